@@ -5,13 +5,13 @@
 
 #define PROJECT_NAME "ModbusTestSrv"
 
-#define MAJOR_VERSION = 0
-#define MINOR_VERSION = 1
-#define BUILD_NUMBER  = 56
+#define MAJOR_VERSION 0
+#define MINOR_VERSION 1
+#define BUILD_NUMBER 56
 
-#define VERSION_STRING = "0.1.56"
-#define BUILD_DATE = __DATE__
-#define BUILD_TIME = __TIME__
+#define VERSION_STRING "0.1.56"
+#define BUILD_DATE __DATE__
+#define BUILD_TIME __TIME__
 
 // Function to get full version info
 inline std::string get_version_info() {
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of install trees, used by Makefiles made with generator.py --cache
+Usage: python artifact_cache.py restore --cache DIR --key-file KEY [--key-file DEP_KEY ...] [--part TEXT ...] --dest DIR
+       python artifact_cache.py store --cache DIR --key-file KEY [...] --src DIR [--max-size 10G]
+       python artifact_cache.py prune --cache DIR [--max-size 10G]
+
+An entry is keyed by the generated key files (submodule commit + build recipe hash, the
+dependencies' keys after it), extra parts such as the URL, the compiler versions and the
+install path (pkg-config and CMake package files embed it). Restores hardlink the cached
+files (copy across file systems), so cached files are kept read-only.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+SIZE_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_size(text: str) -> int:
+    """'10G', '512M' or plain bytes"""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+def compiler_version() -> str:
+    """First --version line of the C and C++ compilers, another compiler makes another artifact"""
+    lines = []
+    for var, default in (('CC', 'cc'), ('CXX', 'c++')):
+        try:
+            out = subprocess.run(os.environ.get(var, default).split() + ['--version'],
+                                 capture_output=True, text=True, timeout=30).stdout
+        except (OSError, subprocess.SubprocessError):
+            out = ""
+        lines.append(out.splitlines()[0] if out else "")
+    return "\n".join(lines)
+
+def artifact_key(key_files: List[str], parts: List[str], install_dir: str) -> Optional[str]:
+    """Cache key, None when a submodule has no commit to pin it to"""
+    digest = hashlib.sha256()
+    for key_file in key_files:
+        with open(key_file) as f:
+            build_key = f.read().split()
+        if len(build_key) < 2:  # "<commit> <recipe hash>", no commit: not a git checkout
+            return None
+        digest.update(" ".join(build_key).encode() + b"\n")
+    for part in parts + [compiler_version(), os.path.abspath(install_dir)]:
+        digest.update(part.encode() + b"\n")
+    return digest.hexdigest()
+
+def link_or_copy(src: str, dst: str):
+    """Hardlink, copy when the cache is on another file system"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def tree_size(path: str) -> int:
+    """Bytes of the regular files below path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            if not os.path.islink(full):
+                total += os.path.getsize(full)
+    return total
+
+def restore(cache: str, key: Optional[str], dest: str) -> bool:
+    """Put the cached tree at dest. On a miss dest is removed, the build installs into a clean
+    directory and never writes through hardlinks of an earlier restore"""
+    entry = os.path.join(cache, key) if key else None
+    if os.path.lexists(dest):
+        shutil.rmtree(dest)
+    if entry is None or not os.path.isdir(os.path.join(entry, 'tree')):
+        return False
+    shutil.copytree(os.path.join(entry, 'tree'), dest, symlinks=True, copy_function=link_or_copy)
+    os.utime(entry)  # most recently used
+    return True
+
+def store(cache: str, key: Optional[str], src: str, max_bytes: int):
+    """Add src under key (first writer wins), then evict down to max_bytes"""
+    if key is None or not os.path.isdir(src):
+        return
+    entry = os.path.join(cache, key)
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return
+    os.makedirs(cache, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=cache)
+    try:
+        shutil.copytree(src, os.path.join(tmp, 'tree'), symlinks=True)
+        for root, _, files in os.walk(os.path.join(tmp, 'tree')):
+            for name in files:
+                full = os.path.join(root, name)
+                if not os.path.islink(full):
+                    os.chmod(full, os.stat(full).st_mode & ~0o222)
+        with open(os.path.join(tmp, 'size'), 'w') as f:
+            f.write(str(tree_size(os.path.join(tmp, 'tree'))))
+        os.rename(tmp, entry)
+    except OSError:
+        pass  # another build stored the same key first, or the cache is unusable: only caching is lost
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    prune(cache, max_bytes)
+
+def prune(cache: str, max_bytes: int):
+    """Evict least recently used entries until the cache fits, and leftovers of crashed stores"""
+    if not os.path.isdir(cache):
+        return
+    entries = []
+    for name in os.listdir(cache):
+        path = os.path.join(cache, name)
+        if name.startswith('.tmp-'):
+            if time.time() - os.path.getmtime(path) > 24 * 3600:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            with open(os.path.join(path, 'size')) as f:
+                size = int(f.read())
+        except (OSError, ValueError):
+            size = tree_size(path)
+        entries.append((os.path.getmtime(path), size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed cache of install trees')
+    parser.add_argument('action', choices=['restore', 'store', 'prune'])
+    parser.add_argument('--cache', required=True, help='Cache directory')
+    parser.add_argument('--key-file', action='append', default=[], help='Key file of the build, then of its dependencies')
+    parser.add_argument('--part', action='append', default=[], help='Extra text the artifact depends on')
+    parser.add_argument('--dest', help='Install tree to restore')
+    parser.add_argument('--src', help='Install tree to store')
+    parser.add_argument('--max-size', default='10G', help='Cache size bound, least recently used entries go first')
+
+    args = parser.parse_args()
+
+    if args.action == 'prune':
+        prune(args.cache, parse_size(args.max_size))
+        return
+
+    tree = args.dest if args.action == 'restore' else args.src
+    if not args.key_file or not tree:
+        parser.error(f"{args.action} needs --key-file and --{'dest' if args.action == 'restore' else 'src'}")
+    key = artifact_key(args.key_file, args.part, tree)
+
+    if args.action == 'restore':
+        sys.exit(0 if restore(args.cache, key, args.dest) else 1)
+    store(args.cache, key, args.src, parse_size(args.max_size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Phase timing of the builds in a Makefile made with generator.py --timing
+Usage: python build_timing.py mark --dir DIR --lib glog --flavour local --phase configure
+       python build_timing.py report --dir DIR --lib gflags= --lib glog=gflags [--out report.json]
+
+Every mark starts a phase (fetch, restore, configure, compile, install) of one library and
+ends the one before it, phase '-' just ends it. Marks are appended to DIR/<lib>.<flavour>.events
+as "<unix time> <phase>" lines; the report takes the latest complete run of every phase.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+PHASES = ['fetch', 'restore', 'configure', 'compile', 'install']
+
+def mark(directory: str, lib: str, flavour: str, phase: str):
+    """Append one mark, a single short write so parallel libraries don't interleave"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{lib}.{flavour}.events"), 'a') as f:
+        f.write(f"{time.time():.6f} {phase}\n")
+
+def read_phases(path: str) -> Dict[str, Tuple[float, float]]:
+    """(start, end) of every phase of the last complete run in one events file: a cache hit
+    doesn't inherit the compile time of an earlier miss, a run still going is left out"""
+    last_run = {}
+    run = {}
+    with open(path) as f:
+        events = [line.split() for line in f if len(line.split()) == 2]
+    for (start, phase), (end, _) in zip(events, events[1:] + [(None, None)]):
+        if phase == '-':
+            if run:
+                last_run, run = run, {}
+        elif end is not None:
+            run[phase] = (float(start), float(end))
+    return last_run
+
+def library_phases(directory: str, lib: str) -> Dict[str, Tuple[float, float]]:
+    """Fetch plus the phases of the most recently built flavour of lib"""
+    fetch = os.path.join(directory, f"{lib}.fetch.events")
+    builds = [os.path.join(directory, name) for name in os.listdir(directory)
+              if name.startswith(f"{lib}.") and name.endswith(".events") and name != f"{lib}.fetch.events"]
+    phases = read_phases(fetch) if os.path.exists(fetch) else {}
+    if builds:
+        phases.update(read_phases(max(builds, key=os.path.getmtime)))
+    return phases
+
+def critical_path(graph: Dict[str, List[str]], seconds: Dict[str, float]) -> Tuple[List[str], float]:
+    """Longest chain of dependencies, weighted by the time every library took"""
+    finish = {}
+    before = {}
+
+    def visit(lib: str) -> float:
+        if lib not in finish:
+            deps = [dep for dep in graph.get(lib, []) if dep in graph]
+            slowest = max(deps, key=visit, default=None)
+            before[lib] = slowest
+            finish[lib] = seconds.get(lib, 0.0) + (finish[slowest] if slowest else 0.0)
+        return finish[lib]
+
+    if not graph:
+        return [], 0.0
+    last = max(graph, key=visit)
+    path = []
+    while last:
+        path.append(last)
+        last = before[last]
+    return path[::-1], finish[path[0]]
+
+def report(directory: str, graph: Dict[str, List[str]]) -> Dict:
+    """Per library phase times, the critical path and how much parallel builds could save"""
+    libraries = {}
+    seconds = {}
+    for lib in graph:
+        phases = library_phases(directory, lib) if os.path.isdir(directory) else {}
+        durations = {phase: round(end - start, 3) for phase, (start, end) in phases.items()}
+        seconds[lib] = sum(durations.values())
+        libraries[lib] = {
+            "phases": {phase: durations[phase] for phase in PHASES if phase in durations},
+            "seconds": round(seconds[lib], 3),
+            "dependencies": graph[lib],
+        }
+    path, path_seconds = critical_path(graph, seconds)
+    total = sum(seconds.values())
+    return {
+        "libraries": libraries,
+        "critical_path": path,
+        "critical_path_seconds": round(path_seconds, 3),
+        "serial_seconds": round(total, 3),
+        # what make -jN could get out of the graph at most
+        "max_speedup": round(total / path_seconds, 2) if path_seconds > 0 else None,
+    }
+
+def print_report(data: Dict):
+    """The JSON, readable"""
+    print(f"{'library':20} {'total':>9} " + " ".join(f"{phase:>9}" for phase in PHASES))
+    for lib, info in sorted(data["libraries"].items(), key=lambda item: -item[1]["seconds"]):
+        cells = " ".join(f"{info['phases'][phase]:9.1f}" if phase in info["phases"] else f"{'-':>9}" for phase in PHASES)
+        print(f"{lib:20} {info['seconds']:9.1f} {cells}")
+    print(f"\nCritical path: {' -> '.join(data['critical_path']) or '-'} ({data['critical_path_seconds']:.1f} s"
+          f" of {data['serial_seconds']:.1f} s serial)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Phase timing of generated submodule builds')
+    parser.add_argument('action', choices=['mark', 'report'])
+    parser.add_argument('--dir', required=True, help='Timing directory')
+    parser.add_argument('--lib', action='append', default=[],
+                        help='mark: library name; report: name=dep1,dep2 for every library')
+    parser.add_argument('--flavour', default='system', help='system, local, dev or fetch')
+    parser.add_argument('--phase', help=f"{', '.join(PHASES)} or - to end the current one")
+    parser.add_argument('--out', help='Write the report JSON here too')
+
+    args = parser.parse_args()
+
+    if args.action == 'mark':
+        if len(args.lib) != 1 or not args.phase:
+            parser.error("mark needs one --lib and --phase")
+        mark(args.dir, args.lib[0], args.flavour, args.phase)
+        return
+
+    graph = {}
+    for item in args.lib:
+        name, _, deps = item.partition('=')
+        graph[name] = [dep for dep in deps.split(',') if dep]
+    data = report(args.dir, graph)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(data, f, indent=2)
+    print_report(data)
+    if args.out:
+        print(f"Report saved to: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,14 @@ Makefile Generator for Git Submodules with Different Build Systems
 Usage: python generate_makefile.py [config_file.json]
 """
 
+import copy
+import hashlib
 import json
 import os
 import sys
 import argparse
-from typing import Dict, List, Any
+import shlex
+from typing import Dict, List, Any, Optional
 
 TEMPLATE = """# Generated Makefile for managing submodules with different build systems
 # To regenerate: python {generator_script}
@@ -20,6 +23,11 @@ all: {all_targets}
 # Directory definitions
 {submodule_vars}
 
+# Build targets are stamped ($(<LIB>_BUILD_DIR)/.stamp-<flavour>): they run again only when the
+# submodule commit, the build options or a dependency changed. make clean-<lib> (or make -B) forces it.
+.PHONY: FORCE
+FORCE:
+
 # Submodule management targets
 {submodule_targets}
 
@@ -50,7 +58,7 @@ distclean: clean
 	@echo "Removing all submodules..."
 {distclean_commands}
 
-# Check dependencies
+{report_targets}# Check dependencies
 .PHONY: check-deps
 check-deps:
 	@echo "Checking build dependencies..."
@@ -69,6 +77,8 @@ help:
 	@echo "Available targets:"
 	@echo ""
 	@echo "  all              - Build and install all libraries system-wide"
+	@echo "                     (make -jN builds independent libraries side by side,"
+	@echo "                      up to date libraries are skipped, see clean-<lib>)"
 	@echo "  local            - Build and install all libraries locally"
 	@echo "  submodules       - Only add all submodules"
 	@echo "  update-submodules - Update all submodules to latest"
@@ -88,7 +98,7 @@ help:
 	@echo "  distclean        - Completely remove all libraries including submodules"
 	@echo ""
 	@echo "Utility targets:"
-	@echo "  check-deps       - Check for required build tools"
+{report_help}	@echo "  check-deps       - Check for required build tools"
 	@echo "  install-deps     - Install build dependencies (Ubuntu/Debian)"
 	@echo "  help             - Show this help message"
 """
@@ -113,10 +123,57 @@ class SubmoduleConfig:
 class MakefileGenerator:
     """Generates Makefiles for managing submodules"""
     
-    def __init__(self, configs: List[SubmoduleConfig], output_file: str = "Makefile"):
-        self.configs = configs
+    def __init__(self, configs: List[SubmoduleConfig], output_file: str = "Makefile",
+                 cache_dir: Optional[str] = None, cache_max_size: str = "10G", ccache: bool = False,
+                 timing: bool = False):
+        self.configs = self._build_order(configs)
         self.output_file = output_file
         self.generator_script = os.path.basename(__file__)
+        # local install trees are restored from / stored to cache_dir instead of always being built
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        self.ccache = ccache
+        self.cache_tool = self._tool_path("artifact_cache.py")
+        # every build phase marks its start in $(BUILD_TIMING_DIR), make build-report sums them up
+        self.timing = timing
+        self.timing_tool = self._tool_path("build_timing.py")
+    
+    def _tool_path(self, script: str) -> str:
+        """Helper script next to this one, as the generated Makefile reaches it"""
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        relative = os.path.relpath(path, os.path.dirname(os.path.abspath(self.output_file)))
+        # the usual scripts/ next to the Makefile, keeps the checkout relocatable
+        return path if relative.startswith("..") else relative
+    
+    @staticmethod
+    def _build_order(configs: List[SubmoduleConfig]) -> List[SubmoduleConfig]:
+        """Sort submodules so every one comes after its dependencies (stable otherwise)"""
+        by_name = {config.name: config for config in configs}
+        order = []
+        state = {}  # name -> 'visiting' while its dependencies are walked, 'done' after
+        
+        def visit(config: SubmoduleConfig, path: List[str]):
+            if state.get(config.name) == 'done':
+                return
+            if state.get(config.name) == 'visiting':
+                cycle = path[path.index(config.name):] + [config.name]
+                raise ValueError(f"Dependency cycle: {' -> '.join(cycle)}")
+            state[config.name] = 'visiting'
+            for dep in config.dependencies:
+                if dep not in by_name:
+                    raise ValueError(f"{config.name} depends on unknown submodule: {dep}")
+                visit(by_name[dep], path + [config.name])
+            state[config.name] = 'done'
+            order.append(config)
+        
+        for config in configs:
+            visit(config, [])
+        return order
+    
+    @staticmethod
+    def _prerequisites(config: SubmoduleConfig, flavour: str) -> str:
+        """Stamps of the same flavour (system, local, dev) that have to be done first"""
+        return "".join(f" $({dep.upper()}_BUILD_DIR)/.stamp-{flavour}" for dep in config.dependencies)
         
     def generate(self):
         """Generate the complete Makefile"""
@@ -131,6 +188,8 @@ class MakefileGenerator:
             clean_targets=" ".join([f"clean-{config.name}" for config in self.configs]),
             individual_clean_targets=self._generate_individual_clean_targets(),
             distclean_commands=self._generate_distclean_commands(),
+            report_targets=self._generate_report_targets(),
+            report_help='\t@echo "  build-report     - Phase timings and critical path of the last builds"\n' if self.timing else "",
             dependency_checks=self._generate_dependency_checks(),
             apt_dependencies=self._generate_apt_dependencies(),
             system_targets_help=self._generate_system_targets_help(),
@@ -151,6 +210,21 @@ class MakefileGenerator:
         for config in self.configs:
             lines.append(f"{config.name.upper()}_DIR ?= {config.directory}")
             lines.append(f"{config.name.upper()}_BUILD_DIR = $({config.name.upper()}_DIR)/build")
+        if self.cache_dir:
+            lines.append("")
+            lines.append("# Artifact cache: local install trees keyed by commit, options, dependencies and compiler")
+            lines.append(f"ARTIFACT_CACHE ?= {self.cache_dir}")
+            lines.append(f"ARTIFACT_CACHE_MAX ?= {self.cache_max_size}")
+            lines.append(f"ARTIFACT_CACHE_TOOL ?= python3 {self.cache_tool}")
+        if self.timing:
+            lines.append("")
+            lines.append("# Phase timing of every build, see make build-report")
+            lines.append("BUILD_TIMING_DIR ?= .build-timing")
+            lines.append(f"BUILD_TIMING_TOOL ?= python3 {self.timing_tool}")
+        if self.ccache:
+            lines.append("")
+            lines.append("# Compiler launcher for cache misses, empty = plain compiler")
+            lines.append("CCACHE ?= $(shell command -v ccache 2>/dev/null)")
         return "\n".join(lines)
     
     def _generate_submodule_targets(self) -> str:
@@ -162,10 +236,14 @@ class MakefileGenerator:
         targets.append(f"submodules: {' '.join([f'{config.name}-submodule' for config in self.configs])}")
         targets.append("")
         
-        # Individual submodule targets
+        # Individual submodule targets. git locks its index, so under make -j they still run
+        # one after another (order-only chain), the builds behind them don't wait for each other
+        previous = ""
         for config in self.configs:
             targets.append(f".PHONY: {config.name}-submodule")
-            targets.append(f"{config.name}-submodule:")
+            targets.append(f"{config.name}-submodule:{f' | {previous}' if previous else ''}")
+            previous = f"{config.name}-submodule"
+            targets.extend(self._mark(config, "fetch", "fetch"))
             targets.append(f"\t@if [ ! -d \"$({config.name.upper()}_DIR)/.git\" ]; then \\")
             targets.append(f"\t\techo \"Adding {config.name} submodule...\"; \\")
             targets.append(f"\t\tgit submodule add {config.url} $({config.name.upper()}_DIR); \\")
@@ -174,25 +252,48 @@ class MakefileGenerator:
             targets.append(f"\tfi")
             
             # Check for build system files and update if needed
-            if config.build_system == 'cmake':
-                check_file = "CMakeLists.txt"
-            elif config.build_system == 'autoconf':
-                check_file = "configure.ac"
-            elif config.build_system == 'make':
-                check_file = "Makefile"
-            else:  # meson
-                check_file = "meson.build"
-                
+            check_file = self._check_file(config)
             targets.append(f"\t@if [ ! -f \"$({config.name.upper()}_DIR)/{check_file}\" ]; then \\")
             targets.append(f"\t\tgit submodule update --init --recursive $({config.name.upper()}_DIR); \\")
             targets.append(f"\tfi")
+            targets.extend(self._mark(config, "fetch", "-"))
             targets.append("")
         
         return "\n".join(targets)
     
-    def _get_build_commands(self, config: SubmoduleConfig, install_prefix: str, build_type: str = "Release") -> str:
+    @staticmethod
+    def _check_file(config: SubmoduleConfig) -> str:
+        """Build system file that tells whether a submodule is checked out"""
+        if config.build_system == 'cmake':
+            return "CMakeLists.txt"
+        elif config.build_system == 'autoconf':
+            return "configure.ac"
+        elif config.build_system == 'make':
+            return "Makefile"
+        else:  # meson
+            return "meson.build"
+    
+    def _mark(self, config: SubmoduleConfig, flavour: str, phase: str) -> List[str]:
+        """Recipe line starting a timed phase ('-' ends the current one), nothing without --timing"""
+        if not self.timing:
+            return []
+        return [f"\t@$(BUILD_TIMING_TOOL) mark --dir $(BUILD_TIMING_DIR) --lib {config.name} --flavour {flavour} --phase {phase}"]
+    
+    @staticmethod
+    def _dep_prefixes(config: SubmoduleConfig, flavour: str) -> List[str]:
+        """Install trees of the dependencies a local build has to find, system and dev ones are in /usr/local"""
+        if flavour != "local":
+            return []
+        return [f"$(abspath $({dep.upper()}_BUILD_DIR)/install)" for dep in config.dependencies]
+    
+    def _get_build_commands(self, config: SubmoduleConfig, install_prefix: str, build_type: str = "Release",
+                            flavour: str = "system") -> str:
         """Generate build commands for a specific submodule"""
         commands = []
+        if config.build_system != 'make':
+            commands.extend(self._mark(config, flavour, "configure"))
+        dep_prefixes = self._dep_prefixes(config, flavour)
+        pkg_config_path = ":".join(f"{prefix}/lib/pkgconfig:{prefix}/lib64/pkgconfig" for prefix in dep_prefixes)
         
         if config.build_system == 'cmake':
             cmake_options = config.build_options.get('cmake_options', [])
@@ -205,9 +306,14 @@ class MakefileGenerator:
             
             if cmake_flags:
                 base_cmd += f" \\\n\t\t{cmake_flags}"
+            if dep_prefixes:
+                base_cmd += f" \\\n\t\t-DCMAKE_PREFIX_PATH=\"{';'.join(dep_prefixes)}\""
+            if self.ccache:
+                base_cmd += " \\\n\t\t$(if $(CCACHE),-DCMAKE_C_COMPILER_LAUNCHER=$(CCACHE) -DCMAKE_CXX_COMPILER_LAUNCHER=$(CCACHE))"
                 
             commands.append(f"\t{base_cmd}")
-            commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE) -j$$(shell nproc 2>/dev/null || echo 4)")
+            commands.extend(self._mark(config, flavour, "compile"))
+            commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE)")
             
         elif config.build_system == 'autoconf':
             autoconf_options = config.build_options.get('autoconf_options', [])
@@ -219,52 +325,121 @@ class MakefileGenerator:
             commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && \\")
             
             base_cmd = f"../configure \\\n\t\t--prefix={install_prefix} \\\n\t\t--enable-shared \\\n\t\t--disable-static"
+            if self.ccache:
+                base_cmd = f"{self._ccache_env()}{base_cmd}"
+            if dep_prefixes:
+                base_cmd = f"PKG_CONFIG_PATH=\"{pkg_config_path}$${{PKG_CONFIG_PATH:+:$$PKG_CONFIG_PATH}}\" {base_cmd}"
+                includes = " ".join(f"-I{prefix}/include" for prefix in dep_prefixes)
+                libs = " ".join(f"-L{prefix}/lib" for prefix in dep_prefixes)
+                base_cmd += f" \\\n\t\tCPPFLAGS=\"{includes}\" LDFLAGS=\"{libs}\""
             
             if configure_flags:
                 base_cmd += f" \\\n\t\t{configure_flags}"
                 
             commands.append(f"\t{base_cmd}")
-            commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE) -j$$(shell nproc 2>/dev/null || echo 4)")
+            commands.extend(self._mark(config, flavour, "compile"))
+            commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE)")
             
         elif config.build_system == 'make':
             make_options = config.build_options.get('make_options', {})
             env_vars = " ".join([f"{k}={v}" for k, v in make_options.items()])
             
+            commands.extend(self._mark(config, flavour, "compile"))
             commands.append(f"\tcd $({config.name.upper()}_DIR) && \\")
             if env_vars:
-                commands.append(f"\t{env_vars} $(MAKE) -j$$(shell nproc 2>/dev/null || echo 4)")
+                commands.append(f"\t{env_vars} $(MAKE)")
             else:
-                commands.append(f"\t$(MAKE) -j$$(shell nproc 2>/dev/null || echo 4)")
+                commands.append(f"\t$(MAKE)")
                 
         elif config.build_system == 'meson':
             meson_options = config.build_options.get('meson_options', [])
+            if dep_prefixes:
+                meson_options = meson_options + [f"cmake_prefix_path={','.join(dep_prefixes)}",
+                                                 f"pkg_config_path={pkg_config_path.replace(':', ',')}"]
             meson_flags = " ".join([f"-D{opt}" for opt in meson_options])
             
             commands.append(f"\t@mkdir -p $({config.name.upper()}_BUILD_DIR)")
             commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && \\")
-            commands.append(f"\tmeson setup .. --buildtype={build_type.lower()} --prefix={install_prefix} {meson_flags}")
-            commands.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && ninja")
+            commands.append(f"\t{self._ccache_env() if self.ccache else ''}meson setup .. --buildtype={build_type.lower()} --prefix={install_prefix} {meson_flags}")
+            commands.extend(self._mark(config, flavour, "compile"))
+            # '+' hands ninja the jobserver (ninja >= 1.13 joins it, older ones ignore it)
+            commands.append(f"\t+cd $({config.name.upper()}_BUILD_DIR) && ninja")
         
         return "\n".join(commands)
     
+    def _stamp(self, config: SubmoduleConfig, flavour: str) -> str:
+        """Stamp file of a finished build + install of one flavour (system, local, dev)"""
+        return f"$({config.name.upper()}_BUILD_DIR)/.stamp-{flavour}"
+    
+    def _stamped_target(self, config: SubmoduleConfig, flavour: str, alias: str, recipe: List[str],
+                        install_dir: Optional[str] = None) -> List[str]:
+        """Wrap a build recipe in stamp rules so it only runs again when something it depends on changed.
+        
+        The key file holds the submodule HEAD commit and a hash of the recipe (build system, options,
+        prefix, build type); it is rewritten only when that changes, so make compares its mtime with
+        the stamp. Stamps of dependencies are prerequisites too: a rebuilt gflags rebuilds glog.
+        With an artifact cache and an install_dir the stamp first tries to restore install_dir from
+        the cache and only runs the recipe (as <alias>-build, which stores the result) on a miss.
+        """
+        name = config.name.upper()
+        recipe_text = "\n".join(recipe)
+        # timing marks don't change what gets built, switching --timing must not rebuild everything
+        hashed = "\n".join(line for line in recipe_text.split("\n") if "$(BUILD_TIMING_TOOL)" not in line)
+        recipe_hash = hashlib.sha1(f"{config.build_system}\n{hashed}".encode()).hexdigest()[:16]
+        key = f"$({name}_BUILD_DIR)/.key-{flavour}"
+        stamp = self._stamp(config, flavour)
+        rule = [
+            f".PHONY: {alias}",
+            f"{alias}: {stamp}",
+            "",
+            f"{key}: FORCE | {config.name}-submodule",
+            f"\t@mkdir -p $({name}_BUILD_DIR)",
+            f"\t@echo \"$$(git -C $({name}_DIR) rev-parse HEAD 2>/dev/null) {recipe_hash}\" > $@.tmp",
+            f"\t@cmp -s $@.tmp $@ && rm -f $@.tmp || mv -f $@.tmp $@",
+            "",
+            f"{stamp}: {key}{self._prerequisites(config, flavour)}",
+        ]
+        if not (self.cache_dir and install_dir):
+            return rule + [recipe_text, "\t@touch $@"]
+        
+        cache_args = f"--cache $(ARTIFACT_CACHE) --key-file {key}"
+        cache_args += "".join(f" --key-file $({dep.upper()}_BUILD_DIR)/.key-{flavour}" for dep in config.dependencies)
+        cache_args += f" --part {shlex.quote(config.url)}"
+        return rule + self._mark(config, flavour, "restore") + [
+            f"\t@$(ARTIFACT_CACHE_TOOL) restore {cache_args} --dest {install_dir} \\",
+            f"\t\t&& echo \"{config.name} restored from $(ARTIFACT_CACHE)\" \\",
+            f"\t\t|| $(MAKE) --no-print-directory {alias}-build",
+        ] + self._mark(config, flavour, "-") + [
+            "\t@touch $@",
+            "",
+            f".PHONY: {alias}-build",
+            f"{alias}-build:",
+            recipe_text,
+            f"\t@$(ARTIFACT_CACHE_TOOL) store {cache_args} --src {install_dir} --max-size $(ARTIFACT_CACHE_MAX)",
+        ]
+    
+    @staticmethod
+    def _ccache_env() -> str:
+        """Compiler variables for configure scripts that don't know about launchers"""
+        return "$(if $(CCACHE),CC=\"$(CCACHE) $${CC:-cc}\" CXX=\"$(CCACHE) $${CXX:-c++}\" )"
+    
     def _generate_build_targets(self) -> str:
         """Generate build targets for system-wide installation"""
         targets = []
         
         for config in self.configs:
-            targets.append(f".PHONY: {config.name}")
-            targets.append(f"{config.name}: {config.name}-submodule")
-            targets.append(f"\t@echo \"Building and installing {config.name}...\"")
-            
-            commands = self._get_build_commands(config, "/usr/local", "Release")
-            targets.append(commands)
+            recipe = [f"\t@echo \"Building and installing {config.name}...\""]
+            recipe.append(self._get_build_commands(config, "/usr/local", "Release"))
+            recipe.extend(self._mark(config, "system", "install"))
             
             if config.build_system in ['cmake', 'autoconf', 'meson']:
-                targets.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
+                recipe.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
             elif config.build_system == 'make':
-                targets.append(f"\tcd $({config.name.upper()}_DIR) && sudo $(MAKE) install")
+                recipe.append(f"\tcd $({config.name.upper()}_DIR) && sudo $(MAKE) install")
                 
-            targets.append(f"\t@echo \"{config.name} installed successfully\"")
+            recipe.extend(self._mark(config, "system", "-"))
+            recipe.append(f"\t@echo \"{config.name} installed successfully\"")
+            targets.extend(self._stamped_target(config, "system", config.name, recipe))
             targets.append("")
         
         return "\n".join(targets)
@@ -281,22 +456,27 @@ class MakefileGenerator:
         
         # Individual local targets
         for config in self.configs:
-            targets.append(f".PHONY: {config.name}-local")
-            targets.append(f"{config.name}-local: {config.name}-submodule")
-            targets.append(f"\t@echo \"Building and installing {config.name} locally...\"")
+            recipe = [f"\t@echo \"Building and installing {config.name} locally...\""]
             
             if config.build_system in ['cmake', 'autoconf', 'meson']:
+                install_dir = f"$({config.name.upper()}_BUILD_DIR)/install"
                 install_prefix = f"$$(pwd)/install"
-                commands = self._get_build_commands(config, install_prefix, "Release")
-                targets.append(commands)
-                targets.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE) install")
-                targets.append(f"\t@echo \"{config.name} installed to: $({config.name.upper()}_BUILD_DIR)/install\"")
+                recipe.append(self._get_build_commands(config, install_prefix, "Release", "local"))
+                recipe.extend(self._mark(config, "local", "install"))
+                recipe.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && $(MAKE) install")
+                recipe.extend(self._mark(config, "local", "-"))
+                recipe.append(f"\t@echo \"{config.name} installed to: $({config.name.upper()}_BUILD_DIR)/install\"")
             elif config.build_system == 'make':
-                targets.append(f"\t@echo \"Note: make build system may not support local installation\"")
-                targets.append(f"\tcd $({config.name.upper()}_DIR) && \\")
-                targets.append(f"\t$(MAKE) -j$$(shell nproc 2>/dev/null || echo 4) PREFIX=$$(pwd)/install")
-                targets.append(f"\tcd $({config.name.upper()}_DIR) && $(MAKE) PREFIX=$$(pwd)/install install")
+                install_dir = f"$({config.name.upper()}_DIR)/install"
+                recipe.append(f"\t@echo \"Note: make build system may not support local installation\"")
+                recipe.extend(self._mark(config, "local", "compile"))
+                recipe.append(f"\tcd $({config.name.upper()}_DIR) && \\")
+                recipe.append(f"\t$(MAKE) PREFIX=$$(pwd)/install")
+                recipe.extend(self._mark(config, "local", "install"))
+                recipe.append(f"\tcd $({config.name.upper()}_DIR) && $(MAKE) PREFIX=$$(pwd)/install install")
+                recipe.extend(self._mark(config, "local", "-"))
                 
+            targets.extend(self._stamped_target(config, "local", f"{config.name}-local", recipe, install_dir))
             targets.append("")
         
         return "\n".join(targets)
@@ -306,26 +486,44 @@ class MakefileGenerator:
         targets = []
         
         for config in self.configs:
-            targets.append(f".PHONY: {config.name}-dev")
-            targets.append(f"{config.name}-dev: {config.name}-submodule")
-            targets.append(f"\t@echo \"Building {config.name} with debug symbols...\"")
+            recipe = [f"\t@echo \"Building {config.name} with debug symbols...\""]
             
             if config.build_system == 'cmake':
-                commands = self._get_build_commands(config, "/usr/local", "Debug")
-                targets.append(commands)
-                targets.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
+                recipe.append(self._get_build_commands(config, "/usr/local", "Debug", "dev"))
+                recipe.extend(self._mark(config, "dev", "install"))
+                recipe.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
+                recipe.extend(self._mark(config, "dev", "-"))
             elif config.build_system == 'autoconf':
-                config.build_options.setdefault('autoconf_options', []).append('CFLAGS=-g -O0')
-                commands = self._get_build_commands(config, "/usr/local", "Release")
-                targets.append(commands)
-                targets.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
+                # a copy, the debug flags must not leak into the other targets or the saved config
+                debug = copy.copy(config)
+                debug.build_options = dict(config.build_options)
+                debug.build_options['autoconf_options'] = config.build_options.get('autoconf_options', []) + ['CFLAGS=-g -O0']
+                recipe.append(self._get_build_commands(debug, "/usr/local", "Release", "dev"))
+                recipe.extend(self._mark(config, "dev", "install"))
+                recipe.append(f"\tcd $({config.name.upper()}_BUILD_DIR) && sudo $(MAKE) install")
+                recipe.extend(self._mark(config, "dev", "-"))
             else:
-                targets.append(f"\t@echo \"Debug build not configured for {config.build_system} build system\"")
+                recipe.append(f"\t@echo \"Debug build not configured for {config.build_system} build system\"")
                 
+            targets.extend(self._stamped_target(config, "dev", f"{config.name}-dev", recipe))
             targets.append("")
         
         return "\n".join(targets)
     
+    def _generate_report_targets(self) -> str:
+        """Generate the build-report target (--timing only)"""
+        if not self.timing:
+            return ""
+        graph = " ".join(f"--lib {config.name}={','.join(config.dependencies)}" for config in self.configs)
+        targets = [
+            "# Phase timings of the last build of every library and the critical path through the graph",
+            ".PHONY: build-report",
+            "build-report:",
+            f"\t@$(BUILD_TIMING_TOOL) report --dir $(BUILD_TIMING_DIR) {graph} --out $(BUILD_TIMING_DIR)/report.json",
+            "",
+        ]
+        return "\n".join(targets) + "\n"
+    
     def _generate_individual_clean_targets(self) -> str:
         """Generate individual clean targets"""
         targets = []
@@ -389,30 +587,215 @@ class MakefileGenerator:
         """Generate help text for system targets"""
         lines = []
         for config in self.configs:
-            lines.append(f"  {config.name:15} - Build and install {config.name} (requires sudo)")
+            lines.append(f"\t@echo \"  {config.name:15} - Build and install {config.name} (requires sudo)\"")
         return "\n".join(lines)
     
     def _generate_local_targets_help(self) -> str:
         """Generate help text for local targets"""
         lines = []
         for config in self.configs:
-            lines.append(f"  {config.name + '-local':15} - Build and install {config.name} locally")
+            lines.append(f"\t@echo \"  {config.name + '-local':15} - Build and install {config.name} locally\"")
         return "\n".join(lines)
     
     def _generate_dev_targets_help(self) -> str:
         """Generate help text for dev targets"""
         lines = []
         for config in self.configs:
-            lines.append(f"  {config.name + '-dev':15} - Build {config.name} with debug symbols")
+            lines.append(f"\t@echo \"  {config.name + '-dev':15} - Build {config.name} with debug symbols\"")
         return "\n".join(lines)
     
     def _generate_clean_targets_help(self) -> str:
         """Generate help text for clean targets"""
         lines = []
         for config in self.configs:
-            lines.append(f"  clean-{config.name:10} - Remove {config.name} build files")
+            lines.append(f"\t@echo \"  clean-{config.name:10} - Remove {config.name} build files\"")
         return "\n".join(lines)
 
+class NinjaGenerator(MakefileGenerator):
+    """Generates a build.ninja for the same submodules: every step has real outputs, ninja tracks
+    command lines (changed options rerun just the steps they affect) and restat keeps a
+    configure that didn't change anything from cascading. CMake and meson build with Ninja here."""
+    
+    def __init__(self, configs: List[SubmoduleConfig], output_file: str = "build.ninja",
+                 config_file: Optional[str] = None, configure_jobs: int = 2, compile_jobs: int = 2):
+        super().__init__(configs, output_file)
+        self.config_file = config_file
+        self.configure_jobs = configure_jobs
+        self.compile_jobs = compile_jobs
+    
+    @staticmethod
+    def _escape(command: str) -> str:
+        """Shell command as a ninja value"""
+        return command.replace("$", "$$")
+    
+    @staticmethod
+    def _build_dir(config: SubmoduleConfig, flavour: str) -> str:
+        """Own build dir per flavour, CMake won't switch generators in the Makefile's build dir"""
+        return f"{config.build_dir}/ninja-{flavour}"
+    
+    def _steps(self, config: SubmoduleConfig, flavour: str) -> List[tuple]:
+        """(rule, output, implicit inputs, command) of configure, compile and install for one flavour
+        (local, system, dev: a debug build installed to /usr/local)"""
+        src = config.directory
+        bdir = self._build_dir(config, flavour)
+        head = f"{config.build_dir}/ninja.head"
+        local = flavour == "local"
+        prefix = f"$PWD/{bdir}/install" if local else "/usr/local"
+        debug = flavour == "dev"
+        build_type = "Debug" if debug else "Release"
+        sudo = "" if local else "sudo "
+        install_rule = "install" if local else "sudo_install"
+        deps = [f"{self._build_dir(dep, flavour)}/.installed" for dep in self.configs if dep.name in config.dependencies]
+        # local dependencies are found in their install trees, system ones in /usr/local
+        dep_prefixes = [f"$PWD/{self._build_dir(dep, flavour)}/install" for dep in self.configs
+                        if local and dep.name in config.dependencies]
+        pkg_config_path = ":".join(f"{p}/lib/pkgconfig:{p}/lib64/pkgconfig" for p in dep_prefixes)
+        built, installed = f"{bdir}/.built", f"{bdir}/.installed"
+        steps = []
+        
+        if config.build_system == 'cmake':
+            options = "".join(f" -D{shlex.quote(opt)}" for opt in config.build_options.get('cmake_options', []))
+            if dep_prefixes:
+                options += f" -DCMAKE_PREFIX_PATH=\"{';'.join(dep_prefixes)}\""
+            steps.append(("configure", f"{bdir}/build.ninja", [head] + deps,
+                          f"cmake -G Ninja -S {src} -B {bdir} -DCMAKE_BUILD_TYPE={build_type} -DCMAKE_INSTALL_PREFIX={prefix} -DBUILD_SHARED_LIBS=ON{options}"))
+            steps.append(("compile", built, [f"{bdir}/build.ninja", head] + deps, f"cmake --build {bdir} && touch {built}"))
+            steps.append((install_rule, installed, [built], f"{sudo}cmake --install {bdir} && touch {installed}"))
+        
+        elif config.build_system == 'autoconf':
+            options = "".join(f" --{shlex.quote(opt)}" for opt in config.build_options.get('autoconf_options', []))
+            if debug:
+                options += " CFLAGS='-g -O0'"
+            env = ""
+            if dep_prefixes:
+                options += (f" CPPFLAGS=\"{' '.join(f'-I{p}/include' for p in dep_prefixes)}\""
+                            f" LDFLAGS=\"{' '.join(f'-L{p}/lib' for p in dep_prefixes)}\"")
+                env = f"PKG_CONFIG_PATH=\"{pkg_config_path}${{PKG_CONFIG_PATH:+:$PKG_CONFIG_PATH}}\" "
+            steps.append(("configure", f"{bdir}/Makefile", [f"{src}/configure", head] + deps,
+                          f"root=$PWD && mkdir -p {bdir} && cd {bdir} && {env}$root/{src}/configure --prefix={prefix} --enable-shared --disable-static{options}"
+                          .replace("$PWD/", "$root/")))
+            steps.append(("compile", built, [f"{bdir}/Makefile", head] + deps, f"make -C {bdir} && touch {built}"))
+            steps.append((install_rule, installed, [built], f"{sudo}make -C {bdir} install && touch {installed}"))
+        
+        elif config.build_system == 'meson':
+            options = "".join(f" -D{shlex.quote(opt)}" for opt in config.build_options.get('meson_options', []))
+            if dep_prefixes:
+                options += f" -Dcmake_prefix_path={','.join(dep_prefixes)} -Dpkg_config_path={pkg_config_path.replace(':', ',')}"
+            steps.append(("configure", f"{bdir}/build.ninja", [head] + deps,
+                          f"meson setup {bdir} {src} --buildtype={build_type.lower()} --prefix={prefix}{options}"
+                          f" $([ -d {bdir}/meson-private ] && echo --reconfigure)"))
+            steps.append(("compile", built, [f"{bdir}/build.ninja", head] + deps, f"meson compile -C {bdir} && touch {built}"))
+            steps.append((install_rule, installed, [built], f"{sudo}meson install --no-rebuild -C {bdir} && touch {installed}"))
+        
+        else:  # make, builds in its source tree, dev is a plain build (no known debug switch)
+            env_vars = "".join(f" {shlex.quote(f'{k}={v}')}" for k, v in config.build_options.get('make_options', {}).items())
+            make_prefix = f" PREFIX=$PWD/{bdir}/install" if local else ""
+            steps.append(("compile", built, [head] + deps, f"make -C {src}{env_vars}{make_prefix} && mkdir -p {bdir} && touch {built}"))
+            steps.append((install_rule, installed, [built], f"{sudo}make -C {src}{env_vars}{make_prefix} install && touch {installed}"))
+        
+        return steps
+    
+    def generate(self):
+        """Generate the complete build.ninja"""
+        lines = [
+            "# Generated build.ninja for managing submodules with different build systems",
+            f"# To regenerate: python {self.generator_script} --backend ninja",
+            "ninja_required_version = 1.5",
+            "",
+            "# configure steps are mostly serial shell and compiler probing, a few side by side is plenty",
+            "pool configure",
+            f"  depth = {self.configure_jobs}",
+            "# every compile step is a parallel build of its own, this many of them side by side",
+            "pool compile",
+            f"  depth = {self.compile_jobs}",
+            "# git locks its index",
+            "pool git",
+            "  depth = 1",
+            "",
+            "rule fetch",
+            "  command = $cmd",
+            "  description = FETCH $name",
+            "  pool = git",
+            "# HEAD commit of a submodule, rewritten only when it moved",
+            "rule head",
+            "  command = git -C $dir rev-parse HEAD > $out.tmp 2>/dev/null; cmp -s $out.tmp $out && rm -f $out.tmp || mv -f $out.tmp $out",
+            "  description = HEAD $name",
+            "  restat = 1",
+            "rule autoreconf",
+            "  command = cd $dir && (autoreconf -f -i 2>/dev/null || autoreconf -i)",
+            "  description = AUTORECONF $name",
+            "  pool = configure",
+            "  restat = 1",
+            "rule configure",
+            "  command = $cmd",
+            "  description = CONFIGURE $name",
+            "  pool = configure",
+            "  restat = 1",
+            "rule compile",
+            "  command = $cmd",
+            "  description = COMPILE $name",
+            "  pool = compile",
+            "rule install",
+            "  command = $cmd",
+            "  description = INSTALL $name",
+            "# sudo may have to ask for a password",
+            "rule sudo_install",
+            "  command = $cmd",
+            "  description = INSTALL $name",
+            "  pool = console",
+            "",
+            "build always: phony",
+            "",
+        ]
+        
+        if self.config_file:
+            output_dir = os.path.dirname(os.path.abspath(self.output_file))
+            script = os.path.relpath(os.path.abspath(__file__), output_dir)
+            config = os.path.relpath(os.path.abspath(self.config_file), output_dir)
+            output = os.path.basename(self.output_file)
+            lines += [
+                "rule regen",
+                f"  command = python3 {script} {config} --backend ninja -o {output} --configure-jobs {self.configure_jobs} --compile-jobs {self.compile_jobs}",
+                "  description = REGENERATE $out",
+                "  generator = 1",
+                f"build {output}: regen {config} {script}",
+                "",
+            ]
+        
+        for config in self.configs:
+            head = f"{config.build_dir}/ninja.head"
+            lines.append(f"# {config.name} ({config.build_system})")
+            lines.append(f"build {config.directory}/.git: fetch")
+            lines.append(f"  name = {config.name}")
+            fetch = (f"if [ ! -e {config.directory}/.git ]; then git submodule add {shlex.quote(config.url)} {config.directory}; fi"
+                     f" && if [ ! -f {config.directory}/{self._check_file(config)} ]; then git submodule update --init --recursive {config.directory}; fi")
+            lines.append(f"  cmd = {self._escape(fetch)}")
+            lines.append(f"build {head}: head | always || {config.directory}/.git")
+            lines.append(f"  name = {config.name}")
+            lines.append(f"  dir = {config.directory}")
+            if config.build_system == 'autoconf':
+                lines.append(f"build {config.directory}/configure: autoreconf {head}")
+                lines.append(f"  name = {config.name}")
+                lines.append(f"  dir = {config.directory}")
+            
+            for flavour, alias in (("local", f"{config.name}-local"), ("system", config.name), ("dev", f"{config.name}-dev")):
+                for rule, output, inputs, command in self._steps(config, flavour):
+                    lines.append(f"build {output}: {rule} | {' '.join(inputs)}")
+                    lines.append(f"  name = {alias}")
+                    lines.append(f"  cmd = {self._escape(command)}")
+                lines.append(f"build {alias}: phony {self._build_dir(config, flavour)}/.installed")
+            lines.append("")
+        
+        lines.append(f"build local: phony {' '.join(f'{config.name}-local' for config in self.configs)}")
+        lines.append(f"build dev: phony {' '.join(f'{config.name}-dev' for config in self.configs)}")
+        lines.append(f"build all: phony {' '.join(config.name for config in self.configs)}")
+        lines.append("default all")
+        
+        with open(self.output_file, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        
+        print(f"build.ninja generated successfully: {self.output_file}")
+
 def load_config_from_json(filename: str) -> List[SubmoduleConfig]:
     """Load configuration from JSON file"""
     with open(filename, 'r') as f:
@@ -449,11 +832,14 @@ def interactive_config() -> List[SubmoduleConfig]:
         if not directory:
             directory = name
         
+        dependencies = input(f"Depends on (comma separated names, empty for none): ").strip()
+        
         config = SubmoduleConfig(
             name=name,
             url=url,
             build_system=build_system,
-            directory=directory
+            directory=directory,
+            dependencies=[dep.strip() for dep in dependencies.split(",") if dep.strip()]
         )
         
         configs.append(config)
@@ -464,10 +850,19 @@ def interactive_config() -> List[SubmoduleConfig]:
 def main():
     parser = argparse.ArgumentParser(description='Generate Makefile for managing git submodules')
     parser.add_argument('config', nargs='?', help='JSON configuration file')
-    parser.add_argument('-o', '--output', default='Makefile', help='Output Makefile name')
+    parser.add_argument('-o', '--output', help='Output file name (default: Makefile, build.ninja)')
     parser.add_argument('-i', '--interactive', action='store_true', help='Interactive mode')
+    parser.add_argument('--cache', metavar='DIR', help='Restore/store local install trees in this artifact cache')
+    parser.add_argument('--cache-max-size', default='10G', help='Artifact cache size bound, e.g. 10G (LRU eviction)')
+    parser.add_argument('--ccache', action='store_true', help='Compile through ccache when it is installed')
+    parser.add_argument('--timing', action='store_true', help='Time every build phase, adds make build-report')
+    parser.add_argument('--backend', choices=['make', 'ninja'], default='make', help='Generate a Makefile or a build.ninja')
+    parser.add_argument('--configure-jobs', type=int, default=2, help='Configure steps run side by side (ninja backend)')
+    parser.add_argument('--compile-jobs', type=int, default=2, help='Submodule builds run side by side (ninja backend)')
     
     args = parser.parse_args()
+    if args.output is None:
+        args.output = 'build.ninja' if args.backend == 'ninja' else 'Makefile'
     
     if args.interactive:
         configs = interactive_config()
@@ -476,12 +871,18 @@ def main():
     else:
         # Example configuration
         configs = [
+            SubmoduleConfig(
+                name="gflags",
+                url="https://github.com/gflags/gflags.git",
+                build_system="cmake"
+            ),
             SubmoduleConfig(
                 name="glog",
                 url="https://github.com/google/glog.git",
                 build_system="cmake",
+                dependencies=["gflags"],
                 build_options={
-                    "cmake_options": ["WITH_GFLAGS=OFF", "WITH_UNWIND=ON"]
+                    "cmake_options": ["WITH_GFLAGS=ON", "WITH_UNWIND=ON"]
                 }
             ),
             SubmoduleConfig(
@@ -498,7 +899,13 @@ def main():
         print("No submodules configured. Exiting.")
         return
     
-    generator = MakefileGenerator(configs, args.output)
+    try:
+        if args.backend == 'ninja':
+            generator = NinjaGenerator(configs, args.output, args.config, args.configure_jobs, args.compile_jobs)
+        else:
+            generator = MakefileGenerator(configs, args.output, args.cache, args.cache_max_size, args.ccache, args.timing)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
     generator.generate()
     
     # Also save configuration to JSON for future reference
@@ -509,6 +916,7 @@ def main():
                 "url": config.url,
                 "build_system": config.build_system,
                 "directory": config.directory,
+                "dependencies": config.dependencies,
                 "build_options": config.build_options
             }
             for config in configs
@@ -521,6 +929,11 @@ def main():
     
     print(f"Configuration saved to: {config_filename}")
     print("\nUsage examples:")
+    if args.backend == 'ninja':
+        print(f"  ninja                       # Build and install all libraries")
+        print(f"  ninja {configs[0].name}-local    # Build and install one library locally")
+        print(f"  ninja local                 # Local installation")
+        return
     print(f"  make all                    # Build and install all libraries")
     print(f"  make {configs[0].name}     # Build and install specific library")
     print(f"  make local                  # Local installation")
@@ -1,104 +1,149 @@
 #pragma once
 
-#include <queue>
-#include <mutex>
+#include <algorithm>
 #include <atomic>
-#include <condition_variable>
+#include <cstdint>
+#include <cstring>
 
-/// @attention in fact all this class is usles and should be wiped out to finaly be replased by std::tuple<char,uint,uint>
-/// @brief stores std::atomic<uint16_t> in dequeue (nearest vector analogue 4 copy/move haters)
+/// @brief one register task (read or write some registers) and its result, fixed size, never allocates.
+/// The submitting side fills it, hands the pointer over (SpscQueue<DataBucket *, N>), the executing side
+/// fills the values and calls complete(). Completion is one atomic store plus an optional callback,
+/// waiters sleep on a shared wake word (std::atomic::wait), so thousands of tasks can be in flight
+/// without a mutex and a condition variable each.
+///
+/// Lifetime: the waiter owns the bucket and may free or reuse it as soon as it sees the result, so
+/// complete() touches nothing of the bucket after storing the result. The wake-up goes through a
+/// static word picked by the bucket address, which outlives every bucket.
 class DataBucket
 {
+public:
+
+    /// @brief room for 125 registers (max read) or 2000 bits packed 16 per element, LSB first
+    static constexpr uint16_t CAPACITY = 125;
+    static constexpr uint16_t MAX_BITS = CAPACITY * 16;
+
+    /// @brief lower case opCodes work on bits ('c' coils, 'd' discrete inputs, 'w' write coils),
+    /// upper case on registers ('R' input, 'H' holding, 'W' write holding)
+    static constexpr bool bits(const char & op) {return op >= 'a' && op <= 'z';}
+
+    /// @brief completion callback, runs on the executing thread before waiters wake up, must not block
+    using Callback = void (*)(DataBucket & task, int16_t result, void * ctx);
+
+    /// @brief result codes besides modbus exception codes (1..255)
+    enum Status : int16_t
+    {
+        PENDING = -1,
+        OK = 0,
+        /// @brief transport failed (no connection, timeout)
+        FAILED = -2,
+    };
+
 private:
-    
-    /// @brief deprecated
-    std::deque<std::atomic<uint16_t>> data;
 
-    /// @brief going to deprecate
-    std::atomic_bool rdy;
-    DataBucket(DataBucket &) = delete;
+    uint16_t data[CAPACITY] = {};
+    std::atomic<int16_t> status{PENDING};
+    Callback cb = nullptr;
+    void * cb_ctx = nullptr;
+
+    /// @brief wake words shared by all buckets, bumped on every completion, a waiter may wake for another bucket
+    struct alignas(64) Wake
+    {
+        std::atomic<uint32_t> epoch;
+    };
+    static constexpr size_t WAKE_SLOTS = 64;
+    static inline Wake wakes[WAKE_SLOTS];
+
+    inline std::atomic<uint32_t> & wake() const {return wakes[((uintptr_t)this / alignof(DataBucket)) % WAKE_SLOTS].epoch;}
 
 public:
+
     char opCode;
     uint16_t startReg, qty;
-    std::mutex _data_mutex;
-    std::condition_variable _task_pending;
-    
-    
+
     /// @brief cumstructor or smth
     /// @param code operation code
     /// @param start startReg
     /// @param num numregs
-    DataBucket(const char& code, const uint16_t& start, const uint16_t& num) {opCode = code; startReg = start; qty = num;} 
+    DataBucket(const char & code, const uint16_t & start, const uint16_t & num) : opCode(code), startReg(start), qty(std::min(num, bits(code) ? MAX_BITS : CAPACITY)) {}
+    DataBucket(const DataBucket &) = delete;
     ~DataBucket() = default;
-    
-    inline void set_rdy(bool set) {rdy = set;}
-    inline bool get_rdy() {return (rdy == true);}
-    inline int size() {return data.size();}
-
-    /// @brief sycronized read
-    /// @param out where to read ptr
-    /// @return true on sssssss
-    inline bool read(uint16_t * out) 
+
+    /// @brief runs cb(*this, result, ctx) on completion, set it before submitting
+    inline void then(const Callback & f, void * ctx = nullptr) {cb = f; cb_ctx = ctx;}
+
+    /// @brief makes the task pending again for resubmission, values are kept
+    inline void reset() {status.store(PENDING, std::memory_order_relaxed);}
+
+    /// @brief executing side: runs the callback, then publishes the values and the result and wakes waiters.
+    /// Callback first and no member access after the store, since a waiter may drop the task right away.
+    /// @param code OK, FAILED or a modbus exception code
+    inline void complete(const int16_t & code = OK)
     {
-        int c = 0;
-        std::unique_lock<std::mutex> lk(_data_mutex);
-        _task_pending.wait(lk,[this]{return &rdy;});
-        for (auto &&i : data)
-        {
-            out[c] = i;
-            c++;
-        }
-        lk.unlock();
-        rdy = false;
-        return true;
+        if (cb != nullptr) {cb(*this, code, cb_ctx);}
+        std::atomic<uint32_t> & w = wake();
+        status.store(code);
+        w.fetch_add(1);
+        w.notify_all();
     }
-    
-    /// @brief read as mutex allows
-    /// @param out where to read ptr
-    /// @return true on true
-    inline bool read_tread(uint16_t * out) 
+
+    inline bool get_rdy() const {return status.load(std::memory_order_acquire) != PENDING;}
+    /// @brief OK, FAILED, a modbus exception code or PENDING
+    inline int16_t result() const {return status.load(std::memory_order_acquire);}
+    inline int size() const {return qty;}
+    /// @brief storage elements in use, qty for registers, qty / 16 rounded up for bits
+    inline uint16_t words() const {return bits(opCode) ? (qty + 15) / 16 : qty;}
+
+    /// @brief sleeps until complete()
+    /// @return result()
+    inline int16_t wait() const
     {
-        int c = 0;
-        std::lock_guard<std::mutex> lk(_data_mutex);
-        
-        for (auto &&i : data)
+        std::atomic<uint32_t> & w = wake();
+        for (;;)
         {
-            out[c] = i;
-            c++;
+            // epoch before status: a completion after the status check moves the epoch and ends the wait
+            uint32_t e = w.load();
+            int16_t s = status.load();
+            if (s != PENDING) {return s;}
+            w.wait(e);
         }
-        
-        return true;
     }
 
-    /// @brief writes into bucket of atomic (differs length before)
-    /// @param inp looks like u want to write smth (ptr)
-    /// @param length HOW MUCH WOULD IT STILL?
-    /// @return true on pretty cats birthdays
-    inline bool write(uint16_t * inp, const uint16_t & length) 
-    {   
-        qty = length;
-        std::lock_guard<std::mutex> lk(_data_mutex);
-        for (size_t i = 0; i < qty; i++)
-        {
-            data.emplace_back(inp[i]);
-        }
-        
-        return true;
+    /// @brief waits for completion and copies the values
+    /// @param out at least words() elements
+    /// @return true when the task succeeded
+    inline bool read(uint16_t * out) const
+    {
+        bool ok = wait() == OK;
+        std::memcpy(out, data, words() * sizeof(uint16_t));
+        return ok;
     }
 
-    /// @brief same write but once length is constant
-    /// @param inp write smth on a little peace of paper, give a compiller pointer to it
-    /// @return ftrue onf fevery runf
-    inline bool write(uint16_t * inp) 
-    {   
-        std::lock_guard<std::mutex> lk(_data_mutex);
-        for (size_t i = 0; i < qty; i++)
-        {
-            data.emplace_back(inp[i]);
-        }
-        
+    /// @brief copies whatever is there now, no waiting
+    /// @param out at least words() elements
+    /// @return true if the task is done
+    inline bool read_tread(uint16_t * out) const
+    {
+        bool done = get_rdy();
+        std::memcpy(out, data, words() * sizeof(uint16_t));
+        return done;
+    }
+
+    /// @brief values to write, or the executing side storing what it read
+    /// @param inp values
+    /// @param length new qty, in bits for bit opCodes
+    /// @return false if length is over CAPACITY (MAX_BITS)
+    inline bool write(const uint16_t * inp, const uint16_t & length)
+    {
+        if (length > (bits(opCode) ? MAX_BITS : CAPACITY)) {return false;}
+        qty = length;
+        std::memcpy(data, inp, words() * sizeof(uint16_t));
         return true;
     }
 
-};
\ No newline at end of file
+    /// @brief same write with the current qty
+    inline bool write(const uint16_t * inp) {return write(inp, qty);}
+
+    /// @brief the values in place, executing side only while pending
+    inline uint16_t * values() {return data;}
+    inline const uint16_t * values() const {return data;}
+};
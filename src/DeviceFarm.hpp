@@ -0,0 +1,533 @@
+#pragma once
+
+#include "RegisterStore.hpp"
+#include "MbReply.hpp"
+#include "ServerMetrics.hpp"
+#include "SimEngine.hpp"
+
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/epoll.h>
+#include <sys/socket.h>
+#include <arpa/inet.h>
+#include <netinet/in.h>
+#include <atomic>
+#include <cerrno>
+#include <chrono>
+#include <cstring>
+#include <fstream>
+#include <iterator>
+#include <map>
+#include <memory>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+/// @brief hundreds of simulated slaves in one process: every device has its own RegisterStore and
+/// SimEngine, all of them are served by a few epoll workers and ticked by one thread.
+///
+/// Farm file, device lines open a block, the rules below them are SimEngine rules of that block:
+/// @code
+///   tick_us 1000                 # one tick for every device
+///   workers 2                    # serving threads
+///   device pump ports=1600..1799 unit=any hr=100 ir=100
+///     hr 0..9 sine offset=500 amp=100 period_ms=2000
+///   device meter port=1502 units=1..50 co=16 di=16 hr=20 ir=20 profile=meter.sim
+///     ir 0 counter every_ms=10
+/// @endcode
+/// A block makes one device per (port, unit) pair. unit=any answers every unit id on its port,
+/// otherwise the unit id of the request picks the device; unknown units get exception 0x0B
+/// (gateway target failed to respond). Table sizes default to 20 like dumb_Mserver, a list of
+/// ranges (hr=40000..40099,40200..40210) makes a sparse table, see RegTableSpec.
+///
+/// Every device maps its own RegisterStore, so even an idle device with default tables costs one
+/// 4 KiB page plus its bookkeeping; a sparse table adds 10 KiB of page entries and mask, of which
+/// only the pages that get touched become resident.
+class DeviceFarm
+{
+public:
+
+    /// @brief one simulated slave
+    struct Device
+    {
+        /// @brief index into names()
+        uint32_t block;
+        uint16_t port;
+        /// @brief -1 = any unit
+        int16_t unit;
+        std::unique_ptr<RegisterStore> store;
+        /// @brief nullptr when the block has no rules
+        std::unique_ptr<SimEngine> sim;
+    };
+
+private:
+
+    /// @brief devices behind one listening port
+    struct PortTable
+    {
+        uint16_t port;
+        int fd = -1;
+        Device * any = nullptr;
+        Device * by_unit[256] = {};
+
+        inline Device * lookup(const uint8_t & unit) const {return by_unit[unit] != nullptr ? by_unit[unit] : any;}
+    };
+
+    /// @brief a client, receive buffer holds a handful of pipelined frames
+    struct Conn
+    {
+        PortTable * port;
+        std::shared_ptr<ConnMetrics> metrics;
+        uint8_t in[4096];
+        size_t in_len = 0;
+        /// @brief replies the socket didn't take yet, nothing new is read before they are out
+        std::vector<uint8_t> tail;
+        /// @brief waiting for EPOLLOUT to send the tail instead of EPOLLIN
+        bool wants_out = false;
+    };
+
+    struct Worker
+    {
+        std::thread thread;
+        int efd = -1;
+        ServerMetrics metrics;
+        /// @brief indexed by socket
+        std::vector<std::unique_ptr<Conn>> conns;
+        uint8_t out[16 * 1024];
+    };
+
+    static constexpr int max_events = 64;
+    static constexpr int poll_timeout_ms = 100;
+
+    std::string ip = "127.0.0.1";
+    int nb_workers = 2;
+    std::chrono::microseconds tick{1000};
+
+    std::vector<std::string> blocks;
+    std::vector<std::unique_ptr<Device>> devices;
+    std::map<uint16_t, std::unique_ptr<PortTable>> ports;
+    /// @brief listening socket -> its table, indexed by fd
+    std::vector<PortTable *> listeners;
+
+    std::vector<std::unique_ptr<Worker>> workers;
+    std::thread ticker;
+    std::atomic<bool> running{false};
+
+    static void parse_range(const std::string & s, long & first, long & last)
+    {
+        size_t dots = s.find("..");
+        first = std::stol(s.substr(0, dots));
+        last = dots == std::string::npos ? first : std::stol(s.substr(dots + 2));
+        if (last < first) {throw std::invalid_argument("bad range " + s);}
+    }
+
+    /// @brief table sizes, ports, units and rules of one device line
+    struct Block
+    {
+        std::string name;
+        int line = 0;
+        long port_first = -1, port_last = -1;
+        long unit_first = -1, unit_last = -1;
+        RegTableSpec tables[4] = {RegTableSpec::parse("20"), RegTableSpec::parse("20"), RegTableSpec::parse("20"), RegTableSpec::parse("20")};
+        std::string rules;
+    };
+
+    void add_block(const Block & b)
+    {
+        if (b.port_first < 1 || b.port_last > 65535) {throw std::invalid_argument("device " + b.name + " needs port= or ports= in 1..65535");}
+        if (b.unit_first != -1 && (b.unit_first < 0 || b.unit_last > 255)) {throw std::invalid_argument("device " + b.name + " units out of 0..255");}
+        blocks.push_back(b.name);
+        for (long p = b.port_first; p <= b.port_last; p++)
+        {
+            auto & pt = ports[p];
+            if (pt == nullptr)
+            {
+                pt = std::make_unique<PortTable>();
+                pt->port = p;
+            }
+            for (long u = b.unit_first; u <= b.unit_last; u++)
+            {
+                Device *& slot = u < 0 ? pt->any : pt->by_unit[u];
+                if (slot != nullptr)
+                {
+                    throw std::invalid_argument("device " + b.name + " clashes on port " + std::to_string(p) + " unit " + (u < 0 ? "any" : std::to_string(u)));
+                }
+                auto d = std::make_unique<Device>();
+                d->block = blocks.size() - 1;
+                d->port = p;
+                d->unit = u;
+                d->store = std::make_unique<RegisterStore>(b.tables);
+                if (!b.rules.empty())
+                {
+                    d->sim = std::make_unique<SimEngine>();
+                    d->sim->load_string(b.rules);
+                    d->sim->check(*d->store);
+                }
+                slot = d.get();
+                devices.push_back(std::move(d));
+            }
+        }
+    }
+
+    /// @brief non blocking listener on ip:port
+    /// @throws std::ios_base::failure on socket/bind/listen error
+    int make_listen(const uint16_t & port)
+    {
+        int fd = socket(AF_INET, SOCK_STREAM | SOCK_CLOEXEC | SOCK_NONBLOCK, 0);
+        if (fd == -1)
+        {
+            throw std::ios_base::failure("soc creation FAILED");
+        }
+        int yes = 1;
+        setsockopt(fd, SOL_SOCKET, SO_REUSEADDR, &yes, sizeof(yes));
+        sockaddr_in addr{};
+        addr.sin_family = AF_INET;
+        addr.sin_port = htons(port);
+        if (inet_pton(AF_INET, ip.c_str(), &addr.sin_addr) != 1)
+        {
+            addr.sin_addr.s_addr = htonl(INADDR_ANY);
+        }
+        if (bind(fd, (sockaddr *)&addr, sizeof(addr)) == -1 || listen(fd, SOMAXCONN) == -1)
+        {
+            close(fd);
+            throw std::ios_base::failure("soc bind/listen FAILED on port " + std::to_string(port));
+        }
+        return fd;
+    }
+
+    static std::string peer_of(const int & fd)
+    {
+        sockaddr_in addr{};
+        socklen_t alen = sizeof(addr);
+        char buf[INET_ADDRSTRLEN] = "?";
+        if (getpeername(fd, (sockaddr *)&addr, &alen) == 0)
+        {
+            inet_ntop(AF_INET, &addr.sin_addr, buf, sizeof(buf));
+        }
+        return std::string(buf) + ":" + std::to_string(ntohs(addr.sin_port));
+    }
+
+    void drop(Worker & w, const int & fd)
+    {
+        epoll_ctl(w.efd, EPOLL_CTL_DEL, fd, nullptr);
+        close(fd);
+        w.metrics.close_conn(w.conns[fd]->metrics);
+        w.conns[fd] = nullptr;
+    }
+
+    /// @brief takes every pending connection of a listener, the kernel wakes one worker per accept
+    void accept_all(Worker & w, PortTable & pt)
+    {
+        for (;;)
+        {
+            int cfd = accept4(pt.fd, nullptr, nullptr, SOCK_NONBLOCK | SOCK_CLOEXEC);
+            if (cfd == -1) {return;}
+            if ((size_t)cfd >= w.conns.size()) {w.conns.resize(cfd + 1);}
+            w.conns[cfd] = std::make_unique<Conn>();
+            w.conns[cfd]->port = &pt;
+            w.conns[cfd]->metrics = w.metrics.open_conn(peer_of(cfd));
+            epoll_event ev{};
+            ev.events = EPOLLIN;
+            ev.data.fd = cfd;
+            epoll_ctl(w.efd, EPOLL_CTL_ADD, cfd, &ev);
+        }
+    }
+
+    /// @brief sends buf, what the full socket doesn't take goes to c.tail
+    /// @return false when the client is gone
+    static bool send_or_keep(const int & fd, Conn & c, const uint8_t * buf, const size_t & len)
+    {
+        size_t sent = 0;
+        while (sent < len && c.tail.empty())
+        {
+            ssize_t r = send(fd, buf + sent, len - sent, MSG_NOSIGNAL);
+            if (r > 0) {sent += r; continue;}
+            if (r < 0 && errno == EINTR) {continue;}
+            if (r < 0 && (errno == EAGAIN || errno == EWOULDBLOCK)) {break;}
+            return false;
+        }
+        c.tail.insert(c.tail.end(), buf + sent, buf + len);
+        return true;
+    }
+
+    /// @brief answers every complete frame of one read, replies leave in one send()
+    /// @return false when the client is gone or talks garbage
+    bool serve_conn(Worker & w, const int & fd)
+    {
+        Conn & c = *w.conns[fd];
+        if (!c.tail.empty())
+        {
+            // the client is not reading its replies, don't take more requests from it until it does
+            std::vector<uint8_t> old;
+            old.swap(c.tail);
+            if (!send_or_keep(fd, c, old.data(), old.size())) {return false;}
+            if (!c.tail.empty()) {return true;}
+        }
+        ssize_t r = recv(fd, c.in + c.in_len, sizeof(c.in) - c.in_len, 0);
+        if (r <= 0) {return r < 0 && (errno == EAGAIN || errno == EINTR);}
+        auto t0 = std::chrono::steady_clock::now();
+        c.in_len += r;
+
+        size_t pos = 0, out_len = 0;
+        for (;;)
+        {
+            long flen = mb_frame_length(c.in + pos, c.in_len - pos);
+            if (flen == 0) {break;}
+            if (flen < 0) {return false;}
+            if (sizeof(w.out) - out_len < MB_MAX_ADU_LENGTH)
+            {
+                if (!send_or_keep(fd, c, w.out, out_len)) {return false;}
+                out_len = 0;
+            }
+            const uint8_t * q = c.in + pos;
+            uint8_t * rsp = w.out + out_len;
+            Device * d = c.port->lookup(q[6]);
+            size_t n = d != nullptr ? mb_reply_adu(*d->store, q, flen, rsp) : mb_exception_adu(q, MB_EX_GATEWAY_TARGET_FAILED, rsp);
+            uint64_t ns = std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - t0).count();
+            w.metrics.record(q[MB_MBAP_LENGTH], rsp[MB_MBAP_LENGTH] & 0x80, ns, flen, n, c.metrics.get());
+            out_len += n;
+            pos += flen;
+        }
+        if (out_len && !send_or_keep(fd, c, w.out, out_len)) {return false;}
+        c.in_len -= pos;
+        if (c.in_len > 0 && pos > 0) {std::memmove(c.in, c.in + pos, c.in_len);}
+        return true;
+    }
+
+    void serve(Worker & w)
+    {
+        epoll_event events[max_events];
+        while (running)
+        {
+            int n = epoll_wait(w.efd, events, max_events, poll_timeout_ms);
+            for (int i = 0; i < n; i++)
+            {
+                int fd = events[i].data.fd;
+                if ((size_t)fd < listeners.size() && listeners[fd] != nullptr)
+                {
+                    accept_all(w, *listeners[fd]);
+                }
+                else if (!serve_conn(w, fd))
+                {
+                    drop(w, fd);
+                }
+                else if (Conn & c = *w.conns[fd]; c.wants_out != !c.tail.empty())
+                {
+                    // replies left over: wait until the socket takes them, reading resumes after that
+                    c.wants_out = !c.tail.empty();
+                    epoll_event ev{};
+                    ev.events = c.wants_out ? EPOLLOUT : EPOLLIN;
+                    ev.data.fd = fd;
+                    epoll_ctl(w.efd, EPOLL_CTL_MOD, fd, &ev);
+                }
+            }
+        }
+        for (size_t fd = 0; fd < w.conns.size(); fd++)
+        {
+            if (w.conns[fd] != nullptr) {drop(w, fd);}
+        }
+    }
+
+    void tick_loop()
+    {
+        auto t0 = std::chrono::steady_clock::now();
+        auto next = t0;
+        while (running)
+        {
+            double us = std::chrono::duration<double, std::micro>(next - t0).count();
+            for (auto &&d : devices)
+            {
+                if (d->sim != nullptr) {d->sim->step(*d->store, us);}
+            }
+            next += tick;
+            std::this_thread::sleep_until(next);
+        }
+    }
+
+public:
+
+    DeviceFarm() = default;
+    DeviceFarm(const DeviceFarm &) = delete;
+    ~DeviceFarm() {stop();}
+
+    /// @brief reads a farm file and creates its devices (maps zeroed, rules checked against them)
+    /// @throws std::invalid_argument with the line number on bad lines, std::out_of_range when
+    /// rules touch registers outside a device map, std::ios_base::failure on unreadable profile=
+    void load(std::istream & in)
+    {
+        std::vector<Block> found;
+        std::string line;
+        int nr = 0;
+        try
+        {
+            while (std::getline(in, line))
+            {
+                nr++;
+                std::string body = line.substr(0, line.find('#'));
+                std::stringstream ls(body);
+                std::string word, tok;
+                if (!(ls >> word)) {continue;}
+                if (word == "tick_us" || word == "workers")
+                {
+                    long v = 0;
+                    if (!(ls >> v) || v <= 0) {throw std::invalid_argument(word + " wants a positive number");}
+                    if (word == "tick_us") {tick = std::chrono::microseconds(v);}
+                    else {nb_workers = v;}
+                    continue;
+                }
+                if (word != "device")
+                {
+                    if (found.empty()) {throw std::invalid_argument("rule before any device line");}
+                    found.back().rules += body + "\n";
+                    continue;
+                }
+                Block & b = found.emplace_back();
+                b.line = nr;
+                if (!(ls >> b.name)) {throw std::invalid_argument("device wants a name");}
+                while (ls >> tok)
+                {
+                    size_t eq = tok.find('=');
+                    if (eq == std::string::npos) {throw std::invalid_argument("expected key=value, got " + tok);}
+                    std::string k = tok.substr(0, eq), v = tok.substr(eq + 1);
+                    if (k == "port" || k == "ports") {parse_range(v, b.port_first, b.port_last);}
+                    else if ((k == "unit" || k == "units") && v == "any") {b.unit_first = b.unit_last = -1;}
+                    else if (k == "unit" || k == "units") {parse_range(v, b.unit_first, b.unit_last);}
+                    else if (k == "co") {b.tables[0] = RegTableSpec::parse(v);}
+                    else if (k == "di") {b.tables[1] = RegTableSpec::parse(v);}
+                    else if (k == "hr") {b.tables[2] = RegTableSpec::parse(v);}
+                    else if (k == "ir") {b.tables[3] = RegTableSpec::parse(v);}
+                    else if (k == "profile")
+                    {
+                        std::ifstream f(v);
+                        if (!f) {throw std::ios_base::failure("can't read simulation profile " + v);}
+                        b.rules += std::string(std::istreambuf_iterator<char>(f), {}) + "\n";
+                    }
+                    else {throw std::invalid_argument("unknown device key " + k);}
+                }
+            }
+            for (auto &&b : found)
+            {
+                nr = b.line;
+                add_block(b);
+            }
+        }
+        catch (const std::invalid_argument & e)
+        {
+            throw std::invalid_argument("farm line " + std::to_string(nr) + ": " + e.what());
+        }
+        catch (const std::out_of_range & e) // stoul and SimEngine::check
+        {
+            throw std::out_of_range("farm line " + std::to_string(nr) + ": " + e.what());
+        }
+    }
+
+    /// @throws std::ios_base::failure if the file can't be read, see load()
+    void load_file(const std::string & path)
+    {
+        std::ifstream f(path);
+        if (!f) {throw std::ios_base::failure("can't read farm file " + path);}
+        load(f);
+    }
+
+    inline void load_string(const std::string & text)
+    {
+        std::istringstream s(text);
+        load(s);
+    }
+
+    /// @brief address to listen on, before start()
+    inline void set_ip(const std::string & nip) {ip = nip;}
+    /// @brief overrides the workers line of the farm file, before start()
+    inline void set_workers(const int & n) {nb_workers = std::max(1, n);}
+
+    inline size_t size() const {return devices.size();}
+    inline const std::vector<std::unique_ptr<Device>> & all() const {return devices;}
+    /// @brief device block names, Device::block indexes this
+    inline const std::vector<std::string> & names() const {return blocks;}
+
+    /// @brief the device answering unit on port
+    /// @return nullptr if there is none
+    Device * find(const uint16_t & port, const uint8_t & unit) const
+    {
+        auto it = ports.find(port);
+        return it == ports.end() ? nullptr : it->second->lookup(unit);
+    }
+
+    /// @brief binds every port, starts the workers and the tick thread and returns
+    /// @throws std::ios_base::failure when a port can't be bound (nothing keeps running then)
+    void start()
+    {
+        stop();
+        workers.clear();
+        try
+        {
+            for (auto &&[p, pt] : ports)
+            {
+                pt->fd = make_listen(p);
+                if ((size_t)pt->fd >= listeners.size()) {listeners.resize(pt->fd + 1);}
+                listeners[pt->fd] = pt.get();
+            }
+            for (int i = 0; i < nb_workers; i++)
+            {
+                auto w = std::make_unique<Worker>();
+                w->efd = epoll_create1(EPOLL_CLOEXEC);
+                if (w->efd == -1) {throw std::ios_base::failure("epoll_create1 FAILED");}
+                for (auto &&[p, pt] : ports)
+                {
+                    // every worker waits on every listener, EPOLLEXCLUSIVE wakes just one of them
+                    epoll_event ev{};
+                    ev.events = EPOLLIN | EPOLLEXCLUSIVE;
+                    ev.data.fd = pt->fd;
+                    epoll_ctl(w->efd, EPOLL_CTL_ADD, pt->fd, &ev);
+                }
+                workers.push_back(std::move(w));
+            }
+        }
+        catch (...)
+        {
+            stop();
+            throw;
+        }
+        running = true;
+        for (auto &&w : workers) {w->thread = std::thread(&DeviceFarm::serve, this, std::ref(*w));}
+        for (auto &&d : devices)
+        {
+            if (d->sim != nullptr)
+            {
+                ticker = std::thread(&DeviceFarm::tick_loop, this);
+                break;
+            }
+        }
+    }
+
+    /// @brief stops serving and ticking, closes every socket, devices keep their values and metrics_text() its counts
+    void stop()
+    {
+        running = false;
+        if (ticker.joinable()) {ticker.join();}
+        for (auto &&w : workers)
+        {
+            if (w->thread.joinable()) {w->thread.join();}
+            if (w->efd != -1) {close(w->efd);}
+            w->efd = -1;
+        }
+        for (auto &&[p, pt] : ports)
+        {
+            if (pt->fd != -1) {close(pt->fd);}
+            pt->fd = -1;
+        }
+        listeners.clear();
+    }
+
+    /// @brief Prometheus text of all workers, same series as dumb_Mserver::metrics_text()
+    std::string metrics_text() const
+    {
+        std::vector<const ServerMetrics *> all;
+        for (auto &&w : workers) {all.push_back(&w->metrics);}
+        std::ostringstream os;
+        ServerMetrics::render(os, all);
+        return os.str();
+    }
+};
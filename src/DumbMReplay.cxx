@@ -0,0 +1,69 @@
+/// @brief replays a capture written by DumbMserver --capture against a server and reports
+/// divergences and throughput as JSON. Exit code 0 only when every reply matched.
+///   ./DumbMReplay --capture=field.cap --port=1502            back to back
+///   ./DumbMReplay --capture=field.cap --port=1502 --speed=1  at the captured pace
+
+#include "TrafficReplay.hpp"
+
+#include <gflags/gflags.h>
+
+#include <iostream>
+
+DEFINE_string(capture, "", "capture file to replay");
+DEFINE_string(host, "127.0.0.1", "server to replay against");
+DEFINE_int32(port, 1502, "server port");
+DEFINE_double(speed, 0, "captured pace multiplier (1 = original timing), 0 = as fast as possible");
+DEFINE_int32(loops, 1, "replay this many times, handy as a benchmark workload");
+
+/// @brief JSON string escaping for the divergence samples, they are plain ASCII hex anyway
+static std::string quoted(const std::string & s)
+{
+    std::string q = "\"";
+    for (char c : s)
+    {
+        if (c == '"' || c == '\\') {q += '\\';}
+        q += c;
+    }
+    return q + "\"";
+}
+
+int main(int argc, char* argv[])
+{
+    gflags::ParseCommandLineFlags(&argc, &argv, true);
+    if (FLAGS_capture.empty())
+    {
+        std::cerr << "--capture is required" << std::endl;
+        return 2;
+    }
+
+    TrafficLogView log(FLAGS_capture);
+    TrafficReplay replay(log);
+    ReplayResult total;
+    for (int i = 0; i < std::max(1, FLAGS_loops); i++)
+    {
+        ReplayResult r = replay.run(FLAGS_host, FLAGS_port, FLAGS_speed);
+        total.frames += r.frames;
+        total.divergences += r.divergences;
+        total.errors += r.errors;
+        total.seconds += r.seconds;
+        for (auto && s : r.samples)
+        {
+            if (total.samples.size() < TrafficReplay::max_samples) {total.samples.push_back(s);}
+        }
+    }
+
+    std::cout << "{\n"
+              << "  \"capture\": " << quoted(FLAGS_capture) << ", \"captured_frames\": " << log.frames()
+              << ", \"connections\": " << replay.connections() << ",\n"
+              << "  \"speed\": " << FLAGS_speed << ", \"loops\": " << FLAGS_loops << ",\n"
+              << "  \"frames\": " << total.frames << ", \"divergences\": " << total.divergences << ", \"errors\": " << total.errors << ",\n"
+              << "  \"duration_s\": " << total.seconds << ", \"throughput_rps\": " << total.rps() << ",\n"
+              << "  \"samples\": [";
+    for (size_t i = 0; i < total.samples.size(); i++)
+    {
+        std::cout << (i ? ",\n    " : "\n    ") << quoted(total.samples[i]);
+    }
+    std::cout << (total.samples.empty() ? "]\n}\n" : "\n  ]\n}\n");
+
+    return total.divergences == 0 && total.errors == 0 ? 0 : 1;
+}
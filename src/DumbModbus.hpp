@@ -1,13 +1,54 @@
 #pragma once
 
 #include "modbus/modbus.h"
+#include "RegisterStore.hpp"
+#include "MbReply.hpp"
+#include "ServerMetrics.hpp"
+#include "ReplyCache.hpp"
+#include "SimEngine.hpp"
+#include "TrafficLog.hpp"
 
 #include <unistd.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <poll.h>
+#include <sched.h>
+#include <sys/epoll.h>
+#include <sys/eventfd.h>
+#include <sys/socket.h>
+#include <netinet/tcp.h>
 #include <stdexcept>
 #include <iostream>
 #include <string>
 #include <atomic>
 #include <thread>
+#include <arpa/inet.h>
+#include <netinet/in.h>
+#include <chrono>
+#include <vector>
+#include <memory>
+#include <mutex>
+#include <sstream>
+#include <cerrno>
+#include <cstring>
+
+/// @brief plain copy of the serving loop counters summed over all workers
+struct ServeTotals
+{
+    uint64_t connections_total = 0;
+    uint64_t connections_active = 0;
+    uint64_t requests_total = 0;
+    /// @brief requests per second measured over the last report interval
+    double requests_per_sec = 0;
+};
+
+/// @brief counters of one serving worker, own cache line so workers don't fight over it
+struct alignas(64) ServeStats
+{
+    std::atomic<uint64_t> connections_total{0};
+    std::atomic<uint64_t> connections_active{0};
+    std::atomic<uint64_t> requests_total{0};
+};
 
 class dumb_Mserver
 {
@@ -18,13 +59,111 @@ private:
     int ro_regs = 20;
     int rw_regs = 20;
     int nb_masters = 1;
+    bool multi_client = false;
+    bool pipelined = false;
+    /// @brief spin on nonblocking sockets instead of epoll, see set_low_latency()
+    bool low_latency = false;
+    /// @brief first CPU of the low-latency workers (worker i gets pin_cpu + i), -1 = no pinning
+    int pin_cpu = -1;
+    /// @brief SO_BUSY_POLL of low-latency client sockets, microseconds
+    int busy_poll_us = 50;
+    std::chrono::milliseconds report_every{0};
+    std::ostream * report_out = &std::cerr;
+
+    /// @brief how many epoll events we eat per wakeup
+    static constexpr int max_events = 64;
+    /// @brief epoll_wait timeout, paces the stats report, stop() wakes the loops through wake_fd
+    static constexpr int poll_timeout_ms = 100;
+    /// @brief low-latency loop looks at the listener and the stats only once per this many spins
+    static constexpr uint32_t busy_housekeeping = 1024;
 
-    std::atomic<bool> running;
+    /// @brief multi-client modes read this much per recv(), pipelined replies are flushed in chunks of this size
+    static constexpr size_t pipe_buf_size = 64 * 1024;
+
+    /// @brief one client of a worker
+    struct Conn
+    {
+        std::shared_ptr<ConnMetrics> metrics;
+        /// @brief received bytes not yet parsed into frames
+        std::unique_ptr<uint8_t[]> in;
+        size_t in_len = 0;
+        /// @brief replies the nonblocking socket didn't take yet, nothing new is read before they are out
+        std::vector<uint8_t> tail;
+        /// @brief epoll mode: waiting for EPOLLOUT to send the tail instead of EPOLLIN
+        bool wants_out = false;
+        /// @brief TrafficLog connection id, 0 when not capturing
+        uint32_t cap_id = 0;
+    };
+
+    /// @brief request answered in the current pipelined batch, recorded after the flush
+    struct PendingRec
+    {
+        uint8_t fc;
+        bool exception;
+        uint16_t in;
+        uint16_t out;
+    };
+
+    /// @brief one serving thread: own context, own listener, own epoll
+    struct Worker
+    {
+        modbus_t *ctx = nullptr;
+        int listen_fd = -1;
+        std::thread thread;
+        ServeStats stats;
+        ServerMetrics metrics;
+        /// @brief open clients indexed by socket
+        std::vector<std::unique_ptr<Conn>> conns;
+        /// @brief reply buffer and its records, shared by all clients of the worker
+        std::unique_ptr<uint8_t[]> out;
+        std::vector<PendingRec> pending;
+        /// @brief encoded reads of this worker, nullptr when the cache is off
+        std::unique_ptr<ReplyCache> cache;
+        /// @brief capture buffer of this worker, nullptr when not capturing
+        std::unique_ptr<TrafficLog::Writer> cap;
+    };
+
+    /// @brief capture file from set_capture(), empty = off
+    std::string capture_path;
+    /// @brief open while serving with a capture, declared before the workers whose writers point into it
+    std::unique_ptr<TrafficLog> capture;
+
+    int nb_workers = 1;
+    std::vector<std::unique_ptr<Worker>> workers;
+    /// @brief guards resizing workers against get_stats()/metrics_text() from other threads
+    mutable std::mutex workers_lock;
+
+    /// @brief metrics of the legacy single client ezRun
+    ServerMetrics legacy_metrics;
+    /// @brief reply cache entries per worker, 0 = off
+    size_t reply_cache_size = 0;
+    std::unique_ptr<ReplyCache> legacy_cache;
+    std::unique_ptr<TrafficLog::Writer> legacy_cap;
+    /// @brief Prometheus text endpoint port, served by worker 0, 0 = off
+    int metrics_port = 0;
+
+    std::atomic<double> requests_per_sec{0};
+    std::chrono::steady_clock::time_point last_report;
+    uint64_t last_report_requests = 0;
+
+    std::atomic<bool> running{false};
     pthread_t thread = 0;
     std::thread server;
+    /// @brief stop() pokes it, every blocking wait of the serving loops watches it, drained in prepare()
+    int wake_fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    /// @brief port the listener actually got (set_context() may ask for 0), 0 while not listening
+    std::atomic<int> bound_port{0};
 
     modbus_t *context = nullptr;
-    modbus_mapping_t *mb_mapping = nullptr;
+    /// @brief shared by all workers and test code, seqlocked per table
+    std::unique_ptr<RegisterStore> store;
+    /// @brief shm name or file backing the store, empty = private heap
+    std::string shared_map;
+    /// @brief tables from setRegLayout() in RegTable order, only used with custom_layout
+    RegTableSpec layout[4];
+    bool custom_layout = false;
+    /// @brief register simulation ticking next to the serving loop, nullptr = SimEngine::DEFAULT_PROFILE
+    std::unique_ptr<SimEngine> sim;
     int port = 1502;
     int soc = -1;
     int rc;
@@ -32,11 +171,25 @@ private:
 
     /// @brief initializes context, locks port (creates socket)
     /// @return true on sucsess
-    inline bool make_context() {context = modbus_new_tcp(ip.c_str(), port); if(context == nullptr){throw std::ios_base::failure("Failed to create the Modbus context!"); return false;} return true;}
+    inline bool make_context() {if (context != nullptr){modbus_free(context);} context = modbus_new_tcp(ip.c_str(), port); if(context == nullptr){throw std::ios_base::failure("Failed to create the Modbus context!"); return false;} return true;}
     
     /// @brief initializes memory map to store registers 20 of each by default (or set sizes first)
     /// @return true on sucsess
-    inline bool make_map() {mb_mapping = modbus_mapping_new(ro_bits,coil,ro_regs,rw_regs); if (mb_mapping == nullptr){throw std::overflow_error(std::string("mem fuckup")); return false;} return true;}
+    inline bool make_map()
+    {
+        if (shared_map.empty())
+        {
+            store = !custom_layout ? std::make_unique<RegisterStore>(ro_bits,coil,ro_regs,rw_regs)
+                                   : std::make_unique<RegisterStore>(layout);
+        }
+        else
+        {
+            store.reset(); // same file, old mapping goes first
+            store = !custom_layout ? std::make_unique<RegisterStore>(shared_map,ro_bits,coil,ro_regs,rw_regs)
+                                   : std::make_unique<RegisterStore>(shared_map, layout);
+        }
+        return true;
+    }
 
     /// @brief at the edge of the rainbow, where eagles learn to fly All modbus dreams becomes so clear
     /// @return true on sucsess
@@ -46,39 +199,611 @@ private:
         if (soc == -1) 
         {
             modbus_free(context);
+            context = nullptr;
             throw std::ios_base::failure("soc creation FAILED");
             return false;
         }
+        bound_port = local_port(soc);
         return true;
     }
 
+    /// @brief port a socket is bound to
+    static int local_port(const int & fd)
+    {
+        sockaddr_in addr{};
+        socklen_t alen = sizeof(addr);
+        if (getsockname(fd, (sockaddr *)&addr, &alen) != 0) {return 0;}
+        return ntohs(addr.sin_port);
+    }
+
+    /// @brief blocks until fd has something to read (or hung up) or stop() is called
+    /// @return false when it was stop()
+    inline bool wait_readable(const int & fd)
+    {
+        pollfd p[2] = {{fd, POLLIN, 0}, {wake_fd, POLLIN, 0}};
+        while (poll(p, 2, -1) == -1 && errno == EINTR) {}
+        return !(p[1].revents & POLLIN) && running;
+    }
+
+    /// @brief fills a dense table with pattern(address); sparse tables are left alone, seeding
+    /// them would give every 64-address block its memory up front
+    template<typename F>
+    void seed(const RegTable & t, F pattern)
+    {
+        if (store->sparse(t)) {return;}
+        auto b = store->batch(t);
+        for (size_t i = 0; i < store->count(t); i++)
+        {
+            if (!store->in_range(t, i, 1)) {continue;}
+            b.set(i, pattern(i));
+        }
+    }
+
     /// @brief spawns data into registers, reading 0's is boring
     /// @return pointer to Flint's treashure 
     bool spawn_values()
     {
-        for (size_t i = 0; i < mb_mapping->nb_bits; i++)
+        seed(RegTable::COILS, [](size_t i) {return i%3%2;}); //100100
+        seed(RegTable::INPUT_BITS, [](size_t i) {return i%2;}); //1010
+        seed(RegTable::INPUT_REGS, [](size_t i) {return i*2;});
+        seed(RegTable::HOLDING_REGS, [](size_t i) {return i*3;});
+
+        return true;
+    }
+
+    /// @brief starts the simulation on the current store, the default profile only if the map has room for it
+    /// @throws std::out_of_range when the profile touches registers outside the map
+    void start_sim()
+    {
+        if (sim == nullptr)
         {
-            mb_mapping->tab_bits[i] = i%3%2; //100100
+            if (store->count(RegTable::INPUT_REGS) <= 6) {return;}
+            sim = std::make_unique<SimEngine>();
+            sim->load_string(SimEngine::DEFAULT_PROFILE);
         }
-        for (size_t i = 0; i < mb_mapping->nb_input_bits; i++)
+        sim->start(*store);
+    }
+
+    /// @brief encodes the reply of one frame, through the cache when there is one
+    /// @return reply length
+    inline size_t encode(ReplyCache * cache, const uint8_t * query, const size_t & len, uint8_t * rsp, ServerMetrics & m)
+    {
+        if (cache == nullptr) {return mb_reply_adu(*store, query, len, rsp);}
+        ReplyCache::Outcome res;
+        size_t n = cache->reply(*store, query, len, rsp, res);
+        if (res != ReplyCache::Outcome::BYPASS) {m.record_cache(res == ReplyCache::Outcome::HIT);}
+        return n;
+    }
+
+    /// @brief answers one frame from the store, sends it back and records it
+    /// @param cache may be nullptr
+    /// @param cap capture writer, may be nullptr
+    /// @param cap_id connection id in the capture
+    /// @param t0 when the request started to be received
+    /// @return reply length
+    inline size_t reply(const int & fd, const uint8_t * query, const int & len, ServerMetrics & m, ConnMetrics * conn, ReplyCache * cache,
+                        TrafficLog::Writer * cap, const uint32_t & cap_id, const std::chrono::steady_clock::time_point & t0)
+    {
+        uint8_t rsp[MB_MAX_ADU_LENGTH];
+        size_t n = encode(cache, query, len, rsp, m);
+        if (cap != nullptr) {cap->record(cap_id, t0, query, len, rsp, n);}
+        if (n == 0) {return 0;}
+        for (size_t sent = 0; sent < n;)
+        {
+            ssize_t r = send(fd, rsp + sent, n - sent, MSG_NOSIGNAL);
+            if (r > 0) {sent += r;}
+            else if (r < 0 && errno != EINTR) {break;} // client gone, the next receive notices
+        }
+        uint64_t ns = std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - t0).count();
+        m.record(query[MB_MBAP_LENGTH], rsp[MB_MBAP_LENGTH] & 0x80, ns, len, n, conn);
+        return n;
+    }
+
+    /// @brief "ip:port" of the other end
+    static std::string peer_of(const int & fd)
+    {
+        sockaddr_in addr{};
+        socklen_t alen = sizeof(addr);
+        char buf[INET_ADDRSTRLEN] = "?";
+        if (getpeername(fd, (sockaddr *)&addr, &alen) == 0)
         {
-            mb_mapping->tab_input_bits[i] = i%2;//1010
+            inet_ntop(AF_INET, &addr.sin_addr, buf, sizeof(buf));
         }
-        for (size_t i = 0; i < mb_mapping->nb_input_registers; i++)
+        return std::string(buf) + ":" + std::to_string(ntohs(addr.sin_port));
+    }
+
+    /// @brief one scrape: ignores the request, answers with the text and closes
+    void serve_metrics(const int & fd)
+    {
+        char req[1024];
+        recv(fd, req, sizeof(req), MSG_DONTWAIT);
+        std::string body = metrics_text();
+        std::string head = "HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: " +
+                           std::to_string(body.size()) + "\r\nConnection: close\r\n\r\n";
+        send(fd, head.data(), head.size(), MSG_NOSIGNAL);
+        send(fd, body.data(), body.size(), MSG_NOSIGNAL);
+        close(fd);
+    }
+
+    /// @brief recalculates requests/s and prints a line once per report_every
+    void report_stats()
+    {
+        auto now = std::chrono::steady_clock::now();
+        auto elapsed = now - last_report;
+        if (report_every.count() == 0 || elapsed < report_every) {return;}
+
+        ServeTotals t = get_stats();
+        double sec = std::chrono::duration<double>(elapsed).count();
+        requests_per_sec = (t.requests_total - last_report_requests) / sec;
+        last_report = now;
+        last_report_requests = t.requests_total;
+
+        if (report_out != nullptr)
         {
-            mb_mapping->tab_input_registers[i] = i*2;
+            *report_out << "port " << bound_port
+                        << " workers " << workers.size()
+                        << " conn " << t.connections_active << "/" << t.connections_total
+                        << " req " << t.requests_total
+                        << " rps " << requests_per_sec << std::endl;
         }
-        for (size_t i = 0; i < mb_mapping->nb_registers; i++)
+    }
+
+    /// @brief drops client from epoll set and closes it
+    inline void drop_client(Worker & w, int efd, int fd)
+    {
+        if (efd != -1) {epoll_ctl(efd, EPOLL_CTL_DEL, fd, nullptr);}
+        close(fd);
+        w.stats.connections_active--;
+        if (w.cap != nullptr) {w.cap->flush();}
+        if ((size_t)fd < w.conns.size() && w.conns[fd] != nullptr)
         {
-            mb_mapping->tab_registers[i] = i*3;
+            w.metrics.close_conn(w.conns[fd]->metrics);
+            w.conns[fd] = nullptr;
         }
+    }
 
+    /// @brief sends buf, what a full nonblocking socket doesn't take goes to c.tail
+    /// @return false when the client is gone
+    static bool send_or_keep(const int & fd, Conn & c, const uint8_t * buf, const size_t & len)
+    {
+        size_t sent = 0;
+        while (sent < len && c.tail.empty())
+        {
+            ssize_t r = send(fd, buf + sent, len - sent, MSG_NOSIGNAL);
+            if (r > 0) {sent += r; continue;}
+            if (r < 0 && errno == EINTR) {continue;}
+            if (r < 0 && (errno == EAGAIN || errno == EWOULDBLOCK)) {break;}
+            return false;
+        }
+        c.tail.insert(c.tail.end(), buf + sent, buf + len);
         return true;
     }
 
+    /// @brief sends the batch of replies with one syscall and records every request in it
+    /// @return false when the client is gone
+    inline bool flush_pipelined(Worker & w, const int & fd, size_t & out_len, Conn & c, const std::chrono::steady_clock::time_point & t0)
+    {
+        if (out_len == 0) {return true;}
+        if (!send_or_keep(fd, c, w.out.get(), out_len)) {return false;}
+        uint64_t ns = std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - t0).count();
+        for (auto &&r : w.pending)
+        {
+            w.metrics.record(r.fc, r.exception, ns, r.in, r.out, c.metrics.get());
+        }
+        w.pending.clear();
+        out_len = 0;
+        return true;
+    }
+
+    /// @brief one recv() for whatever the client sent, every complete MBAP frame in it is answered.
+    /// Pipelined (and low-latency) the replies share one buffer that goes out with a single send(),
+    /// otherwise every reply is sent on its own. Partial frames wait in the connection for the next read.
+    /// @return false when the client is gone or talks garbage
+    bool serve_pipelined(Worker & w, const int & fd)
+    {
+        Conn & c = *w.conns[fd];
+        if (!c.tail.empty())
+        {
+            // the client is not reading its replies, don't take more requests from it until it does
+            std::vector<uint8_t> old;
+            old.swap(c.tail);
+            if (!send_or_keep(fd, c, old.data(), old.size())) {return false;}
+            if (!c.tail.empty()) {return true;}
+        }
+        ssize_t r = recv(fd, c.in.get() + c.in_len, pipe_buf_size - c.in_len, 0);
+        if (r <= 0) {return r < 0 && (errno == EAGAIN || errno == EINTR);}
+        auto t0 = std::chrono::steady_clock::now();
+        c.in_len += r;
+
+        size_t pos = 0;
+        size_t out_len = 0;
+        for (;;)
+        {
+            long flen = mb_frame_length(c.in.get() + pos, c.in_len - pos);
+            if (flen == 0) {break;}
+            if (flen < 0) {return false;}
+            if (pipe_buf_size - out_len < MB_MAX_ADU_LENGTH && !flush_pipelined(w, fd, out_len, c, t0)) {return false;}
+
+            const uint8_t * q = c.in.get() + pos;
+            uint8_t * rsp = w.out.get() + out_len;
+            size_t n = encode(w.cache.get(), q, flen, rsp, w.metrics);
+            if (w.cap != nullptr) {w.cap->record(c.cap_id, t0, q, flen, rsp, n);}
+            w.pending.push_back({q[MB_MBAP_LENGTH], (rsp[MB_MBAP_LENGTH] & 0x80) != 0, (uint16_t)flen, (uint16_t)n});
+            out_len += n;
+            pos += flen;
+            w.stats.requests_total++;
+            if (!pipelined && !low_latency && !flush_pipelined(w, fd, out_len, c, t0)) {return false;}
+        }
+        if (!flush_pipelined(w, fd, out_len, c, t0)) {return false;}
+
+        c.in_len -= pos;
+        if (c.in_len > 0 && pos > 0) {std::memmove(c.in.get(), c.in.get() + pos, c.in_len);}
+        return true;
+    }
+
+    /// @brief own listener, with SO_REUSEPORT every worker gets its share of the accepts from the kernel
+    /// @param lport port to bind
+    /// @param reuseport set SO_REUSEPORT
+    /// @throws std::ios_base::failure on socket/bind/listen error
+    /// @return listening socket
+    int make_tcp_listen(const int & lport, const bool & reuseport)
+    {
+        int fd = socket(AF_INET, SOCK_STREAM | SOCK_CLOEXEC, 0);
+        if (fd == -1)
+        {
+            throw std::ios_base::failure("soc creation FAILED");
+        }
+        int yes = 1;
+        setsockopt(fd, SOL_SOCKET, SO_REUSEADDR, &yes, sizeof(yes));
+        if (reuseport && setsockopt(fd, SOL_SOCKET, SO_REUSEPORT, &yes, sizeof(yes)) == -1)
+        {
+            close(fd);
+            throw std::ios_base::failure("SO_REUSEPORT FAILED");
+        }
+
+        sockaddr_in addr{};
+        addr.sin_family = AF_INET;
+        addr.sin_port = htons(lport);
+        if (inet_pton(AF_INET, ip.c_str(), &addr.sin_addr) != 1)
+        {
+            addr.sin_addr.s_addr = htonl(INADDR_ANY);
+        }
+        if (bind(fd, (sockaddr *)&addr, sizeof(addr)) == -1 || listen(fd, nb_masters) == -1)
+        {
+            close(fd);
+            throw std::ios_base::failure("soc bind/listen FAILED");
+        }
+        return fd;
+    }
+
+    /// @brief counts a new client in and gives it its metrics and (pipelined) receive buffer
+    inline void open_client(Worker & w, const int & cfd)
+    {
+        w.stats.connections_total++;
+        w.stats.connections_active++;
+        if ((size_t)cfd >= w.conns.size()) {w.conns.resize(cfd + 1);}
+        w.conns[cfd] = std::make_unique<Conn>();
+        w.conns[cfd]->metrics = w.metrics.open_conn(peer_of(cfd));
+        w.conns[cfd]->in = std::make_unique_for_overwrite<uint8_t[]>(pipe_buf_size);
+        if (capture != nullptr) {w.conns[cfd]->cap_id = capture->open_conn();}
+    }
+
+    /// @brief spin-wait hint, keeps the sibling hyperthread and the power budget happier
+    static inline void cpu_relax()
+    {
+#if defined(__x86_64__) || defined(__i386__)
+        __builtin_ia32_pause();
+#elif defined(__aarch64__)
+        asm volatile("yield");
+#endif
+    }
+
+    /// @brief every CPU the low-latency workers will be pinned to must be ours
+    /// @throws std::invalid_argument otherwise
+    void check_pin_cpus() const
+    {
+        if (pin_cpu < 0) {return;}
+        cpu_set_t allowed;
+        CPU_ZERO(&allowed);
+        sched_getaffinity(0, sizeof(allowed), &allowed);
+        for (int c = pin_cpu; c < pin_cpu + nb_workers; c++)
+        {
+            if (c >= CPU_SETSIZE || !CPU_ISSET(c, &allowed))
+            {
+                throw std::invalid_argument("low latency: CPU " + std::to_string(c) + " is not available");
+            }
+        }
+    }
+
+    /// @brief low-latency loop of one worker: no epoll and no sleeping, nonblocking sockets are polled in a
+    /// spin on a pinned CPU. Frames are answered like pipelined mode, from buffers set up at accept, so
+    /// nothing between recv() and send() allocates or logs. Accepts, metrics scrapes and stats wait for
+    /// the housekeeping tick every busy_housekeeping spins.
+    /// @param w worker to run
+    /// @param reporter this one also prints stats and serves the metrics port
+    /// @param cpu pin to this CPU, -1 = leave it to the scheduler
+    void serve_busy(Worker & w, bool reporter, int cpu)
+    {
+        if (cpu >= 0)
+        {
+            cpu_set_t set;
+            CPU_ZERO(&set);
+            CPU_SET(cpu, &set);
+            pthread_setaffinity_np(pthread_self(), sizeof(set), &set);
+        }
+        int metrics_fd = -1;
+        if (reporter && metrics_port > 0)
+        {
+            metrics_fd = make_tcp_listen(metrics_port, false);
+            fcntl(metrics_fd, F_SETFL, O_NONBLOCK);
+        }
+        w.out = std::make_unique<uint8_t[]>(pipe_buf_size);
+        w.pending.reserve(pipe_buf_size / (MB_MBAP_LENGTH + 2));
+        std::vector<int> clients;
+        clients.reserve(nb_masters);
+
+        for (uint32_t spin = 0; running; spin++)
+        {
+            for (size_t i = 0; i < clients.size();)
+            {
+                if (serve_pipelined(w, clients[i])) {i++; continue;}
+                drop_client(w, -1, clients[i]);
+                clients[i] = clients.back();
+                clients.pop_back();
+            }
+            if (spin % busy_housekeeping == 0)
+            {
+                int cfd = accept4(w.listen_fd, nullptr, nullptr, SOCK_NONBLOCK | SOCK_CLOEXEC);
+                if (cfd != -1)
+                {
+                    int yes = 1;
+                    setsockopt(cfd, IPPROTO_TCP, TCP_NODELAY, &yes, sizeof(yes));
+                    setsockopt(cfd, SOL_SOCKET, SO_BUSY_POLL, &busy_poll_us, sizeof(busy_poll_us)); // may need CAP_NET_ADMIN, best effort
+                    clients.push_back(cfd);
+                    open_client(w, cfd);
+                }
+                if (metrics_fd != -1 && (cfd = accept4(metrics_fd, nullptr, nullptr, SOCK_CLOEXEC)) != -1) {serve_metrics(cfd);}
+                if (reporter) {report_stats();}
+            }
+            cpu_relax();
+        }
+
+        for (auto &&fd : clients)
+        {
+            drop_client(w, -1, fd);
+        }
+        if (metrics_fd != -1) {close(metrics_fd);}
+    }
+
+    /// @brief epoll loop of one worker, keeps serving while clients connect and disconnect
+    /// @param w worker to run
+    /// @param reporter this one also prints stats
+    void serve(Worker & w, bool reporter)
+    {
+        int efd = epoll_create1(EPOLL_CLOEXEC);
+        if (efd == -1)
+        {
+            throw std::ios_base::failure("epoll_create1 FAILED");
+        }
+        epoll_event ev{};
+        ev.events = EPOLLIN;
+        ev.data.fd = w.listen_fd;
+        epoll_ctl(efd, EPOLL_CTL_ADD, w.listen_fd, &ev);
+        ev.data.fd = wake_fd; // level triggered and never read here, so it wakes every worker
+        epoll_ctl(efd, EPOLL_CTL_ADD, wake_fd, &ev);
+
+        int metrics_fd = -1;
+        if (reporter && metrics_port > 0)
+        {
+            metrics_fd = make_tcp_listen(metrics_port, false);
+            ev.data.fd = metrics_fd;
+            epoll_ctl(efd, EPOLL_CTL_ADD, metrics_fd, &ev);
+        }
+
+        w.out = std::make_unique<uint8_t[]>(pipe_buf_size);
+        w.pending.reserve(pipe_buf_size / (MB_MBAP_LENGTH + 2));
+        std::vector<int> clients;
+        epoll_event events[max_events];
+
+        while (running)
+        {
+            int n = epoll_wait(efd, events, max_events, poll_timeout_ms);
+            for (int i = 0; i < n; i++)
+            {
+                int fd = events[i].data.fd;
+                if (fd == wake_fd) {continue;}
+                if (fd == w.listen_fd)
+                {
+                    // nonblocking: a client that doesn't read or sends half a frame must not stall the others
+                    int cfd = accept4(w.listen_fd, nullptr, nullptr, SOCK_NONBLOCK | SOCK_CLOEXEC);
+                    if (cfd == -1) {continue;}
+                    ev.events = EPOLLIN;
+                    ev.data.fd = cfd;
+                    epoll_ctl(efd, EPOLL_CTL_ADD, cfd, &ev);
+                    clients.push_back(cfd);
+                    open_client(w, cfd);
+                    continue;
+                }
+                if (fd == metrics_fd)
+                {
+                    int cfd = accept4(metrics_fd, nullptr, nullptr, SOCK_CLOEXEC);
+                    if (cfd != -1) {serve_metrics(cfd);}
+                    continue;
+                }
+
+                if (!serve_pipelined(w, fd))
+                {
+                    /* Connection closed by the client or error, others keep going */
+                    drop_client(w, efd, fd);
+                    std::erase(clients, fd);
+                    continue;
+                }
+                // replies left over: wait until the socket takes them, reading resumes after that
+                Conn & c = *w.conns[fd];
+                if (c.wants_out != !c.tail.empty())
+                {
+                    c.wants_out = !c.tail.empty();
+                    ev.events = c.wants_out ? EPOLLOUT : EPOLLIN;
+                    ev.data.fd = fd;
+                    epoll_ctl(efd, EPOLL_CTL_MOD, fd, &ev);
+                }
+            }
+            if (reporter) {report_stats();}
+        }
+
+        for (auto &&fd : clients)
+        {
+            drop_client(w, efd, fd);
+        }
+        if (metrics_fd != -1) {close(metrics_fd);}
+        close(efd);
+    }
+
+    /// @brief map, simulation and listening sockets, everything that can fail before serving starts
+    /// @throws std::ios_base::failure on socket errors, std::out_of_range when the simulation is off the map
+    void prepare()
+    {
+        eventfd_t stale;
+        eventfd_read(wake_fd, &stale);
+        try
+        {
+            if (multi_client && low_latency) {check_pin_cpus();}
+            if (store == nullptr) {make_map();}
+            spawn_values();
+            start_sim();
+            capture = capture_path.empty() ? nullptr : std::make_unique<TrafficLog>(capture_path);
+            if (multi_client) {open_workers();}
+            else
+            {
+                legacy_cache = reply_cache_size ? std::make_unique<ReplyCache>(reply_cache_size) : nullptr;
+                legacy_cap = capture != nullptr ? std::make_unique<TrafficLog::Writer>(*capture) : nullptr;
+                make_context();
+                make_listen();
+            }
+        }
+        catch (...)
+        {
+            running = false;
+            if (sim != nullptr) {sim->stop();}
+            std::vector<std::unique_ptr<Worker>> opened;
+            {
+                std::lock_guard lk(workers_lock);
+                opened.swap(workers);
+            }
+            for (auto &&w : opened)
+            {
+                close(w->listen_fd);
+                modbus_free(w->ctx);
+            }
+            legacy_cap.reset();
+            capture.reset();
+            throw;
+        }
+    }
+
+    /// @brief one listener per worker, the first one decides the port when port 0 was asked for
+    void open_workers()
+    {
+        {
+            std::lock_guard lk(workers_lock);
+            workers.clear();
+        }
+        for (int i = 0; i < nb_workers; i++)
+        {
+            int lport = i == 0 ? port : bound_port.load();
+            auto w = std::make_unique<Worker>();
+            w->ctx = modbus_new_tcp(ip.c_str(), lport);
+            if (w->ctx == nullptr)
+            {
+                throw std::ios_base::failure("Failed to create the Modbus context!");
+            }
+            w->listen_fd = nb_workers == 1 && !low_latency ? modbus_tcp_listen(w->ctx, nb_masters) : make_tcp_listen(lport, nb_workers > 1);
+            if (w->listen_fd == -1)
+            {
+                modbus_free(w->ctx);
+                throw std::ios_base::failure("soc creation FAILED");
+            }
+            if (low_latency) {fcntl(w->listen_fd, F_SETFL, O_NONBLOCK);}
+            // the cache index allocates on insert, low-latency replies are always encoded fresh
+            if (reply_cache_size && !low_latency) {w->cache = std::make_unique<ReplyCache>(reply_cache_size);}
+            if (capture != nullptr) {w->cap = std::make_unique<TrafficLog::Writer>(*capture);}
+            if (i == 0) {bound_port = local_port(w->listen_fd);}
+            std::lock_guard lk(workers_lock);
+            workers.push_back(std::move(w));
+        }
+    }
+
+    /// @brief serves on what prepare() opened until stop(), or in single client mode until the client leaves
+    void serve_prepared()
+    {
+        if (multi_client) {serve_workers();}
+        else {serve_single();}
+        // writers flush as they go, then the file is closed, ready to be replayed
+        for (auto &&w : workers) {w->cap.reset();}
+        legacy_cap.reset();
+        capture.reset();
+        bound_port = 0;
+        if (sim != nullptr) {sim->stop();}
+    }
+
+    /// @brief the legacy loop: one master, blocking libmodbus framing, done when it disconnects
+    void serve_single()
+    {
+        int cfd = wait_readable(soc) ? modbus_tcp_accept(context, &soc) : -1;
+        close(soc); // nobody else gets in anyway
+        soc = -1;
+        if (cfd != -1)
+        {
+            auto conn = legacy_metrics.open_conn(peer_of(cfd));
+            uint32_t cap_id = capture != nullptr ? capture->open_conn() : 0;
+            uint8_t query[MODBUS_TCP_MAX_ADU_LENGTH];
+            while (wait_readable(cfd))
+            {
+                rc = modbus_receive(context, query);
+                if (rc > 0) 
+                {
+                    /* rc is the query size, the wait before it was idle time so the clock starts here */
+                    auto t0 = std::chrono::steady_clock::now();
+                    reply(cfd, query, rc, legacy_metrics, conn.get(), legacy_cache.get(), legacy_cap.get(), cap_id, t0);
+                } 
+                else if (rc == -1) 
+                {
+                    /* Connection closed by the client or error */
+                    break;
+                }
+            }
+            legacy_metrics.close_conn(conn);
+            close(cfd);
+            modbus_set_socket(context, -1);
+        }
+        running = false;
+    }
+
+    /// @brief runs worker 0 in this thread and the rest in their own, closes the listeners after
+    void serve_workers()
+    {
+        last_report = std::chrono::steady_clock::now();
+        last_report_requests = 0;
+
+        for (size_t i = 1; i < workers.size(); i++)
+        {
+            workers[i]->thread = low_latency ? std::thread(&dumb_Mserver::serve_busy, this, std::ref(*workers[i]), false, pin_cpu < 0 ? -1 : pin_cpu + (int)i)
+                                             : std::thread(&dumb_Mserver::serve, this, std::ref(*workers[i]), false);
+        }
+        if (low_latency) {serve_busy(*workers[0], true, pin_cpu);}
+        else {serve(*workers[0], true);}
+
+        for (auto &&w : workers)
+        {
+            if (w->thread.joinable()) {w->thread.join();}
+            close(w->listen_fd);
+            modbus_free(w->ctx);
+        }
+    }
+
 public:
 
-    /// @brief uses modbus_mapping_new()
+    /// @brief same sizes modbus_mapping_new() would take, reallocates the store
     /// @param rob bits
     /// @param rwb input bits
     /// @param rod registers
@@ -87,10 +812,26 @@ public:
     /// @return true on sucsess 
     inline bool setRegSizes(const int &rob,const int &rwb,const int &rod,const int &rwd) 
     {
-        ro_bits = rob; coil = rwb; ro_regs = rod; rw_regs = rwd; 
+        ro_bits = rob; coil = rwb; ro_regs = rod; rw_regs = rwd; custom_layout = false;
         return make_map(); // not war
     }
 
+    /// @brief tables at real device addresses (40001+, 30000-series, scattered blocks) without paying for
+    /// all 64K of them: sparse tables only get memory for 64-register blocks somebody wrote, reads outside
+    /// the ranges answer Illegal Data Address. Reallocates the store like setRegSizes().
+    /// @param co coils, "20" = dense table of 20 from 0, "40000..40099,40200" = sparse ranges
+    /// @param di discrete inputs, same format
+    /// @param hr holding registers, same format
+    /// @param ir input registers, same format
+    /// @throws std::invalid_argument on bad specs, std::overflow_error on bad sizes
+    inline bool setRegLayout(const std::string & co, const std::string & di, const std::string & hr, const std::string & ir)
+    {
+        RegTableSpec spec[4] = {RegTableSpec::parse(co), RegTableSpec::parse(di), RegTableSpec::parse(hr), RegTableSpec::parse(ir)};
+        for (int i = 0; i < 4; i++) {layout[i] = std::move(spec[i]);}
+        custom_layout = true;
+        return make_map();
+    }
+
     /// @brief 
     /// @param nip new IP it's yours (exist cos u can have multiple ones u dummy, on different physycal/virtual devices)
     /// @param listen_port port u wanna listen to
@@ -103,58 +844,181 @@ public:
         return make_context();
     }
 
-    /// @brief don't think RUN
-    void ezRun()
+    /// @brief serve many masters at once from the single thread (epoll), clients may come and go
+    /// @param max_masters listen backlog
+    /// @param report print connections and requests/s this often, 0 = never
+    /// @param out where to print, nullptr = only update stats()
+    inline void set_multi_client(const int & max_masters, const std::chrono::milliseconds & report = std::chrono::milliseconds(0), std::ostream * out = &std::cerr)
     {
-        make_map();
-        spawn_values();
-        make_context();
-        make_listen();
-        soc = modbus_tcp_accept(context, &soc);
-        running = true;
+        multi_client = true;
+        nb_masters = max_masters;
+        report_every = report;
+        report_out = out;
+    }
 
-        while (running)
+    /// @brief multi-client mode with N serving threads, each with own SO_REUSEPORT listener on the same port.
+    /// All of them share the RegisterStore: every write is published through the table seqlock before
+    /// the reply goes out, so it is visible to every read served afterwards by any worker.
+    /// @param n workers, 0 = one per core
+    inline void set_workers(const int & n)
+    {
+        multi_client = true;
+        nb_workers = n > 0 ? n : std::max(1u, std::thread::hardware_concurrency());
+    }
+
+    /// @brief counters of the serving loop summed over the workers
+    ServeTotals get_stats() const
+    {
+        ServeTotals t;
+        std::lock_guard lk(workers_lock);
+        for (auto &&w : workers)
         {
-            uint8_t query[MODBUS_TCP_MAX_ADU_LENGTH];
-            rc = modbus_receive(context, query);
-            if (rc > 0) 
-            {
-                /* rc is the query size */
-                modbus_reply(context, query, rc, mb_mapping);
-                
-                if (mb_mapping->tab_input_registers[6] == 6*5)
-                {
-                    mb_mapping->tab_input_registers[6] = 12;
-                }
-                else if (mb_mapping->tab_input_registers[6] == 12)
-                {
-                    mb_mapping->tab_input_registers[6] = 6*5;
-                }
-                
-            } 
-            else if (rc == -1) 
-            {
-                /* Connection closed by the client or error */
-                close(soc);
-                running = false;
-            }
+            t.connections_total += w->stats.connections_total;
+            t.connections_active += w->stats.connections_active;
+            t.requests_total += w->stats.requests_total;
         }
+        t.requests_per_sec = requests_per_sec;
+        return t;
+    }
+
+    /// @brief pipelined serving (multi-client mode): clients may keep many transactions in flight,
+    /// each socket read takes up to 64 KiB, every complete frame in it is answered and all replies
+    /// leave in one send(), so a burst of N requests costs one recv/send pair instead of N
+    /// @param on true to enable
+    inline void set_pipelined(const bool & on)
+    {
+        multi_client = multi_client || on;
+        pipelined = on;
+    }
+
+    /// @brief low-latency serving (multi-client mode) for control-loop tests: each worker spins on nonblocking
+    /// sockets instead of sleeping in epoll, pinned to its own CPU, clients get TCP_NODELAY and SO_BUSY_POLL,
+    /// and the reply path neither allocates nor logs (the reply cache is skipped, its index allocates).
+    /// Burns a core per worker while idle, that's the price. Tail latency shows up in metrics_text()
+    /// quantiles and in DumbMBench --self --low_latency_cpu.
+    /// @param cpu worker i is pinned to cpu + i, -1 = no pinning, checked against our affinity when serving starts
+    /// @param poll_us SO_BUSY_POLL of client sockets, raising it above net.core.busy_read may need CAP_NET_ADMIN
+    inline void set_low_latency(const int & cpu, const int & poll_us = 50)
+    {
+        multi_client = true;
+        low_latency = true;
+        pin_cpu = cpu;
+        busy_poll_us = poll_us;
     }
 
-    /// @brief treading stuff or smth
+    /// @brief cache encoded replies of reads (FC 1-4) per (unit, fc, start, qty), LRU bounded.
+    /// Entries are tagged with the generation of the covered registers, so any write through the
+    /// store (modbus request, regs(), simulation) invalidates them; a hit is a copy plus a new transaction id.
+    /// @param entries per serving thread, 0 = off
+    inline void set_reply_cache(const size_t & entries) {reply_cache_size = entries;}
+
+    /// @brief capture every request and reply ADU with its arrival time into a binary log (see TrafficLog),
+    /// buffered per serving thread, flushed when a client leaves and when serving stops. The file is
+    /// created anew on every start; replay it with DumbMReplay or TrafficReplay.
+    /// @param path capture file, empty = off
+    inline void set_capture(const std::string & path) {capture_path = path;}
+
+    /// @brief serve the Prometheus text from metrics_text() over plain HTTP on ip:lport (multi-client mode)
+    /// @param lport port, 0 = off
+    inline void set_metrics_port(const int & lport) {metrics_port = lport;}
+
+    /// @brief per function code requests, exceptions, receive-to-reply quantiles and per connection bytes
+    /// in Prometheus text format, summed over the workers
+    std::string metrics_text() const
+    {
+        std::vector<const ServerMetrics *> all = {&legacy_metrics};
+        std::lock_guard lk(workers_lock);
+        for (auto &&w : workers) {all.push_back(&w->metrics);}
+        std::ostringstream os;
+        ServerMetrics::render(os, all);
+        return os.str();
+    }
+
+    /// @brief back the register map with a shared memory object ("/name") or a file other processes
+    /// can RegisterStore::attach() to and drive values zero-copy, see RegStoreHeader for the layout.
+    /// The map is laid out again with the current sizes right away and on every setRegSizes().
+    /// @param path shm name or file, empty = back to private memory
+    /// @throws std::ios_base::failure when the map can't be created
+    inline bool set_shared_map(const std::string & path)
+    {
+        shared_map = path;
+        return make_map();
+    }
+
+    /// @brief replace the built-in register 6 flip with a simulation profile, see SimEngine for the format.
+    /// It ticks on its own thread from ezRun() until stop(), writing each tick in one batch per table.
+    /// @param path profile file, empty = no simulation at all
+    /// @throws std::ios_base::failure if unreadable, std::invalid_argument on syntax errors
+    void set_simulation(const std::string & path)
+    {
+        if (running) {throw std::logic_error("can't swap the simulation while serving");}
+        auto s = std::make_unique<SimEngine>();
+        if (!path.empty()) {s->load_file(path);}
+        sim = std::move(s);
+    }
+
+    /// @brief the register map, test code may read and write it any time from any thread
+    /// @return store, allocated with current sizes if there is none yet
+    inline RegisterStore & regs()
+    {
+        if (store == nullptr) {make_map();}
+        return *store;
+    }
+
+    /// @brief don't think RUN. Single client mode serves one master until it leaves,
+    /// multi-client mode until stop() from another thread
+    /// @throws std::ios_base::failure when the map or the sockets can't be set up
+    void ezRun()
+    {
+        running = true;
+        prepare();
+        serve_prepared();
+    }
+
+    /// @brief epoll flavour of ezRun, runs worker 0 in this thread and the rest in their own
+    /// @throws std::ios_base::failure when sockets or epoll can't be set up
+    void ezRunMulti()
+    {
+        multi_client = true;
+        ezRun();
+    }
+
+    /// @brief treading stuff or smth. Listens before it returns, so clients can connect right away
+    /// (to get_port() when set_context() asked for port 0), restarts a server that was running
+    /// @throws same as ezRun(), in the calling thread
     inline void ezTreadstart()
     {
+        stop();
         running = true;
-        server = std::thread(&dumb_Mserver::ezRun, this);
+        prepare();
+        server = std::thread(&dumb_Mserver::serve_prepared, this);
     }
 
-    /// @brief Wanna join?
+    /// @brief Wanna join? Wakes the serving loops wherever they wait, returns as soon as they are out
     inline void stop() 
     {
         running = false;
+        eventfd_write(wake_fd, 1);
         if (server.joinable()) {
             server.join();
         }
+        if (sim != nullptr) {sim->stop();}
+    }
+
+    /// @brief port clients should connect to, the kernel's pick when set_context() asked for 0
+    /// @return 0 when not listening
+    inline int get_port() const {return bound_port;}
+
+    /// @brief back to the start-up values for the next test without touching sockets or threads,
+    /// clients stay connected and see the reset with their next request
+    inline void reset_map()
+    {
+        if (store == nullptr) {make_map();}
+        for (auto t : {RegTable::COILS, RegTable::INPUT_BITS, RegTable::HOLDING_REGS, RegTable::INPUT_REGS})
+        {
+            if (store->sparse(t)) {store->clear(t);} // seeding skips them, written blocks would stay
+        }
+        spawn_values();
     }
 
     /// @brief paterns are(100100,1010,2468,36912)
@@ -163,28 +1027,16 @@ public:
     /// @param rod ro_regs
     /// @param rwd rw_regs
     /// @return T on suc
+    /// @throws std::logic_error on resize while serving, workers hold the store
     bool spawn_values(const int &rob,const int &rwb,const int &rod,const int &rwd)
     {
         if ((ro_bits != rob) && (coil != rwb) && (ro_regs != rod) && (rw_regs != rwd))
         {
+            if (running) {throw std::logic_error("can't resize the map while serving");}
             setRegSizes(rob,rwb,rod,rwd);
         }
-        for (size_t i = 0; i < mb_mapping->nb_bits; i++)
-        {
-            mb_mapping->tab_bits[i] = i%3%2; //100100
-        }
-        for (size_t i = 0; i < mb_mapping->nb_input_bits; i++)
-        {
-            mb_mapping->tab_input_bits[i] = i%2;//1010
-        }
-        for (size_t i = 0; i < mb_mapping->nb_input_registers; i++)
-        {
-            mb_mapping->tab_input_registers[i] = i*2;
-        }
-        for (size_t i = 0; i < mb_mapping->nb_registers; i++)
-        {
-            mb_mapping->tab_registers[i] = i*3;
-        }
+        if (store == nullptr) {make_map();}
+        spawn_values();
         std::cerr << "spawned" << std::endl;
         return true;
         
@@ -194,7 +1046,13 @@ public:
     dumb_Mserver() = default;
 
     /// @brief bring up chaos and DESTRUCTION uppon those whimpy server objects
-    ~dumb_Mserver() {stop(); if (soc != -1){close(soc);close(port);} modbus_mapping_free(mb_mapping); modbus_close(context); modbus_free(context);};
+    ~dumb_Mserver()
+    {
+        stop();
+        if (soc != -1) {close(soc);}
+        if (context != nullptr) {modbus_free(context);}
+        close(wake_fd);
+    }
 
     /// @brief rudimentary @todo modify to a funny trap by adding @throw feathureNotImplemented
     void run();
@@ -1,27 +1,121 @@
-
 #include "DumbModbus.hpp"
+#include "DeviceFarm.hpp"
 
 #include <glog/logging.h>
 #include <gflags/gflags.h>
 
+DEFINE_string(ip, "127.0.0.1", "IP to listen on");
+DEFINE_int32(port, 1502, "Modbus TCP port, 0 = any free port (shown in the --report_ms lines)");
+DEFINE_int32(masters, 0, "serve up to N concurrent masters with epoll (0 = legacy single client, unless --pipelined or --low_latency)");
+DEFINE_int32(workers, 1, "serving threads with own SO_REUSEPORT listener each, 0 = one per core (multi-client mode)");
+DEFINE_bool(pipelined, false, "answer every complete frame of a socket read with one send (multi-client mode)");
+DEFINE_string(shm_map, "", "back the registers with this shm object (\"/name\") or file so other processes can drive them");
+DEFINE_string(sim, "", "register simulation profile (see SimEngine.hpp), default flips input register 6");
+DEFINE_string(farm, "", "serve the virtual devices of this farm file (see DeviceFarm.hpp) instead of one server");
+DEFINE_string(co, "20", "coils: count from 0, or sparse address ranges like 0..99,1000..1099");
+DEFINE_string(di, "20", "discrete inputs: count or sparse ranges");
+DEFINE_string(hr, "20", "holding registers: count or sparse ranges like 40000..40099");
+DEFINE_string(ir, "20", "input registers: count or sparse ranges like 30000..30049");
+DEFINE_string(capture, "", "write every request/reply with timestamps to this binary log, replay it with DumbMReplay");
+DEFINE_int32(reply_cache, 0, "cache up to N encoded read replies per serving thread, 0 = off");
+DEFINE_int32(metrics_port, 0, "serve Prometheus text metrics over HTTP on this port (multi-client mode), 0 = off");
+DEFINE_int32(metrics_dump_s, 0, "dump metrics to the log every N seconds, 0 = never");
+DEFINE_int32(report_ms, 0, "print connections and requests/s every N ms (multi-client mode)");
+DEFINE_bool(low_latency, false, "spin on nonblocking sockets with TCP_NODELAY/SO_BUSY_POLL instead of sleeping, burns a core per worker");
+DEFINE_int32(cpu, -1, "low latency: pin worker i to CPU cpu+i, -1 = no pinning");
+DEFINE_int32(busy_poll_us, 50, "low latency: SO_BUSY_POLL of client sockets in microseconds");
+
 // Validate flag values
 static bool ValidatePort(const char* flagname, int32_t value) {
-    if (value > 0 && value < 65536) return true;
+    if (value >= 0 && value < 65536) return true;
     std::cout << "Invalid value for --" << flagname << ": " << value << std::endl;
     return false;
 }
 DEFINE_validator(port, &ValidatePort);
 
-int main(char argc,char* argv)
+/// @brief names of the flags in list given on the command line
+static std::string given(const std::initializer_list<const char *> & list)
+{
+    std::string out;
+    for (auto &&name : list)
+    {
+        if (!gflags::GetCommandLineFlagInfoOrDie(name).is_default) {out += std::string(out.empty() ? "--" : ", --") + name;}
+    }
+    return out;
+}
+
+int main(int argc, char* argv[])
 {
     gflags::ParseCommandLineFlags(&argc, &argv, true);
 
     // Initialize glog
     google::InitGoogleLogging(argv[0]);
 
-    LOG(INFO) << "Server starting...";
+    // flags that would be silently ignored
+    std::string unused = FLAGS_farm.empty() ? "" : given({"port", "masters", "workers", "pipelined", "shm_map", "sim",
+                                                          "co", "di", "hr", "ir", "capture", "reply_cache", "metrics_port",
+                                                          "report_ms", "low_latency", "cpu", "busy_poll_us"});
+    if (!unused.empty())
+    {
+        std::cerr << unused << " don't apply to --farm, ports, workers, tables and rules come from the farm file" << std::endl;
+        return 2;
+    }
+    // set_pipelined() and set_low_latency() switch to multi-client mode on their own
+    bool multi_client = FLAGS_masters > 0 || FLAGS_pipelined || FLAGS_low_latency;
+    unused = multi_client ? "" : given({"workers", "metrics_port", "report_ms"});
+    if (!unused.empty())
+    {
+        std::cerr << unused << " only work in multi-client mode, add --masters=N" << std::endl;
+        return 2;
+    }
+    unused = FLAGS_low_latency ? "" : given({"cpu", "busy_poll_us"});
+    if (!unused.empty())
+    {
+        std::cerr << unused << " only work with --low_latency" << std::endl;
+        return 2;
+    }
+
+    if (!FLAGS_farm.empty())
+    {
+        DeviceFarm farm;
+        farm.set_ip(FLAGS_ip);
+        farm.load_file(FLAGS_farm);
+        farm.start();
+        LOG(INFO) << "Farm of " << farm.size() << " devices serving on " << FLAGS_ip;
+        for (;;)
+        {
+            std::this_thread::sleep_for(std::chrono::seconds(FLAGS_metrics_dump_s > 0 ? FLAGS_metrics_dump_s : 3600));
+            if (FLAGS_metrics_dump_s > 0) {LOG(INFO) << "metrics\n" << farm.metrics_text();}
+        }
+    }
+
+    LOG(INFO) << "Server starting on " << FLAGS_ip << ":" << FLAGS_port;
     dumb_Mserver srv;
-    srv.ezTreadstart();
+    srv.set_context(FLAGS_ip, FLAGS_port);
+    srv.set_reply_cache(std::max(0, FLAGS_reply_cache));
+    srv.set_capture(FLAGS_capture);
+    srv.setRegLayout(FLAGS_co, FLAGS_di, FLAGS_hr, FLAGS_ir);
+    if (!FLAGS_shm_map.empty()) {srv.set_shared_map(FLAGS_shm_map);}
+    if (!FLAGS_sim.empty()) {srv.set_simulation(FLAGS_sim);}
+    if (multi_client)
+    {
+        srv.set_multi_client(std::max(1, FLAGS_masters), std::chrono::milliseconds(FLAGS_report_ms));
+        srv.set_workers(FLAGS_workers);
+        srv.set_metrics_port(FLAGS_metrics_port);
+        srv.set_pipelined(FLAGS_pipelined);
+    }
+    if (FLAGS_low_latency) {srv.set_low_latency(FLAGS_cpu, FLAGS_busy_poll_us);}
+    if (FLAGS_metrics_dump_s > 0)
+    {
+        std::thread([&srv]{
+            for (;;)
+            {
+                std::this_thread::sleep_for(std::chrono::seconds(FLAGS_metrics_dump_s));
+                LOG(INFO) << "metrics\n" << srv.metrics_text();
+            }
+        }).detach();
+    }
+    srv.ezRun();
 
     return 0;
-}
\ No newline at end of file
+}
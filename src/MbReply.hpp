@@ -0,0 +1,244 @@
+#pragma once
+
+#include "RegisterStore.hpp"
+
+#include <cstddef>
+#include <cstdint>
+
+/// @brief modbus exception codes we answer with
+enum MbException : uint8_t
+{
+    MB_EX_ILLEGAL_FUNCTION = 0x01,
+    MB_EX_ILLEGAL_DATA_ADDRESS = 0x02,
+    MB_EX_ILLEGAL_DATA_VALUE = 0x03,
+    MB_EX_GATEWAY_TARGET_FAILED = 0x0B,
+};
+
+constexpr size_t MB_MBAP_LENGTH = 7;
+constexpr size_t MB_MAX_PDU_LENGTH = 253;
+constexpr size_t MB_MAX_ADU_LENGTH = MB_MBAP_LENGTH + MB_MAX_PDU_LENGTH;
+
+constexpr uint16_t MB_MAX_READ_BITS = 2000;
+constexpr uint16_t MB_MAX_WRITE_BITS = 1968;
+constexpr uint16_t MB_MAX_READ_REGISTERS = 125;
+constexpr uint16_t MB_MAX_WRITE_REGISTERS = 123;
+constexpr uint16_t MB_MAX_WR_WRITE_REGISTERS = 121;
+
+/// @brief Report Server ID answer: the id libmodbus reports, run indicator ON, then this text
+constexpr uint8_t MB_SERVER_ID = 0xB4;
+constexpr char MB_SERVER_ID_TEXT[] = "DumbMsrv";
+
+inline uint16_t mb_get16(const uint8_t * p) {return (uint16_t)((p[0] << 8) | p[1]);}
+inline void mb_put16(uint8_t * p, const uint16_t & v) {p[0] = v >> 8; p[1] = v & 0xFF;}
+
+/// @brief exception response pdu
+/// @return pdu length
+inline size_t mb_exception(const uint8_t & fc, const uint8_t & code, uint8_t * rsp)
+{
+    rsp[0] = fc | 0x80;
+    rsp[1] = code;
+    return 2;
+}
+
+/// @brief function codes mb_reply_pdu() answers besides Report Server ID
+constexpr bool mb_known_fc(const uint8_t & fc)
+{
+    return (fc >= 0x01 && fc <= 0x06) || fc == 0x0F || fc == 0x10 || fc == 0x16 || fc == 0x17;
+}
+
+/// @brief packs one-byte-per-bit values into the modbus bit order (LSB first)
+/// @return bytes written
+inline size_t mb_pack_bits(const uint8_t * bits, const uint16_t & nb, uint8_t * out)
+{
+    size_t bytes = (nb + 7) / 8;
+    for (size_t i = 0; i < bytes; i++) {out[i] = 0;}
+    for (uint16_t i = 0; i < nb; i++)
+    {
+        if (bits[i]) {out[i / 8] |= 1 << (i % 8);}
+    }
+    return bytes;
+}
+
+/// @brief answers one request pdu from the store (FC 1,2,3,4,5,6,15,16,17,22,23), everything else is Illegal Function
+/// @param store register map
+/// @param req request pdu, starts with the function code
+/// @param len request pdu length
+/// @param rsp out buffer, at least MB_MAX_PDU_LENGTH
+/// @return response pdu length
+inline size_t mb_reply_pdu(RegisterStore & store, const uint8_t * req, const size_t & len, uint8_t * rsp)
+{
+    if (len < 1) {return 0;}
+    const uint8_t fc = req[0];
+    if (fc == 0x11)
+    {
+        rsp[0] = fc;
+        rsp[2] = MB_SERVER_ID;
+        rsp[3] = 0xFF;
+        size_t n = sizeof(MB_SERVER_ID_TEXT) - 1;
+        for (size_t i = 0; i < n; i++) {rsp[4 + i] = MB_SERVER_ID_TEXT[i];}
+        rsp[1] = 2 + n;
+        return 2 + rsp[1];
+    }
+    if (!mb_known_fc(fc)) {return mb_exception(fc, MB_EX_ILLEGAL_FUNCTION, rsp);}
+    if (len < 5) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+
+    const uint16_t addr = mb_get16(req + 1);
+    const uint16_t val = mb_get16(req + 3);
+
+    switch (fc)
+    {
+    case 0x01:
+    case 0x02:
+    {
+        RegTable t = fc == 0x01 ? RegTable::COILS : RegTable::INPUT_BITS;
+        if (val < 1 || val > MB_MAX_READ_BITS) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+        uint8_t bits[MB_MAX_READ_BITS];
+        if (!store.read(t, addr, val, bits)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        rsp[0] = fc;
+        rsp[1] = mb_pack_bits(bits, val, rsp + 2);
+        return 2 + rsp[1];
+    }
+    case 0x03:
+    case 0x04:
+    {
+        RegTable t = fc == 0x03 ? RegTable::HOLDING_REGS : RegTable::INPUT_REGS;
+        if (val < 1 || val > MB_MAX_READ_REGISTERS) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+        uint16_t regs[MB_MAX_READ_REGISTERS];
+        if (!store.read(t, addr, val, regs)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        rsp[0] = fc;
+        rsp[1] = val * 2;
+        for (uint16_t i = 0; i < val; i++)
+        {
+            mb_put16(rsp + 2 + i * 2, regs[i]);
+        }
+        return 2 + rsp[1];
+    }
+    case 0x05:
+    {
+        if (val != 0xFF00 && val != 0x0000) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+        if (!store.set(RegTable::COILS, addr, val ? 1 : 0)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        for (size_t i = 0; i < 5; i++) {rsp[i] = req[i];}
+        return 5;
+    }
+    case 0x06:
+    {
+        if (!store.set(RegTable::HOLDING_REGS, addr, val)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        for (size_t i = 0; i < 5; i++) {rsp[i] = req[i];}
+        return 5;
+    }
+    case 0x0F:
+    {
+        if (val < 1 || val > MB_MAX_WRITE_BITS || len < 6 || req[5] != (val + 7) / 8 || len < 6u + req[5])
+        {
+            return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);
+        }
+        if (!store.in_range(RegTable::COILS, addr, val)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        uint8_t bits[MB_MAX_WRITE_BITS];
+        for (uint16_t i = 0; i < val; i++)
+        {
+            bits[i] = (req[6 + i / 8] >> (i % 8)) & 1;
+        }
+        store.write(RegTable::COILS, addr, val, bits);
+        for (size_t i = 0; i < 5; i++) {rsp[i] = req[i];}
+        return 5;
+    }
+    case 0x10:
+    {
+        if (val < 1 || val > MB_MAX_WRITE_REGISTERS || len < 6 || req[5] != val * 2 || len < 6u + req[5])
+        {
+            return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);
+        }
+        if (!store.in_range(RegTable::HOLDING_REGS, addr, val)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        uint16_t regs[MB_MAX_WRITE_REGISTERS];
+        for (uint16_t i = 0; i < val; i++)
+        {
+            regs[i] = mb_get16(req + 6 + i * 2);
+        }
+        store.write(RegTable::HOLDING_REGS, addr, val, regs);
+        for (size_t i = 0; i < 5; i++) {rsp[i] = req[i];}
+        return 5;
+    }
+    case 0x16:
+    {
+        if (len < 7) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+        if (!store.in_range(RegTable::HOLDING_REGS, addr, 1)) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);}
+        const uint16_t or_mask = mb_get16(req + 5);
+        {
+            auto b = store.batch(RegTable::HOLDING_REGS); // read-modify-write in one seqlock round
+            b.set(addr, (b.get(addr) & val) | (or_mask & ~val));
+        }
+        for (size_t i = 0; i < 7; i++) {rsp[i] = req[i];}
+        return 7;
+    }
+    case 0x17:
+    {
+        if (len < 10) {return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);}
+        const uint16_t waddr = mb_get16(req + 5);
+        const uint16_t wnb = mb_get16(req + 7);
+        if (val < 1 || val > MB_MAX_READ_REGISTERS || wnb < 1 || wnb > MB_MAX_WR_WRITE_REGISTERS ||
+            req[9] != wnb * 2 || len < 10u + req[9])
+        {
+            return mb_exception(fc, MB_EX_ILLEGAL_DATA_VALUE, rsp);
+        }
+        if (!store.in_range(RegTable::HOLDING_REGS, addr, val) || !store.in_range(RegTable::HOLDING_REGS, waddr, wnb))
+        {
+            return mb_exception(fc, MB_EX_ILLEGAL_DATA_ADDRESS, rsp);
+        }
+        uint16_t regs[MB_MAX_READ_REGISTERS];
+        for (uint16_t i = 0; i < wnb; i++)
+        {
+            regs[i] = mb_get16(req + 10 + i * 2);
+        }
+        store.write(RegTable::HOLDING_REGS, waddr, wnb, regs);
+        store.read(RegTable::HOLDING_REGS, addr, val, regs);
+        rsp[0] = fc;
+        rsp[1] = val * 2;
+        for (uint16_t i = 0; i < val; i++)
+        {
+            mb_put16(rsp + 2 + i * 2, regs[i]);
+        }
+        return 2 + rsp[1];
+    }
+    default:
+        return mb_exception(fc, MB_EX_ILLEGAL_FUNCTION, rsp);
+    }
+}
+
+/// @brief answers one modbus TCP frame: copies the MBAP header, fixes its length field
+/// @param adu request frame (MBAP + pdu)
+/// @param len frame length
+/// @param rsp out buffer, at least MB_MAX_ADU_LENGTH
+/// @return response frame length, 0 if the frame is too short to answer
+inline size_t mb_reply_adu(RegisterStore & store, const uint8_t * adu, const size_t & len, uint8_t * rsp)
+{
+    if (len < MB_MBAP_LENGTH + 1) {return 0;}
+    size_t pdu = mb_reply_pdu(store, adu + MB_MBAP_LENGTH, len - MB_MBAP_LENGTH, rsp + MB_MBAP_LENGTH);
+    for (size_t i = 0; i < 4; i++) {rsp[i] = adu[i];}
+    mb_put16(rsp + 4, pdu + 1);
+    rsp[6] = adu[6];
+    return MB_MBAP_LENGTH + pdu;
+}
+
+/// @brief exception response to a request ADU, same MBAP, for requests nobody can answer (e.g. unknown unit)
+/// @return response length
+inline size_t mb_exception_adu(const uint8_t * adu, const uint8_t & code, uint8_t * rsp)
+{
+    for (size_t i = 0; i < 4; i++) {rsp[i] = adu[i];}
+    mb_put16(rsp + 4, 3);
+    rsp[6] = adu[6];
+    return MB_MBAP_LENGTH + mb_exception(adu[MB_MBAP_LENGTH], code, rsp + MB_MBAP_LENGTH);
+}
+
+/// @brief length of the complete frame at the head of a receive buffer
+/// @param buf received bytes
+/// @param avail how many of them
+/// @return frame length, 0 if more bytes are needed, -1 if this is no modbus TCP (drop the connection)
+inline long mb_frame_length(const uint8_t * buf, const size_t & avail)
+{
+    if (avail < MB_MBAP_LENGTH) {return 0;}
+    uint16_t proto = mb_get16(buf + 2);
+    uint16_t len = mb_get16(buf + 4);
+    if (proto != 0 || len < 2 || len > MB_MAX_PDU_LENGTH + 1) {return -1;}
+    size_t total = MB_MBAP_LENGTH - 1 + len;
+    return avail >= total ? (long)total : 0;
+}
@@ -0,0 +1,128 @@
+#pragma once
+
+#include "modbus/modbus.h"
+#include "DataBucket.hpp"
+#include "SpscQueue.hpp"
+#include "TaskScheduler.hpp"
+
+#include <atomic>
+#include <cerrno>
+#include <chrono>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <thread>
+
+/// @brief test-side modbus master: addtask() from one thread, a link thread drains the queue in batches
+/// and pushes them through TaskScheduler, so a polling set of scattered registers costs a few frames.
+class ModbusRos
+{
+public:
+
+    /// @brief tasks waiting for the link thread, addtask() spins when it is full
+    static constexpr size_t QUEUE = 4096;
+    /// @brief most tasks planned together
+    static constexpr size_t BATCH = 512;
+
+private:
+
+    modbus_t * ctx = nullptr;
+    std::unique_ptr<SpscQueue<DataBucket *, QUEUE>> queue = std::make_unique<SpscQueue<DataBucket *, QUEUE>>();
+    TaskScheduler sched;
+    std::atomic_bool running{false};
+    std::thread link;
+    DataBucket * batch[BATCH];
+    uint8_t bits[MB_MAX_READ_BITS];
+    std::atomic<uint64_t> frames{0};
+
+    /// @brief one transaction for the scheduler
+    int16_t io(const char & op, const uint16_t & start, const uint16_t & qty, uint16_t * buf)
+    {
+        int rc = -1;
+        switch (op)
+        {
+        case 'R': rc = modbus_read_input_registers(ctx, start, qty, buf); break;
+        case 'H': rc = modbus_read_registers(ctx, start, qty, buf); break;
+        case 'W': rc = modbus_write_registers(ctx, start, qty, buf); break;
+        case 'c':
+        case 'd':
+            rc = op == 'c' ? modbus_read_bits(ctx, start, qty, bits) : modbus_read_input_bits(ctx, start, qty, bits);
+            std::fill_n(buf, (qty + 15) / 16, 0);
+            for (int i = 0; i < rc; i++) {buf[i >> 4] |= uint16_t((bits[i] ? 1u : 0u) << (i & 15));}
+            break;
+        case 'w':
+            for (int i = 0; i < qty; i++) {bits[i] = (buf[i >> 4] >> (i & 15)) & 1;}
+            rc = modbus_write_bits(ctx, start, qty, bits);
+            break;
+        default: return MB_EX_ILLEGAL_FUNCTION;
+        }
+        if (rc != -1) {return DataBucket::OK;}
+        // libmodbus reports exception replies as MODBUS_ENOBASE + code
+        if (errno > MODBUS_ENOBASE && errno <= MODBUS_ENOBASE + 0xFF) {return int16_t(errno - MODBUS_ENOBASE);}
+        return DataBucket::FAILED;
+    }
+
+    void loop()
+    {
+        while (running)
+        {
+            size_t n = 0;
+            while (n < BATCH && queue->try_pop(batch[n])) {n++;}
+            if (n == 0)
+            {
+                std::this_thread::sleep_for(std::chrono::microseconds(100));
+                continue;
+            }
+            frames += sched.run(batch, n, [this](char op, uint16_t start, uint16_t qty, uint16_t * buf) {return io(op, start, qty, buf);});
+        }
+    }
+
+public:
+
+    ModbusRos() = default;
+    ModbusRos(const ModbusRos &) = delete;
+    ~ModbusRos() {unlink();}
+
+    /// @brief queues a task, the link thread completes it
+    /// @param task must live until it is done, single producer
+    inline void addtask(DataBucket * task)
+    {
+        task->reset();
+        while (!queue->try_push(task)) {std::this_thread::yield();}
+    }
+
+    /// @brief (re)connects and starts the link thread, tasks queued before are served right after
+    /// @throws std::ios_base::failure when the server is not there
+    void relink(const std::string & ip, const int & port)
+    {
+        unlink();
+        ctx = modbus_new_tcp(ip.c_str(), port);
+        if (ctx == nullptr) {throw std::ios_base::failure("Failed to create the Modbus context!");}
+        if (modbus_connect(ctx) == -1)
+        {
+            modbus_free(ctx);
+            ctx = nullptr;
+            throw std::ios_base::failure("connect to " + ip + ":" + std::to_string(port) + " failed");
+        }
+        running = true;
+        link = std::thread(&ModbusRos::loop, this);
+    }
+
+    /// @brief stops the link thread and drops the connection, queued tasks stay queued
+    void unlink()
+    {
+        running = false;
+        if (link.joinable()) {link.join();}
+        if (ctx != nullptr)
+        {
+            modbus_close(ctx);
+            modbus_free(ctx);
+            ctx = nullptr;
+        }
+    }
+
+    /// @brief read gaps the scheduler may bridge, see TaskScheduler, call it while unlinked
+    inline void set_max_gap(const uint16_t & gap) {sched.set_max_gap(gap);}
+    /// @brief transactions sent so far
+    inline uint64_t sent() const {return frames;}
+};
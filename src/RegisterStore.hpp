@@ -0,0 +1,664 @@
+#pragma once
+
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <ios>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+/// @brief the four modbus tables, value is the slot in RegStoreHeader arrays
+enum class RegTable : uint8_t
+{
+    COILS = 0,
+    INPUT_BITS = 1,
+    HOLDING_REGS = 2,
+    INPUT_REGS = 3,
+};
+
+/// @brief true for the one-byte-per-bit tables
+inline constexpr bool is_bit_table(const RegTable & t) {return t == RegTable::COILS || t == RegTable::INPUT_BITS;}
+
+/// @brief what one table holds: count addresses from 0 (dense), or the listed address ranges of
+/// the whole 64K space (sparse). Sparse tables only take memory for the 64-address blocks that
+/// were written at least once; everything outside the ranges answers Illegal Data Address.
+struct RegTableSpec
+{
+    uint32_t count = 0;
+    /// @brief inclusive [first, last] pairs, non empty = sparse
+    std::vector<std::pair<uint32_t, uint32_t>> ranges;
+
+    inline bool sparse() const {return !ranges.empty();}
+
+    /// @brief "100" is a dense table of 100, "40000..40099,40200" sparse ranges
+    /// @throws std::invalid_argument on garbage or addresses past 65535
+    static RegTableSpec parse(const std::string & s)
+    {
+        RegTableSpec spec;
+        if (s.find_first_of(".,") == std::string::npos)
+        {
+            spec.count = std::stoul(s);
+            if (spec.count > 65536) {throw std::invalid_argument("table size " + s + " past 65536");}
+            return spec;
+        }
+        size_t pos = 0;
+        while (pos <= s.size())
+        {
+            size_t comma = std::min(s.find(',', pos), s.size());
+            std::string r = s.substr(pos, comma - pos);
+            size_t dots = r.find("..");
+            uint32_t first = std::stoul(r.substr(0, dots));
+            uint32_t last = dots == std::string::npos ? first : std::stoul(r.substr(dots + 2));
+            if (last < first || last > 65535) {throw std::invalid_argument("bad address range " + r);}
+            spec.ranges.push_back({first, last});
+            pos = comma + 1;
+        }
+        return spec;
+    }
+};
+
+/// @brief POD header in front of the tables, so the whole store is one flat chunk of memory.
+/// Shared map layout (native endianness, everything little endian on x86/arm):
+/// @code
+///   0  u32 magic "MBRS"  (0 while the server lays the map out)
+///   4  u32 version
+///   8  u32 seq[4]        seqlock of COILS, INPUT_BITS, HOLDING_REGS, INPUT_REGS
+///  24  u32 start[4]      first address
+///  40  u32 count[4]      addresses (65536 for sparse tables)
+///  56  u32 offset[4]     table byte offset, 64 aligned: bits are u8 0/1, registers u16
+///  72  u32 gen_offset[4] u32 generation per 64 addresses
+///  88  u32 page_offset[4] sparse: u16 page entry per 64 addresses, 0 = dense table
+/// 104  u32 mask_offset[4] sparse: u64 per page, bit a % 64 set = address a is defined
+/// 120  u32 blocks[4]     sparse: 64-address blocks the table area has room for
+/// 136  u32 used_blocks[4] sparse: blocks handed out so far
+/// @endcode
+/// Dense element i sits at offset + i * size. Sparse page entry e of address a (page a / 64):
+/// 0 = nothing defined, 1 = defined but never written (reads 0), e >= 2 = block e - 2 of the table
+/// area, element at offset + ((e - 2) * 64 + a % 64) * size.
+/// Reader: s1 = seq (acquire), retry while odd, copy, s2 = seq, retry if s1 != s2.
+/// Writer: CAS seq from even s to s+1, store values (a first write into a page with entry 1 takes
+/// block used_blocks and sets the entry to used_blocks + 2), add 1 to the generations of the touched
+/// 64-address blocks, store seq s+2 (release). Skipping the generations leaves stale cached replies.
+struct RegStoreHeader
+{
+    uint32_t magic;
+    uint32_t version;
+    /// @brief seqlock per table, odd while somebody writes
+    uint32_t seq[4];
+    /// @brief first modbus address of each table
+    uint32_t start[4];
+    /// @brief number of addresses in each table
+    uint32_t count[4];
+    /// @brief byte offset of each table from the beginning of the header
+    uint32_t offset[4];
+    /// @brief byte offset of the generation counters of each table (uint32 per GEN_BLOCK addresses)
+    uint32_t gen_offset[4];
+    /// @brief byte offset of the page table of a sparse table, 0 = dense
+    uint32_t page_offset[4];
+    /// @brief byte offset of the defined address bitmap of a sparse table
+    uint32_t mask_offset[4];
+    /// @brief sparse: capacity of the table area in blocks
+    uint32_t blocks[4];
+    /// @brief sparse: blocks taken, only changed inside the write section
+    uint32_t used_blocks[4];
+};
+
+/// @brief register map shared by the serving loop(s) and test code.
+/// Every table is guarded by its own seqlock: writers (server or caller threads) never wait for readers,
+/// readers never block writers and just retry the copy when a write overlapped, so a multi-register
+/// read is always a consistent snapshot of the table.
+class RegisterStore
+{
+private:
+
+    /// @brief anonymous or shared mapping, unmapped on destruction
+    void * mapped = nullptr;
+    bool is_shared = false;
+    RegStoreHeader * hdr = nullptr;
+    size_t region_size = 0;
+
+    /// @brief "/name" is a POSIX shared memory object, anything else a plain file
+    static int open_backing(const std::string & path, const int & flags)
+    {
+        bool shm = path.size() > 1 && path[0] == '/' && path.find('/', 1) == std::string::npos;
+        int fd = shm ? shm_open(path.c_str(), flags, 0666) : open(path.c_str(), flags | O_CLOEXEC, 0666);
+        if (fd == -1)
+        {
+            throw std::ios_base::failure("can't open register map " + path + ": " + std::strerror(errno));
+        }
+        return fd;
+    }
+
+    /// @brief maps fd, closes it either way
+    void map_fd(const int & fd, const std::string & path)
+    {
+        mapped = mmap(nullptr, region_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+        if (mapped == MAP_FAILED)
+        {
+            mapped = nullptr;
+            throw std::ios_base::failure("can't map register map " + path + ": " + std::strerror(errno));
+        }
+        hdr = (RegStoreHeader *)mapped;
+        is_shared = true;
+    }
+
+    static RegTableSpec dense(const int & n)
+    {
+        if (n < 0 || n > 65536) {throw std::overflow_error("register table size out of 0..65536");}
+        RegTableSpec spec;
+        spec.count = n;
+        return spec;
+    }
+
+    /// @brief writes the header and the page tables into zeroed memory at hdr, publishes the magic last
+    void lay_out(const RegTableSpec spec[4])
+    {
+        RegStoreHeader h{};
+        layout_size(spec, &h);
+        h.magic = 0;
+        h.version = VERSION;
+        std::memcpy((void *)hdr, &h, sizeof(h));
+        for (int i = 0; i < 4; i++)
+        {
+            // generations start at 1 so range_gen() of a valid range is never 0
+            uint32_t * g = (uint32_t *)((uint8_t *)hdr + h.gen_offset[i]);
+            std::fill(g, g + (h.count[i] + GEN_BLOCK - 1) / GEN_BLOCK, 1u);
+            if (!spec[i].sparse()) {continue;}
+            uint16_t * pages = (uint16_t *)((uint8_t *)hdr + h.page_offset[i]);
+            uint64_t * mask = (uint64_t *)((uint8_t *)hdr + h.mask_offset[i]);
+            for (auto &&[first, last] : spec[i].ranges)
+            {
+                std::fill(pages + first / GEN_BLOCK, pages + last / GEN_BLOCK + 1, PAGE_EMPTY);
+                for (uint32_t a = first; a <= last; a++) {mask[a / GEN_BLOCK] |= (uint64_t)1 << (a % GEN_BLOCK);}
+            }
+        }
+        std::atomic_ref<uint32_t>(hdr->magic).store(MAGIC, std::memory_order_release);
+    }
+
+    /// @brief zero filled private memory, untouched pages cost nothing
+    void map_anon()
+    {
+        mapped = mmap(nullptr, region_size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+        if (mapped == MAP_FAILED)
+        {
+            mapped = nullptr;
+            throw std::overflow_error("mem fuckup");
+        }
+        hdr = (RegStoreHeader *)mapped;
+    }
+
+    /// @brief (re)creates and maps the shared map at path, zeroed
+    void map_shared(const std::string & path)
+    {
+        int fd = open_backing(path, O_RDWR | O_CREAT);
+        // shrinking to 0 first zeroes the old content without touching every page
+        if (ftruncate(fd, 0) == -1 || ftruncate(fd, region_size) == -1)
+        {
+            close(fd);
+            throw std::ios_base::failure("can't size register map " + path + ": " + std::strerror(errno));
+        }
+        map_fd(fd, path);
+    }
+
+    RegisterStore() = default;
+
+    static inline void cpu_relax()
+    {
+#if defined(__x86_64__) || defined(__i386__)
+        __builtin_ia32_pause();
+#endif
+    }
+
+    inline std::atomic_ref<uint32_t> seq(const RegTable & t) const {return std::atomic_ref<uint32_t>(hdr->seq[(int)t]);}
+
+    inline uint8_t * base(const RegTable & t) const {return (uint8_t *)hdr + hdr->offset[(int)t];}
+
+    inline std::atomic_ref<uint32_t> gen(const RegTable & t, const uint32_t & block) const
+    {
+        return std::atomic_ref<uint32_t>(((uint32_t *)((uint8_t *)hdr + hdr->gen_offset[(int)t]))[block]);
+    }
+
+    /// @brief bumps generations of the blocks holding table indexes [lo, hi], inside the write section
+    inline void bump_gens(const RegTable & t, const uint32_t & lo, const uint32_t & hi)
+    {
+        for (uint32_t b = lo / GEN_BLOCK; b <= hi / GEN_BLOCK; b++)
+        {
+            gen(t, b).fetch_add(1, std::memory_order_release);
+        }
+    }
+
+    inline std::atomic_ref<uint16_t> page(const RegTable & t, const uint32_t & idx) const
+    {
+        return std::atomic_ref<uint16_t>(((uint16_t *)((uint8_t *)hdr + hdr->page_offset[(int)t]))[idx / GEN_BLOCK]);
+    }
+
+    /// @brief where table index idx lives, T is uint8_t for bits and uint16_t for registers
+    /// @return nullptr for a sparse block nobody wrote yet
+    template<typename T>
+    inline T * elem(const RegTable & t, const uint32_t & idx) const
+    {
+        if (hdr->page_offset[(int)t] == 0) {return (T *)base(t) + idx;}
+        uint16_t e = page(t, idx).load(std::memory_order_relaxed);
+        if (e < PAGE_FIRST) {return nullptr;}
+        return (T *)base(t) + (size_t)(e - PAGE_FIRST) * GEN_BLOCK + idx % GEN_BLOCK;
+    }
+
+    /// @brief relaxed element load
+    template<typename T>
+    inline T load(const RegTable & t, const uint32_t & idx) const
+    {
+        T * p = elem<T>(t, idx);
+        return p != nullptr ? std::atomic_ref<T>(*p).load(std::memory_order_relaxed) : 0;
+    }
+
+    /// @brief relaxed element store inside the write section, gives a sparse block its memory on first touch
+    template<typename T>
+    inline void store_elem(const RegTable & t, const uint32_t & idx, const T & v)
+    {
+        T * p = elem<T>(t, idx);
+        if (p == nullptr)
+        {
+            auto e = page(t, idx);
+            uint32_t & used = hdr->used_blocks[(int)t];
+            if (e.load(std::memory_order_relaxed) != PAGE_EMPTY || used >= hdr->blocks[(int)t]) {return;} // undefined address
+            e.store(PAGE_FIRST + used++, std::memory_order_relaxed);
+            p = elem<T>(t, idx);
+        }
+        std::atomic_ref<T>(*p).store(v, std::memory_order_relaxed);
+    }
+
+    inline void store(const RegTable & t, const uint32_t & idx, const uint16_t & v)
+    {
+        if (is_bit_table(t))
+        {
+            store_elem<uint8_t>(t, idx, v ? 1 : 0);
+        }
+        else
+        {
+            store_elem<uint16_t>(t, idx, v);
+        }
+    }
+
+    /// @brief seqlock read, copies [addr, addr+nb) into out
+    template<typename T>
+    bool snapshot(const RegTable & t, const uint32_t & addr, const uint32_t & nb, T * out) const
+    {
+        if (!in_range(t, addr, nb)) {return false;}
+        uint32_t from = addr - hdr->start[(int)t];
+        auto s = seq(t);
+        for (;;)
+        {
+            uint32_t s1 = s.load(std::memory_order_acquire);
+            if (s1 & 1)
+            {
+                cpu_relax();
+                continue;
+            }
+            for (uint32_t i = 0; i < nb; i++)
+            {
+                out[i] = load<T>(t, from + i);
+            }
+            std::atomic_thread_fence(std::memory_order_acquire);
+            if (s.load(std::memory_order_relaxed) == s1) {return true;}
+        }
+    }
+
+public:
+
+    static constexpr uint32_t MAGIC = 0x5352424D; // "MBRS"
+    static constexpr uint32_t VERSION = 2;
+    /// @brief addresses per generation counter and per sparse page
+    static constexpr uint32_t GEN_BLOCK = 64;
+    /// @brief sparse page entries: undefined, defined without memory yet, first block
+    static constexpr uint16_t PAGE_UNDEFINED = 0;
+    static constexpr uint16_t PAGE_EMPTY = 1;
+    static constexpr uint16_t PAGE_FIRST = 2;
+
+    /// @brief bytes needed for a store of the given tables, every area is 64 byte aligned
+    /// @param spec tables in RegTable order
+    /// @param h if not nullptr receives start, count and every offset and capacity
+    static size_t layout_size(const RegTableSpec spec[4], RegStoreHeader * h = nullptr)
+    {
+        RegStoreHeader tmp{};
+        if (h == nullptr) {h = &tmp;}
+        auto take = [pos = (sizeof(RegStoreHeader) + 63) & ~size_t(63)](const size_t & bytes) mutable {
+            size_t at = pos;
+            pos += (bytes + 63) & ~size_t(63);
+            return at;
+        };
+        for (int i = 0; i < 4; i++)
+        {
+            size_t esz = is_bit_table((RegTable)i) ? 1 : sizeof(uint16_t);
+            h->start[i] = 0;
+            if (spec[i].sparse())
+            {
+                std::vector<bool> used(65536 / GEN_BLOCK);
+                for (auto &&[first, last] : spec[i].ranges)
+                {
+                    for (uint32_t b = first / GEN_BLOCK; b <= last / GEN_BLOCK; b++) {used[b] = true;}
+                }
+                h->count[i] = 65536;
+                h->blocks[i] = std::count(used.begin(), used.end(), true);
+                h->offset[i] = take((size_t)h->blocks[i] * GEN_BLOCK * esz);
+                h->page_offset[i] = take(65536 / GEN_BLOCK * sizeof(uint16_t));
+                h->mask_offset[i] = take(65536 / GEN_BLOCK * sizeof(uint64_t));
+            }
+            else
+            {
+                h->count[i] = spec[i].count;
+                h->offset[i] = take(spec[i].count * esz);
+            }
+        }
+        for (int i = 0; i < 4; i++)
+        {
+            h->gen_offset[i] = take((h->count[i] + GEN_BLOCK - 1) / GEN_BLOCK * sizeof(uint32_t));
+        }
+        return take(0);
+    }
+
+    /// @brief same argument order as modbus_mapping_new(), every table starts at address 0
+    /// @throws std::overflow_error on bad sizes or allocation failure
+    RegisterStore(const int & nb_bits, const int & nb_input_bits, const int & nb_registers, const int & nb_input_registers)
+    {
+        RegTableSpec spec[4] = {dense(nb_bits), dense(nb_input_bits), dense(nb_registers), dense(nb_input_registers)};
+        region_size = layout_size(spec);
+        map_anon();
+        lay_out(spec);
+    }
+
+    /// @brief any mix of dense and sparse tables, in RegTable order
+    /// @throws std::overflow_error on bad sizes or allocation failure
+    explicit RegisterStore(const RegTableSpec (&spec)[4])
+    {
+        for (auto &&t : spec) {if (!t.sparse()) {dense(t.count);}}
+        region_size = layout_size(spec);
+        map_anon();
+        lay_out(spec);
+    }
+
+    /// @brief store living in a shared map other processes can attach() to and read/write without
+    /// asking us. The map is (re)created with the given sizes and zeroed, it stays there after we're gone.
+    /// @param path "/name" for shm_open(), any other path for a plain file (e.g. on a tmpfs)
+    /// @throws std::overflow_error on bad sizes, std::ios_base::failure when the map can't be set up
+    RegisterStore(const std::string & path, const int & nb_bits, const int & nb_input_bits, const int & nb_registers, const int & nb_input_registers)
+    {
+        RegTableSpec spec[4] = {dense(nb_bits), dense(nb_input_bits), dense(nb_registers), dense(nb_input_registers)};
+        region_size = layout_size(spec);
+        map_shared(path);
+        lay_out(spec);
+    }
+
+    /// @brief shared map with any mix of dense and sparse tables
+    /// @throws std::overflow_error on bad sizes, std::ios_base::failure when the map can't be set up
+    RegisterStore(const std::string & path, const RegTableSpec (&spec)[4])
+    {
+        for (auto &&t : spec) {if (!t.sparse()) {dense(t.count);}}
+        region_size = layout_size(spec);
+        map_shared(path);
+        lay_out(spec);
+    }
+
+    /// @brief joins a map made by the path constructor, sizes come from its header
+    /// @throws std::ios_base::failure when there is no map or it isn't laid out (yet)
+    static std::unique_ptr<RegisterStore> attach(const std::string & path)
+    {
+        int fd = open_backing(path, O_RDWR);
+        struct stat st{};
+        if (fstat(fd, &st) == -1 || (size_t)st.st_size < sizeof(RegStoreHeader))
+        {
+            close(fd);
+            throw std::ios_base::failure("register map " + path + " is too short");
+        }
+        std::unique_ptr<RegisterStore> s(new RegisterStore());
+        s->region_size = st.st_size;
+        s->map_fd(fd, path);
+        RegStoreHeader * h = s->hdr;
+        if (std::atomic_ref<uint32_t>(h->magic).load(std::memory_order_acquire) != MAGIC || h->version != VERSION)
+        {
+            throw std::ios_base::failure("register map " + path + " has no valid header");
+        }
+        for (int i = 0; i < 4; i++)
+        {
+            size_t esz = is_bit_table((RegTable)i) ? 1 : sizeof(uint16_t);
+            size_t table = h->page_offset[i] ? (size_t)h->blocks[i] * GEN_BLOCK * esz : (size_t)h->count[i] * esz;
+            size_t pages = h->page_offset[i] ? 65536 / GEN_BLOCK * sizeof(uint16_t) : 0;
+            size_t mask = h->page_offset[i] ? 65536 / GEN_BLOCK * sizeof(uint64_t) : 0;
+            size_t gens = (h->count[i] + GEN_BLOCK - 1) / GEN_BLOCK * sizeof(uint32_t);
+            if (h->count[i] > 65536 || h->offset[i] + table > s->region_size || h->page_offset[i] + pages > s->region_size ||
+                h->mask_offset[i] + mask > s->region_size ||
+                h->gen_offset[i] + gens > s->region_size)
+            {
+                throw std::ios_base::failure("register map " + path + " layout doesn't match");
+            }
+        }
+        return s;
+    }
+
+    /// @brief removes a map made by the path constructor, the ones still attached keep working
+    static bool remove(const std::string & path)
+    {
+        bool shm = path.size() > 1 && path[0] == '/' && path.find('/', 1) == std::string::npos;
+        return (shm ? shm_unlink(path.c_str()) : unlink(path.c_str())) == 0;
+    }
+
+    RegisterStore(const RegisterStore &) = delete;
+    RegisterStore & operator=(const RegisterStore &) = delete;
+    ~RegisterStore()
+    {
+        if (mapped != nullptr) {munmap(mapped, region_size);}
+    }
+
+    /// @brief true when backed by a shared map
+    inline bool shared() const {return is_shared;}
+
+    /// @brief table with a page table, see RegTableSpec
+    inline bool sparse(const RegTable & t) const {return hdr->page_offset[(int)t] != 0;}
+
+    /// @brief sparse blocks that got memory so far
+    inline uint32_t used_blocks(const RegTable & t) const {return std::atomic_ref<uint32_t>(hdr->used_blocks[(int)t]).load(std::memory_order_relaxed);}
+
+    inline uint32_t start(const RegTable & t) const {return hdr->start[(int)t];}
+    inline uint32_t count(const RegTable & t) const {return hdr->count[(int)t];}
+
+    /// @brief [addr, addr+nb) lies inside the table (every page of it defined, for sparse ones)
+    inline bool in_range(const RegTable & t, const uint32_t & addr, const uint32_t & nb) const
+    {
+        if (addr < hdr->start[(int)t] || addr + nb > hdr->start[(int)t] + hdr->count[(int)t]) {return false;}
+        if (hdr->page_offset[(int)t] == 0 || nb == 0) {return true;}
+        const uint64_t * mask = (const uint64_t *)((uint8_t *)hdr + hdr->mask_offset[(int)t]);
+        uint32_t from = addr - hdr->start[(int)t];
+        uint32_t to = from + nb - 1;
+        for (uint32_t b = from / GEN_BLOCK; b <= to / GEN_BLOCK; b++)
+        {
+            // bits of this page the range covers
+            uint32_t lo = b == from / GEN_BLOCK ? from % GEN_BLOCK : 0;
+            uint32_t hi = b == to / GEN_BLOCK ? to % GEN_BLOCK : GEN_BLOCK - 1;
+            uint64_t want = (~(uint64_t)0 >> (63 - hi)) & (~(uint64_t)0 << lo);
+            if ((mask[b] & want) != want) {return false;}
+        }
+        return true;
+    }
+
+    /// @brief changes whenever a write touches [addr, addr+nb), read it before the data it guards.
+    /// Sum of the generation counters of the covered blocks; counters only grow, so does the sum.
+    /// @return 0 if the range is outside the table
+    uint64_t range_gen(const RegTable & t, const uint32_t & addr, const uint32_t & nb) const
+    {
+        if (nb == 0 || !in_range(t, addr, nb)) {return 0;}
+        uint32_t from = addr - hdr->start[(int)t];
+        uint64_t sum = 0;
+        for (uint32_t b = from / GEN_BLOCK; b <= (from + nb - 1) / GEN_BLOCK; b++)
+        {
+            sum += gen(t, b).load(std::memory_order_acquire);
+        }
+        return sum;
+    }
+
+    /// @brief consistent copy of bits (one byte per bit)
+    /// @return false if the range is outside the table
+    inline bool read(const RegTable & t, const uint32_t & addr, const uint32_t & nb, uint8_t * out) const
+    {
+        if (!is_bit_table(t)) {return false;}
+        return snapshot<uint8_t>(t, addr, nb, out);
+    }
+
+    /// @brief consistent copy of registers
+    /// @return false if the range is outside the table
+    inline bool read(const RegTable & t, const uint32_t & addr, const uint32_t & nb, uint16_t * out) const
+    {
+        if (is_bit_table(t)) {return false;}
+        return snapshot<uint16_t>(t, addr, nb, out);
+    }
+
+    /// @brief single value, bits come back as 0/1
+    inline uint16_t get(const RegTable & t, const uint32_t & addr) const
+    {
+        uint16_t v = 0;
+        if (is_bit_table(t))
+        {
+            uint8_t b = 0;
+            read(t, addr, 1, &b);
+            v = b;
+        }
+        else
+        {
+            read(t, addr, 1, &v);
+        }
+        return v;
+    }
+
+    /// @brief takes the table seqlock, spins while another writer holds it
+    void write_begin(const RegTable & t)
+    {
+        auto s = seq(t);
+        uint32_t cur = s.load(std::memory_order_relaxed);
+        for (;;)
+        {
+            if (!(cur & 1) && s.compare_exchange_weak(cur, cur + 1, std::memory_order_acq_rel, std::memory_order_relaxed))
+            {
+                break;
+            }
+            cpu_relax();
+            cur = s.load(std::memory_order_relaxed);
+        }
+        std::atomic_thread_fence(std::memory_order_release);
+    }
+
+    /// @brief publishes everything written since write_begin
+    inline void write_end(const RegTable & t)
+    {
+        seq(t).fetch_add(1, std::memory_order_release);
+    }
+
+    /// @brief RAII write section: many stores, one seqlock round, readers see all of them or none.
+    /// Generations of the touched blocks are bumped on the way out.
+    class Batch
+    {
+    private:
+        RegisterStore & s;
+        RegTable t;
+        uint32_t lo = UINT32_MAX;
+        uint32_t hi = 0;
+    public:
+        Batch(RegisterStore & store, const RegTable & table) : s(store), t(table) {s.write_begin(t);}
+        Batch(const Batch &) = delete;
+        ~Batch()
+        {
+            if (lo <= hi) {s.bump_gens(t, lo, hi);}
+            s.write_end(t);
+        }
+
+        /// @brief absolute address, caller checks the range
+        inline void set(const uint32_t & addr, const uint16_t & v)
+        {
+            uint32_t idx = addr - s.start(t);
+            lo = std::min(lo, idx);
+            hi = std::max(hi, idx);
+            s.store(t, idx, v);
+        }
+        inline uint16_t get(const uint32_t & addr) const
+        {
+            return is_bit_table(t) ? s.load<uint8_t>(t, addr - s.start(t)) : s.load<uint16_t>(t, addr - s.start(t));
+        }
+    };
+
+    inline Batch batch(const RegTable & t) {return Batch(*this, t);}
+
+    /// @brief writes bits (any non zero byte is 1)
+    /// @return false if the range is outside the table
+    bool write(const RegTable & t, const uint32_t & addr, const uint32_t & nb, const uint8_t * in)
+    {
+        if (!is_bit_table(t) || !in_range(t, addr, nb)) {return false;}
+        Batch b(*this, t);
+        for (uint32_t i = 0; i < nb; i++)
+        {
+            b.set(addr + i, in[i]);
+        }
+        return true;
+    }
+
+    /// @brief writes registers
+    /// @return false if the range is outside the table
+    bool write(const RegTable & t, const uint32_t & addr, const uint32_t & nb, const uint16_t * in)
+    {
+        if (is_bit_table(t) || !in_range(t, addr, nb)) {return false;}
+        Batch b(*this, t);
+        for (uint32_t i = 0; i < nb; i++)
+        {
+            b.set(addr + i, in[i]);
+        }
+        return true;
+    }
+
+    /// @brief every address of the table back to 0. A sparse table also hands back all its blocks,
+    /// the defined ranges (page entries PAGE_EMPTY and the mask) stay as laid out
+    void clear(const RegTable & t)
+    {
+        write_begin(t);
+        if (!sparse(t))
+        {
+            for (uint32_t i = 0; i < count(t); i++) {store(t, i, 0);}
+            if (count(t) > 0) {bump_gens(t, 0, count(t) - 1);}
+        }
+        else
+        {
+            // blocks are handed out again later and must come back zeroed
+            size_t n = (size_t)used_blocks(t) * GEN_BLOCK;
+            for (size_t i = 0; i < n; i++)
+            {
+                if (is_bit_table(t)) {std::atomic_ref<uint8_t>(base(t)[i]).store(0, std::memory_order_relaxed);}
+                else {std::atomic_ref<uint16_t>(((uint16_t *)base(t))[i]).store(0, std::memory_order_relaxed);}
+            }
+            for (uint32_t p = 0; p < 65536 / GEN_BLOCK; p++)
+            {
+                auto e = page(t, p * GEN_BLOCK);
+                if (e.load(std::memory_order_relaxed) < PAGE_FIRST) {continue;}
+                e.store(PAGE_EMPTY, std::memory_order_relaxed);
+                gen(t, p).fetch_add(1, std::memory_order_release);
+            }
+            std::atomic_ref<uint32_t>(hdr->used_blocks[(int)t]).store(0, std::memory_order_relaxed);
+        }
+        write_end(t);
+    }
+
+    /// @brief single value
+    /// @return false if addr is outside the table
+    inline bool set(const RegTable & t, const uint32_t & addr, const uint16_t & v)
+    {
+        if (!in_range(t, addr, 1)) {return false;}
+        Batch b(*this, t);
+        b.set(addr, v);
+        return true;
+    }
+};
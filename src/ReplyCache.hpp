@@ -0,0 +1,171 @@
+#pragma once
+
+#include "RegisterStore.hpp"
+#include "MbReply.hpp"
+
+#include <cstdint>
+#include <cstring>
+#include <unordered_map>
+#include <vector>
+
+/// @brief encoded read replies (FC 1-4) keyed by (unit, fc, start, qty), LRU with a fixed number of slots.
+/// An entry remembers RegisterStore::range_gen() of the range it was encoded from; any write to that
+/// range changes the generation and the entry is re-encoded on the next request. A hit only copies
+/// the frame and patches the MBAP transaction id. Not thread safe, one per serving worker.
+class ReplyCache
+{
+private:
+
+    static constexpr uint32_t NIL = UINT32_MAX;
+
+    struct Entry
+    {
+        uint64_t key = 0;
+        uint64_t gen = 0;
+        uint32_t prev = NIL;
+        uint32_t next = NIL;
+        uint16_t len = 0;
+        uint8_t adu[MB_MAX_ADU_LENGTH];
+    };
+
+    std::vector<Entry> slots;
+    std::unordered_map<uint64_t, uint32_t> index;
+    uint32_t used = 0;
+    uint32_t head = NIL; // most recently used
+    uint32_t tail = NIL; // next victim
+
+    inline void unlink(const uint32_t & i)
+    {
+        Entry & e = slots[i];
+        if (e.prev != NIL) {slots[e.prev].next = e.next;} else {head = e.next;}
+        if (e.next != NIL) {slots[e.next].prev = e.prev;} else {tail = e.prev;}
+        e.prev = e.next = NIL;
+    }
+
+    inline void push_front(const uint32_t & i)
+    {
+        slots[i].next = head;
+        slots[i].prev = NIL;
+        if (head != NIL) {slots[head].prev = i;}
+        head = i;
+        if (tail == NIL) {tail = i;}
+    }
+
+public:
+
+    /// @brief what reply() did with a frame
+    enum class Outcome : uint8_t
+    {
+        BYPASS, ///< not a cacheable read
+        HIT,
+        MISS,
+    };
+
+    /// @param capacity max entries, ~270 bytes each
+    explicit ReplyCache(const size_t & capacity) : slots(capacity ? capacity : 1)
+    {
+        index.reserve(slots.size() * 2);
+    }
+
+    inline size_t size() const {return used;}
+
+    /// @brief cache key of a read request frame
+    /// @param table receives the table the request reads
+    /// @return false if the frame is not a plain FC 1-4 read
+    static inline bool key_of(const uint8_t * adu, const size_t & len, uint64_t & key, RegTable & table)
+    {
+        if (len != MB_MBAP_LENGTH + 5) {return false;}
+        const uint8_t fc = adu[MB_MBAP_LENGTH];
+        switch (fc)
+        {
+        case 0x01: table = RegTable::COILS; break;
+        case 0x02: table = RegTable::INPUT_BITS; break;
+        case 0x03: table = RegTable::HOLDING_REGS; break;
+        case 0x04: table = RegTable::INPUT_REGS; break;
+        default: return false;
+        }
+        key = (uint64_t)adu[6] << 40 | (uint64_t)fc << 32 |
+              (uint64_t)mb_get16(adu + MB_MBAP_LENGTH + 1) << 16 | mb_get16(adu + MB_MBAP_LENGTH + 3);
+        return true;
+    }
+
+    /// @brief copies a still valid reply into rsp with the transaction id of the request
+    /// @return frame length, 0 on miss
+    inline size_t lookup(const uint64_t & key, const uint64_t & gen, const uint8_t * adu, uint8_t * rsp)
+    {
+        auto it = index.find(key);
+        if (it == index.end() || slots[it->second].gen != gen)
+        {
+            return 0;
+        }
+        uint32_t i = it->second;
+        if (head != i)
+        {
+            unlink(i);
+            push_front(i);
+        }
+        const Entry & e = slots[i];
+        std::memcpy(rsp, e.adu, e.len);
+        rsp[0] = adu[0];
+        rsp[1] = adu[1];
+        return e.len;
+    }
+
+    /// @brief remembers an encoded reply, evicts the least recently used entry when full
+    void insert(const uint64_t & key, const uint64_t & gen, const uint8_t * rsp, const size_t & len)
+    {
+        if (len > MB_MAX_ADU_LENGTH) {return;}
+        uint32_t i;
+        auto it = index.find(key);
+        if (it != index.end())
+        {
+            i = it->second;
+            unlink(i);
+        }
+        else if (used < slots.size())
+        {
+            i = used++;
+            index.emplace(key, i);
+        }
+        else
+        {
+            i = tail;
+            unlink(i);
+            index.erase(slots[i].key);
+            index.emplace(key, i);
+        }
+        Entry & e = slots[i];
+        e.key = key;
+        e.gen = gen;
+        e.len = len;
+        std::memcpy(e.adu, rsp, len);
+        push_front(i);
+    }
+
+    /// @brief answers a frame from the cache or encodes it from the store and caches the result
+    /// @param res receives hit, miss or bypass
+    /// @return reply frame length
+    size_t reply(RegisterStore & store, const uint8_t * adu, const size_t & len, uint8_t * rsp, Outcome & res)
+    {
+        uint64_t key;
+        RegTable t;
+        res = Outcome::BYPASS;
+        if (!key_of(adu, len, key, t)) {return mb_reply_adu(store, adu, len, rsp);}
+
+        uint64_t gen = store.range_gen(t, mb_get16(adu + MB_MBAP_LENGTH + 1), mb_get16(adu + MB_MBAP_LENGTH + 3));
+        if (gen != 0)
+        {
+            res = Outcome::MISS;
+            size_t n = lookup(key, gen, adu, rsp);
+            if (n)
+            {
+                res = Outcome::HIT;
+                return n;
+            }
+        }
+        size_t n = mb_reply_adu(store, adu, len, rsp);
+        // gen was taken before encoding: a write racing the encode leaves a stale gen, never a stale hit
+        if (gen != 0 && !(rsp[MB_MBAP_LENGTH] & 0x80)) {insert(key, gen, rsp, n);}
+        return n;
+    }
+};
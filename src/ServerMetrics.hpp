@@ -0,0 +1,265 @@
+#pragma once
+
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <memory>
+#include <mutex>
+#include <ostream>
+#include <string>
+#include <vector>
+
+/// @brief HDR-style latency histogram: 16 linear sub-buckets per power of two (~6% error),
+/// values in ns up to ~2^40 (18 min). Recording is two relaxed fetch_add, no locks, no allocation.
+class LatencyHistogram
+{
+public:
+
+    static constexpr int SUB_BITS = 4;
+    static constexpr int SUB = 1 << SUB_BITS;
+    static constexpr int MAX_EXP = 39;
+    static constexpr size_t BUCKETS = (MAX_EXP - SUB_BITS + 2) * SUB;
+
+    /// @brief bucket index of a value
+    static inline size_t bucket_of(const uint64_t & v)
+    {
+        if (v < SUB) {return v;}
+        int e = 63 - __builtin_clzll(v);
+        size_t idx = (size_t)(e - SUB_BITS + 1) * SUB + ((v >> (e - SUB_BITS)) & (SUB - 1));
+        return idx < BUCKETS ? idx : BUCKETS - 1;
+    }
+
+    /// @brief highest value that lands in the bucket
+    static inline uint64_t bucket_top(const size_t & idx)
+    {
+        if (idx < SUB) {return idx;}
+        int shift = idx / SUB - 1;
+        uint64_t low = (uint64_t)(SUB + idx % SUB) << shift;
+        return low + ((uint64_t)1 << shift) - 1;
+    }
+
+    inline void record(const uint64_t & ns)
+    {
+        buckets[bucket_of(ns)].fetch_add(1, std::memory_order_relaxed);
+        sum_ns.fetch_add(ns, std::memory_order_relaxed);
+    }
+
+    /// @brief adds own counts to acc (BUCKETS long), used to merge workers
+    /// @return sum of recorded values
+    inline uint64_t add_to(uint64_t * acc) const
+    {
+        for (size_t i = 0; i < BUCKETS; i++)
+        {
+            acc[i] += buckets[i].load(std::memory_order_relaxed);
+        }
+        return sum_ns.load(std::memory_order_relaxed);
+    }
+
+    /// @brief p-th quantile (0..1) of merged counts
+    static uint64_t quantile(const uint64_t * counts, const double & p)
+    {
+        uint64_t total = 0;
+        for (size_t i = 0; i < BUCKETS; i++) {total += counts[i];}
+        if (total == 0) {return 0;}
+        uint64_t rank = (uint64_t)(p * (total - 1)) + 1;
+        uint64_t seen = 0;
+        for (size_t i = 0; i < BUCKETS; i++)
+        {
+            seen += counts[i];
+            if (seen >= rank) {return bucket_top(i);}
+        }
+        return bucket_top(BUCKETS - 1);
+    }
+
+private:
+    std::atomic<uint64_t> buckets[BUCKETS] = {};
+    std::atomic<uint64_t> sum_ns{0};
+};
+
+/// @brief traffic of one client connection
+struct ConnMetrics
+{
+    std::string peer;
+    std::atomic<uint64_t> bytes_in{0};
+    std::atomic<uint64_t> bytes_out{0};
+    std::atomic<uint64_t> requests{0};
+};
+
+/// @brief per function code request/exception counters and receive-to-reply latency of one serving thread.
+/// Every worker owns one, so the reply path never shares cache lines; the scrape side sums them up.
+class ServerMetrics
+{
+public:
+
+    /// @brief function codes with own slot, everything else is counted as "other"
+    static constexpr uint8_t FCS[] = {0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x0F, 0x10, 0x11, 0x16, 0x17};
+    static constexpr size_t FC_SLOTS = sizeof(FCS) + 1;
+
+    struct FcMetrics
+    {
+        std::atomic<uint64_t> requests{0};
+        std::atomic<uint64_t> exceptions{0};
+        LatencyHistogram latency;
+    };
+
+    static inline size_t fc_slot(const uint8_t & fc)
+    {
+        for (size_t i = 0; i < sizeof(FCS); i++)
+        {
+            if (FCS[i] == fc) {return i;}
+        }
+        return FC_SLOTS - 1;
+    }
+
+    /// @brief one answered request
+    /// @param conn may be nullptr
+    inline void record(const uint8_t & fc, const bool & exception, const uint64_t & ns, const size_t & in, const size_t & out, ConnMetrics * conn)
+    {
+        FcMetrics & m = fc_metrics[fc_slot(fc)];
+        m.requests.fetch_add(1, std::memory_order_relaxed);
+        if (exception) {m.exceptions.fetch_add(1, std::memory_order_relaxed);}
+        m.latency.record(ns);
+        bytes_in.fetch_add(in, std::memory_order_relaxed);
+        bytes_out.fetch_add(out, std::memory_order_relaxed);
+        if (conn != nullptr)
+        {
+            conn->bytes_in.fetch_add(in, std::memory_order_relaxed);
+            conn->bytes_out.fetch_add(out, std::memory_order_relaxed);
+            conn->requests.fetch_add(1, std::memory_order_relaxed);
+        }
+    }
+
+    /// @brief one read looked up in the reply cache
+    inline void record_cache(const bool & hit)
+    {
+        (hit ? cache_hits : cache_misses).fetch_add(1, std::memory_order_relaxed);
+    }
+
+    /// @brief registers a new client, only called on accept
+    std::shared_ptr<ConnMetrics> open_conn(const std::string & peer)
+    {
+        auto c = std::make_shared<ConnMetrics>();
+        c->peer = peer;
+        std::lock_guard lk(conn_lock);
+        conns.push_back(c);
+        return c;
+    }
+
+    /// @brief forgets a client, only called on close
+    void close_conn(const std::shared_ptr<ConnMetrics> & c)
+    {
+        std::lock_guard lk(conn_lock);
+        std::erase(conns, c);
+    }
+
+    /// @brief Prometheus text exposition of the sum of several metric sets
+    static void render(std::ostream & os, const std::vector<const ServerMetrics *> & all)
+    {
+        static constexpr double qs[] = {0.5, 0.9, 0.99, 0.999};
+        std::vector<uint64_t> counts(LatencyHistogram::BUCKETS);
+
+        os << "# HELP modbus_requests_total Requests answered, by function code.\n"
+           << "# TYPE modbus_requests_total counter\n";
+        for (size_t s = 0; s < FC_SLOTS; s++)
+        {
+            uint64_t n = 0;
+            for (auto &&m : all) {n += m->fc_metrics[s].requests.load(std::memory_order_relaxed);}
+            os << "modbus_requests_total{fc=\"" << fc_label(s) << "\"} " << n << "\n";
+        }
+
+        os << "# HELP modbus_exceptions_total Exception responses, by function code.\n"
+           << "# TYPE modbus_exceptions_total counter\n";
+        for (size_t s = 0; s < FC_SLOTS; s++)
+        {
+            uint64_t n = 0;
+            for (auto &&m : all) {n += m->fc_metrics[s].exceptions.load(std::memory_order_relaxed);}
+            os << "modbus_exceptions_total{fc=\"" << fc_label(s) << "\"} " << n << "\n";
+        }
+
+        os << "# HELP modbus_reply_seconds Receive-to-reply time, by function code.\n"
+           << "# TYPE modbus_reply_seconds summary\n";
+        for (size_t s = 0; s < FC_SLOTS; s++)
+        {
+            std::fill(counts.begin(), counts.end(), 0);
+            uint64_t sum = 0, n = 0;
+            for (auto &&m : all)
+            {
+                sum += m->fc_metrics[s].latency.add_to(counts.data());
+                n += m->fc_metrics[s].requests.load(std::memory_order_relaxed);
+            }
+            if (n == 0) {continue;}
+            for (auto &&q : qs)
+            {
+                os << "modbus_reply_seconds{fc=\"" << fc_label(s) << "\",quantile=\"" << q << "\"} "
+                   << LatencyHistogram::quantile(counts.data(), q) / 1e9 << "\n";
+            }
+            os << "modbus_reply_seconds_sum{fc=\"" << fc_label(s) << "\"} " << sum / 1e9 << "\n"
+               << "modbus_reply_seconds_count{fc=\"" << fc_label(s) << "\"} " << n << "\n";
+        }
+
+        uint64_t in = 0, out = 0;
+        for (auto &&m : all)
+        {
+            in += m->bytes_in.load(std::memory_order_relaxed);
+            out += m->bytes_out.load(std::memory_order_relaxed);
+        }
+        os << "# TYPE modbus_received_bytes_total counter\n"
+           << "modbus_received_bytes_total " << in << "\n"
+           << "# TYPE modbus_sent_bytes_total counter\n"
+           << "modbus_sent_bytes_total " << out << "\n";
+
+        uint64_t hits = 0, misses = 0;
+        for (auto &&m : all)
+        {
+            hits += m->cache_hits.load(std::memory_order_relaxed);
+            misses += m->cache_misses.load(std::memory_order_relaxed);
+        }
+        os << "# HELP modbus_reply_cache_hits_total Reads answered from the reply cache.\n"
+           << "# TYPE modbus_reply_cache_hits_total counter\n"
+           << "modbus_reply_cache_hits_total " << hits << "\n"
+           << "# HELP modbus_reply_cache_misses_total Cacheable reads that had to be encoded.\n"
+           << "# TYPE modbus_reply_cache_misses_total counter\n"
+           << "modbus_reply_cache_misses_total " << misses << "\n";
+
+        os << "# HELP modbus_connection_received_bytes_total Bytes of requests, by open connection.\n"
+           << "# TYPE modbus_connection_received_bytes_total counter\n";
+        for_each_conn(all, [&](const ConnMetrics & c){
+            os << "modbus_connection_received_bytes_total{peer=\"" << c.peer << "\"} " << c.bytes_in << "\n";
+        });
+        os << "# HELP modbus_connection_sent_bytes_total Bytes of replies, by open connection.\n"
+           << "# TYPE modbus_connection_sent_bytes_total counter\n";
+        for_each_conn(all, [&](const ConnMetrics & c){
+            os << "modbus_connection_sent_bytes_total{peer=\"" << c.peer << "\"} " << c.bytes_out << "\n";
+        });
+        os << "# TYPE modbus_connection_requests_total counter\n";
+        for_each_conn(all, [&](const ConnMetrics & c){
+            os << "modbus_connection_requests_total{peer=\"" << c.peer << "\"} " << c.requests << "\n";
+        });
+    }
+
+private:
+
+    FcMetrics fc_metrics[FC_SLOTS];
+    std::atomic<uint64_t> bytes_in{0};
+    std::atomic<uint64_t> bytes_out{0};
+    std::atomic<uint64_t> cache_hits{0};
+    std::atomic<uint64_t> cache_misses{0};
+
+    mutable std::mutex conn_lock;
+    std::vector<std::shared_ptr<ConnMetrics>> conns;
+
+    static inline std::string fc_label(const size_t & slot)
+    {
+        return slot < sizeof(FCS) ? std::to_string(FCS[slot]) : "other";
+    }
+
+    template<typename F>
+    static void for_each_conn(const std::vector<const ServerMetrics *> & all, F && f)
+    {
+        for (auto &&m : all)
+        {
+            std::lock_guard lk(m->conn_lock);
+            for (auto &&c : m->conns) {f(*c);}
+        }
+    }
+};
@@ -0,0 +1,123 @@
+#pragma once
+
+#include "DumbModbus.hpp"
+
+#include <functional>
+#include <memory>
+#include <mutex>
+#include <vector>
+
+/// @brief warm dumb_Mservers for test fixtures. Every server listens on its own ephemeral port from the
+/// moment it joins the pool, acquire() hands one out with its map back at the start-up values and the
+/// Lease returns it, so a test pays for a few register writes instead of a context, a listener and a thread.
+/// Pooled servers run multi-client mode without simulation unless the setup says otherwise.
+class ServerPool
+{
+public:
+
+    /// @brief extra configuration of every new server, runs before it starts listening
+    using Setup = std::function<void(dumb_Mserver &)>;
+
+    /// @brief one server borrowed from the pool, goes back when the lease dies, must not outlive the pool
+    class Lease
+    {
+        friend class ServerPool;
+        ServerPool * pool = nullptr;
+        dumb_Mserver * srv = nullptr;
+        Lease(ServerPool * p, dumb_Mserver * s) : pool(p), srv(s) {}
+
+    public:
+
+        Lease(Lease && o) noexcept : pool(o.pool), srv(o.srv) {o.srv = nullptr;}
+        Lease & operator=(Lease && o) noexcept
+        {
+            if (this != &o)
+            {
+                if (srv != nullptr) {pool->release(srv);}
+                pool = o.pool;
+                srv = o.srv;
+                o.srv = nullptr;
+            }
+            return *this;
+        }
+        Lease(const Lease &) = delete;
+        ~Lease() {if (srv != nullptr) {pool->release(srv);}}
+
+        inline dumb_Mserver & operator*() const {return *srv;}
+        inline dumb_Mserver * operator->() const {return srv;}
+        /// @brief where to connect
+        inline int port() const {return srv->get_port();}
+    };
+
+private:
+
+    std::string ip;
+    Setup setup;
+    std::mutex lock;
+    std::vector<std::unique_ptr<dumb_Mserver>> all;
+    std::vector<dumb_Mserver *> idle;
+
+    /// @brief a started server on a fresh ephemeral port
+    dumb_Mserver * grow()
+    {
+        auto s = std::make_unique<dumb_Mserver>();
+        s->set_context(ip, 0);
+        s->set_multi_client(16, std::chrono::milliseconds(0), nullptr);
+        s->set_simulation("");
+        if (setup) {setup(*s);}
+        s->ezTreadstart();
+        all.push_back(std::move(s));
+        return all.back().get();
+    }
+
+    inline void release(dumb_Mserver * s)
+    {
+        std::lock_guard lk(lock);
+        idle.push_back(s);
+    }
+
+public:
+
+    /// @brief starts n servers right away, more are started on demand
+    /// @param n warm servers
+    /// @param fn extra configuration (sizes, layout, workers...) of every server
+    /// @param listen_ip address they listen on
+    /// @throws std::ios_base::failure when a server can't listen
+    explicit ServerPool(const size_t & n = 0, Setup fn = {}, const std::string & listen_ip = "127.0.0.1") : ip(listen_ip), setup(std::move(fn))
+    {
+        for (size_t i = 0; i < n; i++) {idle.push_back(grow());}
+    }
+    ServerPool(const ServerPool &) = delete;
+
+    /// @brief an idle server with its map reset, a new one if all are out
+    /// @throws std::ios_base::failure when a new server can't listen
+    Lease acquire()
+    {
+        dumb_Mserver * s;
+        {
+            std::lock_guard lk(lock);
+            if (idle.empty()) {s = grow();}
+            else
+            {
+                s = idle.back();
+                idle.pop_back();
+            }
+        }
+        s->reset_map();
+        return Lease(this, s);
+    }
+
+    /// @brief servers started so far
+    inline size_t size()
+    {
+        std::lock_guard lk(lock);
+        return all.size();
+    }
+
+    /// @brief servers not leased out
+    inline size_t available()
+    {
+        std::lock_guard lk(lock);
+        return idle.size();
+    }
+};
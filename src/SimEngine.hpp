@@ -0,0 +1,447 @@
+#pragma once
+
+#include "RegisterStore.hpp"
+
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <cstdint>
+#include <fstream>
+#include <istream>
+#include <map>
+#include <numbers>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+/// @brief register simulation driven by a profile, evaluated on its own tick thread.
+///
+/// Profile, one rule per line, '#' starts a comment:
+/// @code
+///   tick_us 1000                                   # tick period, default 1000
+///   ir 6      steps values=12,30 every_ms=100      # old register 6 flip
+///   ir 0..99  sine offset=2000 amp=1000 period_ms=5000 phase_step_deg=3.6
+///   hr 10     ramp from=0 to=100 period_ms=1000    # sawtooth
+///   ir 200    counter from=0 step=1 every_ms=10 wrap=65536
+///   ir 300..310 walk from=50 min=0 max=100 step=3 seed=1
+///   co 0..15  steps values=1,0,0 every_ms=500
+///   hr 0      const value=1234                     # written once on start
+///   ir 400..409 mirror src=hr:10 scale=2 offset=5  # derived, follows the source every tick
+/// @endcode
+/// Tables are co, di, hr, ir. A range gives every address its own point, sine phase and mirror
+/// source advance with the address. Values are clamped to 0..65535, bit tables take non zero as 1.
+///
+/// Rules of a kind live in one group as flat arrays, so a tick is a few tight loops the compiler
+/// can vectorize, followed by one Batch (one seqlock round, one generation bump) per touched table.
+/// Requests never wait for a tick, they just see the previous or the next one.
+class SimEngine
+{
+public:
+
+    enum class Kind : uint8_t
+    {
+        CONST,
+        RAMP,
+        SINE,
+        COUNTER,
+        WALK,
+        STEPS,
+        MIRROR,
+    };
+
+    /// @brief a destination register
+    struct Point
+    {
+        RegTable table;
+        uint16_t addr;
+    };
+
+private:
+
+    /// @brief rules of one kind, structure of arrays, out[i] goes to dst[i]
+    struct Group
+    {
+        std::vector<Point> dst;
+        /// @brief bit per RegTable that has points
+        uint8_t tables = 0;
+        std::vector<double> a, b, c, d;
+        std::vector<uint32_t> u;
+        std::vector<double> out;
+    };
+
+    Group groups[7];
+    /// @brief steps: all value lists back to back, a group point keeps (first, count) in u
+    std::vector<double> step_values;
+    /// @brief mirror sources
+    std::vector<Point> mirror_src;
+    uint64_t rng = 0x9E3779B97F4A7C15ull;
+
+    std::chrono::microseconds tick{1000};
+    uint64_t ticks = 0;
+    std::atomic<bool> running{false};
+    std::thread thread;
+
+    inline Group & group(const Kind & k) {return groups[(int)k];}
+
+    static RegTable parse_table(const std::string & s)
+    {
+        static const std::map<std::string, RegTable> names = {
+            {"co", RegTable::COILS}, {"di", RegTable::INPUT_BITS}, {"hr", RegTable::HOLDING_REGS}, {"ir", RegTable::INPUT_REGS}};
+        auto it = names.find(s);
+        if (it == names.end()) {throw std::invalid_argument("unknown table " + s);}
+        return it->second;
+    }
+
+    static Kind parse_kind(const std::string & s)
+    {
+        static const std::map<std::string, Kind> names = {
+            {"const", Kind::CONST}, {"ramp", Kind::RAMP}, {"sine", Kind::SINE}, {"counter", Kind::COUNTER},
+            {"walk", Kind::WALK}, {"steps", Kind::STEPS}, {"mirror", Kind::MIRROR}};
+        auto it = names.find(s);
+        if (it == names.end()) {throw std::invalid_argument("unknown kind " + s);}
+        return it->second;
+    }
+
+    /// @brief "a" or "a..b"
+    static void parse_range(const std::string & s, uint32_t & first, uint32_t & last)
+    {
+        size_t dots = s.find("..");
+        first = std::stoul(s.substr(0, dots));
+        last = dots == std::string::npos ? first : std::stoul(s.substr(dots + 2));
+        if (last < first || last > 65535) {throw std::invalid_argument("bad address range " + s);}
+    }
+
+    static double num(const std::map<std::string, std::string> & kv, const std::string & key, const double & def)
+    {
+        auto it = kv.find(key);
+        return it == kv.end() ? def : std::stod(it->second);
+    }
+
+    static double need(const std::map<std::string, std::string> & kv, const std::string & key)
+    {
+        auto it = kv.find(key);
+        if (it == kv.end()) {throw std::invalid_argument("missing " + key);}
+        return std::stod(it->second);
+    }
+
+    static double period_us(const std::map<std::string, std::string> & kv)
+    {
+        double ms = need(kv, "period_ms");
+        if (!(ms > 0)) {throw std::invalid_argument("period_ms must be positive");}
+        return ms * 1000;
+    }
+
+    inline uint64_t next_rand()
+    {
+        rng ^= rng << 13;
+        rng ^= rng >> 7;
+        rng ^= rng << 17;
+        return rng;
+    }
+
+    /// @brief one profile line, throws std::invalid_argument without the line number
+    void add_rule(const std::string & table, const std::string & range, const std::string & kind, const std::map<std::string, std::string> & kv)
+    {
+        RegTable t = parse_table(table);
+        uint32_t first, last;
+        parse_range(range, first, last);
+        Kind k = parse_kind(kind);
+        Group & g = group(k);
+
+        uint32_t steps_first = step_values.size(), steps_count = 0;
+        if (k == Kind::STEPS)
+        {
+            auto it = kv.find("values");
+            if (it == kv.end()) {throw std::invalid_argument("missing values");}
+            std::stringstream vs(it->second);
+            std::string v;
+            while (std::getline(vs, v, ','))
+            {
+                step_values.push_back(std::stod(v));
+                steps_count++;
+            }
+            if (steps_count == 0) {throw std::invalid_argument("empty values");}
+        }
+        RegTable src_t = RegTable::HOLDING_REGS;
+        uint32_t src_addr = 0;
+        if (k == Kind::MIRROR)
+        {
+            auto it = kv.find("src");
+            size_t colon = it == kv.end() ? std::string::npos : it->second.find(':');
+            if (colon == std::string::npos) {throw std::invalid_argument("src wants table:addr");}
+            src_t = parse_table(it->second.substr(0, colon));
+            src_addr = std::stoul(it->second.substr(colon + 1));
+            if (src_addr + (last - first) > 65535) {throw std::invalid_argument("src range past 65535");}
+        }
+
+        for (uint32_t addr = first; addr <= last; addr++)
+        {
+            uint32_t i = addr - first;
+            g.dst.push_back({t, (uint16_t)addr});
+            g.tables |= 1 << (int)t;
+            g.out.push_back(0);
+            switch (k)
+            {
+            case Kind::CONST:
+                g.out.back() = need(kv, "value");
+                break;
+            case Kind::RAMP:
+                g.a.push_back(num(kv, "from", 0));
+                g.b.push_back(num(kv, "to", 65535));
+                g.c.push_back(period_us(kv));
+                break;
+            case Kind::SINE:
+                g.a.push_back(num(kv, "offset", 0));
+                g.b.push_back(need(kv, "amp"));
+                g.c.push_back(2 * std::numbers::pi / period_us(kv));
+                g.d.push_back((num(kv, "phase_deg", 0) + i * num(kv, "phase_step_deg", 0)) * std::numbers::pi / 180);
+                break;
+            case Kind::COUNTER:
+                g.a.push_back(num(kv, "from", 0));
+                g.b.push_back(num(kv, "step", 1));
+                g.c.push_back(std::max(1.0, num(kv, "every_ms", 0) * 1000));
+                g.d.push_back(num(kv, "wrap", 65536));
+                break;
+            case Kind::WALK:
+                g.a.push_back(num(kv, "min", 0));
+                g.b.push_back(num(kv, "max", 65535));
+                g.c.push_back(num(kv, "step", 1));
+                g.d.push_back(num(kv, "from", g.a.back()));
+                if (kv.count("seed")) {rng = (uint64_t)num(kv, "seed", 1) * 0x9E3779B97F4A7C15ull | 1;}
+                break;
+            case Kind::STEPS:
+                g.a.push_back(std::max(1.0, num(kv, "every_ms", 0) * 1000));
+                g.u.push_back(steps_first);
+                g.u.push_back(steps_count);
+                break;
+            case Kind::MIRROR:
+                mirror_src.push_back({src_t, (uint16_t)(src_addr + i)});
+                g.a.push_back(num(kv, "scale", 1));
+                g.b.push_back(num(kv, "offset", 0));
+                break;
+            }
+        }
+    }
+
+    /// @brief outputs of every group except mirror at time us since start
+    void eval(const double & us)
+    {
+        {
+            Group & g = group(Kind::RAMP);
+            for (size_t i = 0; i < g.out.size(); i++)
+            {
+                double f = us / g.c[i];
+                g.out[i] = g.a[i] + (g.b[i] - g.a[i]) * (f - std::floor(f));
+            }
+        }
+        {
+            Group & g = group(Kind::SINE);
+            for (size_t i = 0; i < g.out.size(); i++)
+            {
+                g.out[i] = g.a[i] + g.b[i] * std::sin(g.c[i] * us + g.d[i]);
+            }
+        }
+        {
+            Group & g = group(Kind::COUNTER);
+            for (size_t i = 0; i < g.out.size(); i++)
+            {
+                g.out[i] = std::fmod(g.a[i] + g.b[i] * std::floor(us / g.c[i]), g.d[i]);
+            }
+        }
+        {
+            Group & g = group(Kind::WALK);
+            for (size_t i = 0; i < g.out.size(); i++)
+            {
+                // -step, 0 or +step
+                double v = g.d[i] + g.c[i] * (double)((int)(next_rand() % 3) - 1);
+                g.d[i] = std::clamp(v, g.a[i], g.b[i]);
+                g.out[i] = g.d[i];
+            }
+        }
+        {
+            Group & g = group(Kind::STEPS);
+            for (size_t i = 0; i < g.out.size(); i++)
+            {
+                uint64_t n = (uint64_t)(us / g.a[i]);
+                g.out[i] = step_values[g.u[2 * i] + n % g.u[2 * i + 1]];
+            }
+        }
+    }
+
+    static inline uint16_t clamp16(const double & v)
+    {
+        return v <= 0 ? 0 : v >= 65535 ? 65535 : (uint16_t)std::lround(v);
+    }
+
+    /// @brief value as the table keeps it, bits are 0/1
+    static inline uint16_t stored(const int & t, const double & v)
+    {
+        uint16_t r = clamp16(v);
+        return is_bit_table((RegTable)t) ? r != 0 : r;
+    }
+
+    /// @brief writes the values of the given groups that changed, one Batch per table with a change.
+    /// A tick that changes nothing leaves the seqlock and the generations alone, so cached replies stay valid
+    static void flush(RegisterStore & store, std::initializer_list<const Group *> gs)
+    {
+        for (int t = 0; t < 4; t++)
+        {
+            bool changed = false;
+            for (auto &&g : gs)
+            {
+                if (!(g->tables & (1 << t))) {continue;}
+                for (size_t i = 0; i < g->dst.size() && !changed; i++)
+                {
+                    changed = (int)g->dst[i].table == t && store.get((RegTable)t, g->dst[i].addr) != stored(t, g->out[i]);
+                }
+            }
+            if (!changed) {continue;}
+            auto b = store.batch((RegTable)t);
+            for (auto &&g : gs)
+            {
+                if (!(g->tables & (1 << t))) {continue;}
+                for (size_t i = 0; i < g->dst.size(); i++)
+                {
+                    if ((int)g->dst[i].table != t) {continue;}
+                    uint16_t v = stored(t, g->out[i]);
+                    if (b.get(g->dst[i].addr) != v) {b.set(g->dst[i].addr, v);}
+                }
+            }
+        }
+    }
+
+    void loop(RegisterStore & store)
+    {
+        auto t0 = std::chrono::steady_clock::now();
+        auto next = t0;
+        while (running)
+        {
+            step(store, std::chrono::duration<double, std::micro>(next - t0).count());
+            next += tick;
+            std::this_thread::sleep_until(next);
+        }
+    }
+
+public:
+
+    /// @brief the old behaviour: input register 6 starts at its seeded 12 and flips to 30 and back
+    static constexpr const char * DEFAULT_PROFILE = "ir 6 steps values=12,30 every_ms=100\n";
+
+    SimEngine() = default;
+    SimEngine(const SimEngine &) = delete;
+    ~SimEngine() {stop();}
+
+    /// @brief adds the rules of a profile to the ones already loaded
+    /// @throws std::invalid_argument with the line number on syntax errors
+    void load(std::istream & in)
+    {
+        std::string line;
+        int nr = 0;
+        while (std::getline(in, line))
+        {
+            nr++;
+            line = line.substr(0, line.find('#'));
+            std::stringstream ls(line);
+            std::string table, range, kind, tok;
+            if (!(ls >> table)) {continue;}
+            try
+            {
+                if (table == "tick_us")
+                {
+                    long us = 0;
+                    if (!(ls >> us) || us <= 0) {throw std::invalid_argument("tick_us wants a positive number");}
+                    tick = std::chrono::microseconds(us);
+                    continue;
+                }
+                if (!(ls >> range >> kind)) {throw std::invalid_argument("expected <table> <addr[..addr]> <kind> key=value...");}
+                std::map<std::string, std::string> kv;
+                while (ls >> tok)
+                {
+                    size_t eq = tok.find('=');
+                    if (eq == std::string::npos) {throw std::invalid_argument("expected key=value, got " + tok);}
+                    kv[tok.substr(0, eq)] = tok.substr(eq + 1);
+                }
+                add_rule(table, range, kind, kv);
+            }
+            catch (const std::logic_error & e) // stod/stoul throw invalid_argument/out_of_range too
+            {
+                throw std::invalid_argument("profile line " + std::to_string(nr) + ": " + e.what());
+            }
+        }
+    }
+
+    /// @throws std::ios_base::failure if the file can't be read, std::invalid_argument on bad lines
+    void load_file(const std::string & path)
+    {
+        std::ifstream f(path);
+        if (!f) {throw std::ios_base::failure("can't read simulation profile " + path);}
+        load(f);
+    }
+
+    inline void load_string(const std::string & text)
+    {
+        std::istringstream s(text);
+        load(s);
+    }
+
+    /// @brief number of simulated registers
+    size_t points() const
+    {
+        size_t n = 0;
+        for (auto &&g : groups) {n += g.dst.size();}
+        return n;
+    }
+
+    inline std::chrono::microseconds tick_period() const {return tick;}
+
+    /// @brief every point must exist in the store
+    /// @throws std::out_of_range naming the first one that doesn't
+    void check(const RegisterStore & store) const
+    {
+        auto chk = [&](const Point & p){
+            if (!store.in_range(p.table, p.addr, 1))
+            {
+                throw std::out_of_range("simulated register " + std::to_string((int)p.table) + ":" + std::to_string(p.addr) + " is outside the map");
+            }
+        };
+        for (auto &&g : groups) {for (auto &&p : g.dst) {chk(p);}}
+        for (auto &&p : mirror_src) {chk(p);}
+    }
+
+    /// @brief one tick: evaluates every group at time us and publishes it, mirrors last so they see this tick.
+    /// Called by the tick thread, tests may drive it by hand.
+    void step(RegisterStore & store, const double & us)
+    {
+        if (ticks++ == 0) {flush(store, {&group(Kind::CONST)});}
+        eval(us);
+        flush(store, {&group(Kind::RAMP), &group(Kind::SINE), &group(Kind::COUNTER), &group(Kind::WALK), &group(Kind::STEPS)});
+
+        Group & m = group(Kind::MIRROR);
+        if (m.dst.empty()) {return;}
+        for (size_t i = 0; i < m.out.size(); i++)
+        {
+            m.out[i] = store.get(mirror_src[i].table, mirror_src[i].addr) * m.a[i] + m.b[i];
+        }
+        flush(store, {&m});
+    }
+
+    /// @brief checks the points and starts ticking, the store must outlive stop()
+    /// @throws std::out_of_range if a point is outside the store
+    void start(RegisterStore & store)
+    {
+        stop();
+        check(store);
+        if (points() == 0) {return;}
+        ticks = 0;
+        running = true;
+        thread = std::thread(&SimEngine::loop, this, std::ref(store));
+    }
+
+    void stop()
+    {
+        running = false;
+        if (thread.joinable()) {thread.join();}
+    }
+};
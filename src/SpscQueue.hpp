@@ -0,0 +1,67 @@
+#pragma once
+
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <type_traits>
+
+/// @brief bounded lock-free single producer / single consumer ring, N must be a power of two.
+/// One thread pushes, one thread pops, nobody waits: a full ring refuses the push, an empty one the pop.
+/// Head and tail live on their own cache lines and each side keeps a private copy of the other
+/// index, so the hot path touches the shared line of the other side only when it looks full/empty.
+template<typename T, size_t N>
+class SpscQueue
+{
+    static_assert(N >= 2 && (N & (N - 1)) == 0, "N must be a power of two");
+    static_assert(std::is_trivially_copyable_v<T>, "T is copied around without constructors");
+
+private:
+
+    alignas(64) std::atomic<size_t> head{0}; // next pop, written by the consumer
+    alignas(64) size_t tail_cache = 0;       // consumer's idea of tail
+    alignas(64) std::atomic<size_t> tail{0}; // next push, written by the producer
+    alignas(64) size_t head_cache = 0;       // producer's idea of head
+    alignas(64) T slots[N];
+
+public:
+
+    static constexpr size_t capacity = N;
+
+    /// @brief producer side
+    /// @return false when full
+    inline bool try_push(const T & v)
+    {
+        size_t t = tail.load(std::memory_order_relaxed);
+        if (t - head_cache == N)
+        {
+            head_cache = head.load(std::memory_order_acquire);
+            if (t - head_cache == N) {return false;}
+        }
+        slots[t & (N - 1)] = v;
+        tail.store(t + 1, std::memory_order_release);
+        return true;
+    }
+
+    /// @brief consumer side
+    /// @return false when empty
+    inline bool try_pop(T & out)
+    {
+        size_t h = head.load(std::memory_order_relaxed);
+        if (h == tail_cache)
+        {
+            tail_cache = tail.load(std::memory_order_acquire);
+            if (h == tail_cache) {return false;}
+        }
+        out = slots[h & (N - 1)];
+        head.store(h + 1, std::memory_order_release);
+        return true;
+    }
+
+    /// @brief approximate when called while the other side runs
+    inline size_t size() const
+    {
+        return tail.load(std::memory_order_acquire) - head.load(std::memory_order_acquire);
+    }
+
+    inline bool empty() const {return size() == 0;}
+};
@@ -0,0 +1,217 @@
+#pragma once
+
+#include "DataBucket.hpp"
+#include "MbReply.hpp"
+
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+/// @brief turns a batch of DataBucket tasks into the fewest modbus frames and splits the answers back.
+/// Same-opCode tasks that overlap or sit next to each other (reads: also within max_gap) share a frame
+/// as long as it fits the PDU limits. Order is kept where it matters: a read never jumps over a write
+/// submitted before it and vice versa, writes only merge with the ones submitted right before them,
+/// so overlapping writes land in submission order (last one wins).
+/// Plans are cached by the batch signature (opCode, start, qty of each task), so a polling set that is
+/// resubmitted every cycle is planned once.
+class TaskScheduler
+{
+public:
+
+    /// @brief one task's slice of a frame
+    struct Member
+    {
+        uint32_t task;
+        uint16_t offset;
+    };
+
+    /// @brief one modbus transaction, members[first, first + count) ride along
+    struct Frame
+    {
+        char op;
+        uint16_t start, qty;
+        uint32_t first, count;
+    };
+
+    struct Plan
+    {
+        std::vector<Frame> frames;
+        std::vector<Member> members;
+    };
+
+private:
+
+    uint16_t max_gap;
+    size_t max_plans;
+    std::unordered_map<std::string, Plan> plans;
+    std::string key;
+    std::vector<uint32_t> order, rank;
+    uint16_t buf[DataBucket::CAPACITY];
+    uint64_t hits = 0;
+
+    static bool writes(const char & op) {return op == 'W' || op == 'w';}
+
+    static uint16_t limit(const char & op)
+    {
+        if (DataBucket::bits(op)) {return writes(op) ? MB_MAX_WRITE_BITS : MB_MAX_READ_BITS;}
+        return writes(op) ? MB_MAX_WRITE_REGISTERS : MB_MAX_READ_REGISTERS;
+    }
+
+    static bool get_bit(const uint16_t * w, const uint32_t & i) {return (w[i >> 4] >> (i & 15)) & 1;}
+    static void put_bit(uint16_t * w, const uint32_t & i, const bool & v)
+    {
+        if (v) {w[i >> 4] |= uint16_t(1u << (i & 15));}
+        else {w[i >> 4] &= uint16_t(~(1u << (i & 15)));}
+    }
+
+    /// @brief copies n elements (bits or registers) from src[s0] to dst[d0]
+    static void move(const char & op, uint16_t * dst, const uint32_t & d0, const uint16_t * src, const uint32_t & s0, const uint32_t & n)
+    {
+        if (!DataBucket::bits(op)) {std::copy_n(src + s0, n, dst + d0); return;}
+        for (uint32_t i = 0; i < n; i++) {put_bit(dst, d0 + i, get_bit(src, s0 + i));}
+    }
+
+    /// @brief plans tasks [from, to), an epoch without read/write turnarounds
+    void plan_epoch(DataBucket * const * tasks, const uint32_t & from, const uint32_t & to, Plan & p)
+    {
+        // first appearance of the opCode, then address (reads only), then submission order
+        const bool w = writes(tasks[from]->opCode);
+        uint32_t first[256];
+        std::fill_n(first, 256, UINT32_MAX);
+        order.clear();
+        rank.resize(to);
+        for (uint32_t i = from; i < to; i++)
+        {
+            uint32_t & r = first[(uint8_t)tasks[i]->opCode];
+            if (r == UINT32_MAX) {r = i;}
+            rank[i] = r;
+            order.push_back(i);
+        }
+        std::stable_sort(order.begin(), order.end(), [&](const uint32_t & a, const uint32_t & b)
+        {
+            if (rank[a] != rank[b]) {return rank[a] < rank[b];}
+            // writes stay in submission order: frames split at the PDU limit could otherwise
+            // put an earlier overlapping write after a later one
+            return !w && tasks[a]->startReg < tasks[b]->startReg;
+        });
+
+        for (size_t k = 0; k < order.size();)
+        {
+            const DataBucket * t = tasks[order[k]];
+            Frame f{t->opCode, t->startReg, t->qty, (uint32_t)p.members.size(), 0};
+            uint32_t start = t->startReg, end = start + t->qty;
+            uint32_t gap = w ? 0 : max_gap;
+            size_t j = k + 1;
+            for (; j < order.size(); j++)
+            {
+                const DataBucket * n = tasks[order[j]];
+                // a write may also extend the frame downwards, reads come sorted by address
+                uint32_t n_start = std::min<uint32_t>(start, n->startReg);
+                uint32_t n_end = std::max<uint32_t>(end, uint32_t(n->startReg) + n->qty);
+                if (n->opCode != f.op || n->startReg > end + gap || uint32_t(n->startReg) + n->qty < start ||
+                    n_end - n_start > limit(f.op))
+                {
+                    break;
+                }
+                start = n_start;
+                end = n_end;
+            }
+            f.start = start;
+            f.qty = end - start;
+            // members in submission order, a later write overwrites an earlier one in the frame
+            for (size_t m = k; m < j; m++) {p.members.push_back({order[m], uint16_t(tasks[order[m]]->startReg - f.start)});}
+            f.count = j - k;
+            p.frames.push_back(f);
+            k = j;
+        }
+    }
+
+    /// @brief one frame through io, answers split into the members' buckets
+    template<typename Io>
+    int16_t exec(DataBucket * const * tasks, const Frame & f, const Member * ms, Io & io)
+    {
+        if (writes(f.op))
+        {
+            for (uint32_t m = 0; m < f.count; m++) {move(f.op, buf, ms[m].offset, tasks[ms[m].task]->values(), 0, tasks[ms[m].task]->qty);}
+        }
+        int16_t res = io(f.op, f.start, f.qty, buf);
+        if (res == DataBucket::OK && !writes(f.op))
+        {
+            for (uint32_t m = 0; m < f.count; m++) {move(f.op, tasks[ms[m].task]->values(), 0, buf, ms[m].offset, tasks[ms[m].task]->qty);}
+        }
+        return res;
+    }
+
+public:
+
+    /// @brief cumstructor
+    /// @param gap unused addresses a merged read may step over, 0 merges only touching/overlapping reads
+    /// @param plans_kept plan cache entries before it starts over
+    explicit TaskScheduler(const uint16_t & gap = 16, const size_t & plans_kept = 64) : max_gap(gap), max_plans(plans_kept) {}
+
+    inline void set_max_gap(const uint16_t & gap) {max_gap = gap; plans.clear();}
+    inline size_t cached_plans() const {return plans.size();}
+    inline uint64_t plan_hits() const {return hits;}
+
+    /// @brief the (cached) plan for a batch, valid until the next plan()/run()
+    const Plan & plan(DataBucket * const * tasks, const size_t & n)
+    {
+        key.resize(n * 5);
+        for (size_t i = 0; i < n; i++)
+        {
+            key[i * 5] = tasks[i]->opCode;
+            std::memcpy(&key[i * 5 + 1], &tasks[i]->startReg, 2);
+            std::memcpy(&key[i * 5 + 3], &tasks[i]->qty, 2);
+        }
+        auto it = plans.find(key);
+        if (it != plans.end()) {hits++; return it->second;}
+        if (plans.size() >= max_plans) {plans.clear();}
+
+        Plan & p = plans[key];
+        uint32_t from = 0;
+        for (uint32_t i = 1; i <= n; i++)
+        {
+            if (i == n || writes(tasks[i]->opCode) != writes(tasks[i - 1]->opCode))
+            {
+                plan_epoch(tasks, from, i, p);
+                from = i;
+            }
+        }
+        return p;
+    }
+
+    /// @brief runs a batch, completes every task
+    /// @param io int16_t io(char op, uint16_t start, uint16_t qty, uint16_t * buf) does one transaction,
+    /// bits packed as in DataBucket, returns DataBucket::OK, FAILED or the modbus exception code
+    /// @return frames sent
+    template<typename Io>
+    size_t run(DataBucket * const * tasks, const size_t & n, Io && io)
+    {
+        const Plan & p = plan(tasks, n);
+        size_t sent = 0;
+        for (const Frame & f : p.frames)
+        {
+            const Member * ms = p.members.data() + f.first;
+            int16_t res = exec(tasks, f, ms, io);
+            sent++;
+            // a merged frame refused by the device (gap over an undefined address, say) goes again task by task
+            if (res > 0 && (f.count > 1 || f.qty != tasks[ms[0].task]->qty))
+            {
+                for (uint32_t m = 0; m < f.count; m++)
+                {
+                    DataBucket * t = tasks[ms[m].task];
+                    Frame one{f.op, t->startReg, t->qty, 0, 1};
+                    Member me{ms[m].task, 0};
+                    t->complete(exec(tasks, one, &me, io));
+                    sent++;
+                }
+                continue;
+            }
+            for (uint32_t m = 0; m < f.count; m++) {tasks[ms[m].task]->complete(res);}
+        }
+        return sent;
+    }
+};
@@ -0,0 +1,219 @@
+#pragma once
+
+#include <algorithm>
+#include <atomic>
+#include <cerrno>
+#include <chrono>
+#include <cstdint>
+#include <cstring>
+#include <ios>
+#include <memory>
+#include <string>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+/// @brief capture file header. The file is meant to be mmap'd and walked in place
+/// (native endianness, everything little endian on x86/arm):
+/// @code
+///   0  u64 magic "MBCAPLOG"
+///   8  u32 version
+///  12  u32 reserved
+///  16  i64 wall clock of t_ns = 0, ns since the epoch
+///  24  records, each 8 aligned:
+///      u64 t_ns     request received, steady clock ns since the header's wall clock
+///      u32 conn     connection id, 1.. in accept order
+///      u16 req_len  request ADU bytes
+///      u16 rsp_len  reply ADU bytes, 0 = nothing was sent back
+///      req_len + rsp_len bytes, zero padding to the next 8
+/// @endcode
+/// A record is only appended whole, a crash loses the tail of the last write and nothing before it.
+struct TrafficLogHeader
+{
+    uint64_t magic;
+    uint32_t version;
+    uint32_t reserved;
+    int64_t wall_ns;
+};
+
+struct TrafficRecord
+{
+    uint64_t t_ns;
+    uint32_t conn;
+    uint16_t req_len;
+    uint16_t rsp_len;
+};
+
+/// @brief the capture side: one append-only file, any number of buffered Writers (one per serving thread)
+/// sharing it. Writers only hand whole buffers of whole records to one write() on an O_APPEND fd,
+/// so threads don't need a lock and records never interleave.
+class TrafficLog
+{
+private:
+
+    int fd = -1;
+    std::string path;
+    std::chrono::steady_clock::time_point t0;
+    std::atomic<uint32_t> conns{0};
+
+public:
+
+    static constexpr uint64_t MAGIC = 0x474F4C5041434D42ull; // "MBCAPLOG"
+    static constexpr uint32_t VERSION = 1;
+
+    /// @brief record size on disk, header included
+    static constexpr size_t record_size(const size_t & req_len, const size_t & rsp_len)
+    {
+        return (sizeof(TrafficRecord) + req_len + rsp_len + 7) & ~size_t(7);
+    }
+
+    /// @brief buffered appender of one thread, flushes when full, on flush() and when it dies
+    class Writer
+    {
+    private:
+
+        TrafficLog & log;
+        size_t cap;
+        std::unique_ptr<uint8_t[]> buf;
+        size_t len = 0;
+
+    public:
+
+        /// @param l log to append to, must outlive the writer
+        /// @param buf_size bytes buffered before a write()
+        explicit Writer(TrafficLog & l, const size_t & buf_size = 256 * 1024) : log(l), cap(buf_size), buf(std::make_unique<uint8_t[]>(buf_size)) {}
+        Writer(const Writer &) = delete;
+        ~Writer() {flush();}
+
+        /// @brief queues one transaction, no allocation, a write() only when the buffer is full
+        /// @param conn TrafficLog::open_conn() id
+        /// @param t when the request came in
+        void record(const uint32_t & conn, const std::chrono::steady_clock::time_point & t, const uint8_t * req, const size_t & req_len, const uint8_t * rsp, const size_t & rsp_len)
+        {
+            size_t n = record_size(req_len, rsp_len);
+            if (len + n > cap) {flush();}
+            if (n > cap) {return;} // can't happen with ADU sized frames and a sane buffer
+            TrafficRecord r{(uint64_t)std::chrono::duration_cast<std::chrono::nanoseconds>(t - log.t0).count(), conn, (uint16_t)req_len, (uint16_t)rsp_len};
+            uint8_t * p = buf.get() + len;
+            std::memcpy(p, &r, sizeof(r));
+            std::memcpy(p + sizeof(r), req, req_len);
+            std::memcpy(p + sizeof(r) + req_len, rsp, rsp_len);
+            std::memset(p + sizeof(r) + req_len + rsp_len, 0, n - sizeof(r) - req_len - rsp_len);
+            len += n;
+        }
+
+        /// @brief hands the buffer to the file
+        void flush()
+        {
+            size_t done = 0;
+            while (done < len)
+            {
+                ssize_t w = write(log.fd, buf.get() + done, len - done);
+                if (w <= 0 && errno != EINTR) {break;} // disk full & co: the capture loses data, serving goes on
+                if (w > 0) {done += w;}
+            }
+            len = 0;
+        }
+    };
+
+    /// @brief creates (truncates) the capture file and writes its header
+    /// @throws std::ios_base::failure when it can't
+    explicit TrafficLog(const std::string & file) : path(file)
+    {
+        fd = open(file.c_str(), O_WRONLY | O_CREAT | O_TRUNC | O_APPEND | O_CLOEXEC, 0666);
+        if (fd == -1) {throw std::ios_base::failure("can't create capture " + file + ": " + std::strerror(errno));}
+        t0 = std::chrono::steady_clock::now();
+        TrafficLogHeader h{MAGIC, VERSION, 0, std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::system_clock::now().time_since_epoch()).count()};
+        if (write(fd, &h, sizeof(h)) != (ssize_t)sizeof(h))
+        {
+            close(fd);
+            throw std::ios_base::failure("can't write capture " + file + ": " + std::strerror(errno));
+        }
+    }
+    TrafficLog(const TrafficLog &) = delete;
+    ~TrafficLog() {close(fd);}
+
+    /// @brief id for a new connection
+    inline uint32_t open_conn() {return ++conns;}
+    inline const std::string & file() const {return path;}
+};
+
+/// @brief read side: the whole capture mmap'd read-only, frames point straight into the mapping
+class TrafficLogView
+{
+public:
+
+    /// @brief one transaction, pointers into the mapping
+    struct Frame
+    {
+        uint64_t t_ns;
+        uint32_t conn;
+        const uint8_t * req;
+        uint16_t req_len;
+        const uint8_t * rsp;
+        uint16_t rsp_len;
+    };
+
+private:
+
+    const uint8_t * base = nullptr;
+    size_t size = 0;
+    TrafficLogHeader hdr{};
+    /// @brief offset of every complete record, in file order
+    std::vector<size_t> offsets;
+
+public:
+
+    /// @brief maps and indexes a capture, a torn last record is left out
+    /// @throws std::ios_base::failure when it can't be read or isn't a capture
+    explicit TrafficLogView(const std::string & file)
+    {
+        int fd = open(file.c_str(), O_RDONLY | O_CLOEXEC);
+        if (fd == -1) {throw std::ios_base::failure("can't open capture " + file + ": " + std::strerror(errno));}
+        struct stat st{};
+        fstat(fd, &st);
+        size = st.st_size;
+        if (size < sizeof(TrafficLogHeader))
+        {
+            close(fd);
+            throw std::ios_base::failure(file + " is not a capture");
+        }
+        void * m = mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+        close(fd);
+        if (m == MAP_FAILED) {throw std::ios_base::failure("can't map capture " + file + ": " + std::strerror(errno));}
+        base = (const uint8_t *)m;
+        std::memcpy(&hdr, base, sizeof(hdr));
+        if (hdr.magic != TrafficLog::MAGIC || hdr.version != TrafficLog::VERSION)
+        {
+            munmap((void *)base, size);
+            throw std::ios_base::failure(file + " is not a capture (or a newer one)");
+        }
+        madvise((void *)base, size, MADV_SEQUENTIAL);
+        for (size_t pos = sizeof(TrafficLogHeader); pos + sizeof(TrafficRecord) <= size;)
+        {
+            const TrafficRecord * r = (const TrafficRecord *)(base + pos);
+            size_t n = TrafficLog::record_size(r->req_len, r->rsp_len);
+            if (pos + n > size) {break;}
+            offsets.push_back(pos);
+            pos += n;
+        }
+    }
+    TrafficLogView(const TrafficLogView &) = delete;
+    ~TrafficLogView() {munmap((void *)base, size);}
+
+    inline size_t frames() const {return offsets.size();}
+    /// @brief capture start, ns since the epoch
+    inline int64_t wall_ns() const {return hdr.wall_ns;}
+
+    /// @brief i-th transaction in file order: in time order per connection, serving threads flush
+    /// their buffers independently so connections of different threads come in chunks
+    inline Frame frame(const size_t & i) const
+    {
+        const uint8_t * p = base + offsets[i];
+        const TrafficRecord * r = (const TrafficRecord *)p;
+        return {r->t_ns, r->conn, p + sizeof(TrafficRecord), r->req_len, p + sizeof(TrafficRecord) + r->req_len, r->rsp_len};
+    }
+};
@@ -0,0 +1,171 @@
+#pragma once
+
+#include "TrafficLog.hpp"
+#include "MbReply.hpp"
+
+#include <arpa/inet.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/socket.h>
+
+#include <chrono>
+#include <cstdio>
+#include <map>
+#include <string>
+#include <thread>
+#include <vector>
+
+/// @brief what a replay did
+struct ReplayResult
+{
+    uint64_t frames = 0;
+    /// @brief replies that differ from the captured ones
+    uint64_t divergences = 0;
+    /// @brief frames lost to connect/send/receive failures
+    uint64_t errors = 0;
+    double seconds = 0;
+    /// @brief the first few divergences, human readable
+    std::vector<std::string> samples;
+
+    inline double rps() const {return seconds > 0 ? frames / seconds : 0;}
+};
+
+/// @brief re-drives a capture against a server: one client connection per captured connection, each
+/// sends its requests in captured order and compares every reply byte for byte with the captured one
+/// (transaction ids included, they are sent unchanged). Either at the captured pace (speed 1 = real time,
+/// 2 = twice as fast) or back to back as fast as the server answers.
+class TrafficReplay
+{
+public:
+
+    /// @brief divergences kept as text
+    static constexpr size_t max_samples = 16;
+
+private:
+
+    const TrafficLogView & log;
+    /// @brief frame indexes of every captured connection
+    std::map<uint32_t, std::vector<size_t>> by_conn;
+    /// @brief capture time of the first request, timed replays start there instead of at capture start
+    uint64_t t_first = UINT64_MAX;
+
+    static std::string hex(const uint8_t * p, const size_t & n)
+    {
+        std::string s;
+        char b[4];
+        for (size_t i = 0; i < n; i++)
+        {
+            std::snprintf(b, sizeof(b), "%02x", p[i]);
+            s += b;
+        }
+        return s;
+    }
+
+    /// @brief one captured connection
+    void drive(const std::string & host, const int & port, const std::vector<size_t> & frames, const double & speed,
+               const std::chrono::steady_clock::time_point & start, ReplayResult & res)
+    {
+        int fd = socket(AF_INET, SOCK_STREAM | SOCK_CLOEXEC, 0);
+        sockaddr_in sa{};
+        sa.sin_family = AF_INET;
+        sa.sin_port = htons(port);
+        inet_pton(AF_INET, host.c_str(), &sa.sin_addr);
+        if (connect(fd, (sockaddr *)&sa, sizeof(sa)) == -1)
+        {
+            close(fd);
+            res.errors += frames.size();
+            return;
+        }
+        int yes = 1;
+        setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &yes, sizeof(yes));
+        timeval tv{5, 0};
+        setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+
+        uint8_t in[2 * MB_MAX_ADU_LENGTH];
+        size_t in_len = 0;
+        for (size_t k = 0; k < frames.size(); k++)
+        {
+            auto f = log.frame(frames[k]);
+            if (speed > 0) {std::this_thread::sleep_until(start + std::chrono::nanoseconds((int64_t)((f.t_ns - t_first) / speed)));}
+            if (send(fd, f.req, f.req_len, MSG_NOSIGNAL) != f.req_len)
+            {
+                res.errors += frames.size() - k;
+                break;
+            }
+            res.frames++;
+            if (f.rsp_len == 0) {continue;}
+
+            long flen;
+            while ((flen = mb_frame_length(in, in_len)) == 0)
+            {
+                ssize_t r = recv(fd, in + in_len, sizeof(in) - in_len, 0);
+                if (r <= 0) {flen = -1; break;}
+                in_len += r;
+            }
+            if (flen < 0)
+            {
+                res.errors += frames.size() - k;
+                break;
+            }
+            if ((size_t)flen != f.rsp_len || std::memcmp(in, f.rsp, flen) != 0)
+            {
+                if (res.samples.size() < max_samples)
+                {
+                    res.samples.push_back("frame " + std::to_string(frames[k]) + " conn " + std::to_string(f.conn) +
+                                          " request " + hex(f.req, f.req_len) + ": expected " + hex(f.rsp, f.rsp_len) +
+                                          " got " + hex(in, flen));
+                }
+                res.divergences++;
+            }
+            in_len -= flen;
+            std::memmove(in, in + flen, in_len);
+        }
+        close(fd);
+    }
+
+public:
+
+    explicit TrafficReplay(const TrafficLogView & view) : log(view)
+    {
+        for (size_t i = 0; i < log.frames(); i++)
+        {
+            auto f = log.frame(i);
+            by_conn[f.conn].push_back(i);
+            t_first = std::min(t_first, f.t_ns);
+        }
+    }
+
+    /// @brief captured connections
+    inline size_t connections() const {return by_conn.size();}
+
+    /// @brief replays everything, all connections at once
+    /// @param host server IPv4 address
+    /// @param port server port
+    /// @param speed captured pace multiplier, 0 = as fast as possible
+    ReplayResult run(const std::string & host, const int & port, const double & speed = 0)
+    {
+        std::vector<ReplayResult> part(by_conn.size());
+        std::vector<std::thread> threads;
+        auto start = std::chrono::steady_clock::now();
+        size_t i = 0;
+        for (auto && [conn, frames] : by_conn)
+        {
+            threads.emplace_back(&TrafficReplay::drive, this, std::cref(host), port, std::cref(frames), speed, start, std::ref(part[i++]));
+        }
+        for (auto && t : threads) {t.join();}
+
+        ReplayResult res;
+        res.seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+        for (auto && p : part)
+        {
+            res.frames += p.frames;
+            res.divergences += p.divergences;
+            res.errors += p.errors;
+            for (auto && s : p.samples)
+            {
+                if (res.samples.size() < max_samples) {res.samples.push_back(s);}
+            }
+        }
+        return res;
+    }
+};
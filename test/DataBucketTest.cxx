@@ -0,0 +1,124 @@
+/// @brief DataBucket completion and the SPSC submission ring, thousands of tasks in flight
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE DataBucket_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include <memory>
+#include <thread>
+
+#include "src/DataBucket.hpp"
+#include "src/SpscQueue.hpp"
+
+BOOST_AUTO_TEST_SUITE(DataBucket_Tests)
+
+BOOST_AUTO_TEST_CASE(bounded_write_read)
+{
+    uint16_t big[DataBucket::CAPACITY + 1] = {};
+    DataBucket d('W', 2, 500);
+    BOOST_CHECK_EQUAL(d.size(), DataBucket::CAPACITY);
+    BOOST_CHECK(!d.write(big, DataBucket::CAPACITY + 1));
+
+    uint16_t in[2] = {7, 8}, out[2] = {};
+    BOOST_CHECK(d.write(in, 2));
+    BOOST_CHECK_EQUAL(d.size(), 2);
+    BOOST_CHECK(!d.get_rdy());
+    BOOST_CHECK(!d.read_tread(out));
+    d.complete(0x02);
+    BOOST_CHECK(d.get_rdy());
+    BOOST_CHECK(!d.read(out)); // exception code is not OK, values still copied
+    BOOST_CHECK_EQUAL(out[1], 8);
+
+    d.reset();
+    BOOST_CHECK_EQUAL(d.result(), DataBucket::PENDING);
+}
+
+BOOST_AUTO_TEST_CASE(wait_and_callback)
+{
+    DataBucket d('R', 0, 3);
+    int seen = -100;
+    d.then([](DataBucket & t, int16_t res, void * ctx) {*(int *)ctx = res + t.values()[0];}, &seen);
+    std::thread exec([&]
+    {
+        std::this_thread::sleep_for(std::chrono::milliseconds(5));
+        uint16_t v[3] = {40, 41, 42};
+        d.write(v, 3);
+        d.complete();
+    });
+    uint16_t out[3] = {};
+    BOOST_CHECK(d.read(out));
+    exec.join();
+    BOOST_CHECK_EQUAL(out[2], 42);
+    BOOST_CHECK_EQUAL(seen, 40);
+}
+
+BOOST_AUTO_TEST_CASE(spsc_in_flight)
+{
+    constexpr int N = 10000;
+    auto q = std::make_unique<SpscQueue<DataBucket *, 4096>>();
+    std::vector<std::unique_ptr<DataBucket>> tasks;
+    for (int i = 0; i < N; i++) {tasks.emplace_back(std::make_unique<DataBucket>('R', i, 1));}
+    std::atomic<int> done{0};
+    for (auto & t : tasks) {t->then([](DataBucket &, int16_t, void * ctx) {((std::atomic<int> *)ctx)->fetch_add(1);}, &done);}
+
+    std::thread exec([&]
+    {
+        DataBucket * t;
+        for (int n = 0; n < N;)
+        {
+            if (!q->try_pop(t)) {std::this_thread::yield(); continue;}
+            uint16_t v = t->startReg * 3;
+            t->write(&v, 1);
+            t->complete();
+            n++;
+        }
+    });
+    for (auto & t : tasks)
+    {
+        while (!q->try_push(t.get())) {std::this_thread::yield();}
+    }
+    for (int i = 0; i < N; i++)
+    {
+        uint16_t v;
+        BOOST_REQUIRE(tasks[i]->read(&v));
+        BOOST_REQUIRE_EQUAL(v, uint16_t(i * 3));
+    }
+    exec.join();
+    BOOST_CHECK_EQUAL(done.load(), N);
+    BOOST_CHECK(q->empty());
+
+    SpscQueue<int, 2> small;
+    int x = 0;
+    BOOST_CHECK(small.try_push(1) && small.try_push(2));
+    BOOST_CHECK(!small.try_push(3));
+    BOOST_CHECK(small.try_pop(x) && x == 1);
+}
+
+BOOST_AUTO_TEST_CASE(waiter_frees_right_away)
+{
+    // every bucket is deleted the moment its result is seen, the next one likely gets the same memory
+    constexpr int N = 20000;
+    std::atomic<DataBucket *> slot{nullptr};
+    std::thread exec([&]
+    {
+        for (int n = 0; n < N; n++)
+        {
+            DataBucket * t;
+            while ((t = slot.exchange(nullptr)) == nullptr) {}
+            uint16_t v = t->startReg;
+            t->write(&v, 1);
+            t->complete();
+        }
+    });
+    for (int i = 0; i < N; i++)
+    {
+        auto t = std::make_unique<DataBucket>('R', i, 1);
+        slot.store(t.get());
+        uint16_t v;
+        BOOST_REQUIRE(t->read(&v));
+        BOOST_REQUIRE_EQUAL(v, uint16_t(i));
+    }
+    exec.join();
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,149 @@
+/// @brief DeviceFarm profile loading, dispatch by port and unit id over real sockets
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE DeviceFarm_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include "src/DeviceFarm.hpp"
+
+BOOST_AUTO_TEST_SUITE(DeviceFarm_Tests)
+
+/// @brief blocking FC 3 read of one register, returns the reply frame
+static std::vector<uint8_t> read_reg(const int & port, const uint8_t & unit, const uint16_t & addr)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    timeval tv{2, 0};
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+    sockaddr_in sa{};
+    sa.sin_family = AF_INET;
+    sa.sin_port = htons(port);
+    sa.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    BOOST_REQUIRE_EQUAL(connect(fd, (sockaddr *)&sa, sizeof(sa)), 0);
+    uint8_t req[12] = {0x00, 0x2A, 0x00, 0x00, 0x00, 0x06, unit, 0x03, 0, 0, 0x00, 0x01};
+    mb_put16(req + 8, addr);
+    send(fd, req, sizeof(req), 0);
+    uint8_t rsp[MB_MAX_ADU_LENGTH];
+    ssize_t n = recv(fd, rsp, sizeof(rsp), 0);
+    close(fd);
+    return std::vector<uint8_t>(rsp, rsp + std::max<ssize_t>(n, 0));
+}
+
+BOOST_AUTO_TEST_CASE(dispatch)
+{
+    const int base = 30000 + getpid() % 20000;
+    std::string ports = std::to_string(base) + ".." + std::to_string(base + 199);
+    DeviceFarm farm;
+    auto t0 = std::chrono::steady_clock::now();
+    farm.load_string(
+        "workers 2\n"
+        "device pump ports=" + ports + " unit=any hr=10 ir=10\n"
+        "  hr 0 const value=77\n"
+        "device meter port=" + std::to_string(base + 200) + " units=1..50 hr=4\n"
+        "  hr 1 counter from=100 every_ms=100000\n");
+    farm.start();
+    double startup = std::chrono::duration<double>(std::chrono::steady_clock::now() - t0).count();
+    BOOST_CHECK_EQUAL(farm.size(), 250u);
+    BOOST_CHECK_LT(startup, 1.0);
+
+    farm.find(base + 200, 7)->store->set(RegTable::HOLDING_REGS, 2, 7);
+    farm.find(base + 200, 8)->store->set(RegTable::HOLDING_REGS, 2, 8);
+    BOOST_CHECK(farm.find(base + 200, 51) == nullptr);
+    std::this_thread::sleep_for(std::chrono::milliseconds(20));
+
+    auto r = read_reg(base + 150, 99, 0);
+    BOOST_REQUIRE_EQUAL(r.size(), 11u);
+    BOOST_CHECK_EQUAL(mb_get16(r.data()), 0x2A);
+    BOOST_CHECK_EQUAL(mb_get16(r.data() + 9), 77);
+
+    BOOST_CHECK_EQUAL(mb_get16(read_reg(base + 200, 7, 2).data() + 9), 7);
+    BOOST_CHECK_EQUAL(mb_get16(read_reg(base + 200, 8, 2).data() + 9), 8);
+    BOOST_CHECK_EQUAL(mb_get16(read_reg(base + 200, 8, 1).data() + 9), 100);
+
+    r = read_reg(base + 200, 51, 0);
+    BOOST_REQUIRE_EQUAL(r.size(), 9u);
+    BOOST_CHECK_EQUAL(r[7], 0x83);
+    BOOST_CHECK_EQUAL(r[8], MB_EX_GATEWAY_TARGET_FAILED);
+
+    farm.stop();
+    BOOST_CHECK(farm.metrics_text().find("modbus_requests_total{fc=\"3\"} 5") != std::string::npos);
+}
+
+BOOST_AUTO_TEST_CASE(client_not_reading)
+{
+    const int port = 30000 + (getpid() + 7000) % 20000;
+    DeviceFarm farm;
+    farm.load_string("workers 1\ndevice big port=" + std::to_string(port) + " unit=any hr=125\n  hr 124 const value=5\n");
+    farm.start();
+
+    int deaf = socket(AF_INET, SOCK_STREAM, 0);
+    int small = 4096;
+    setsockopt(deaf, SOL_SOCKET, SO_RCVBUF, &small, sizeof(small));
+    timeval tv{2, 0};
+    setsockopt(deaf, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+    sockaddr_in sa{};
+    sa.sin_family = AF_INET;
+    sa.sin_port = htons(port);
+    sa.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    BOOST_REQUIRE_EQUAL(connect(deaf, (sockaddr *)&sa, sizeof(sa)), 0);
+    const size_t n = 30000;
+    std::thread sender([&]
+    {
+        std::vector<uint8_t> reqs(n * 12);
+        for (size_t i = 0; i < n; i++)
+        {
+            const uint8_t q[12] = {0x00, 0x00, 0x00, 0x00, 0x00, 0x06, 0x01, 0x03, 0x00, 0x00, 0x00, 0x7D};
+            std::copy_n(q, 12, reqs.data() + i * 12);
+            mb_put16(reqs.data() + i * 12, i);
+        }
+        for (size_t off = 0; off < reqs.size();)
+        {
+            ssize_t r = send(deaf, reqs.data() + off, reqs.size() - off, MSG_NOSIGNAL);
+            if (r <= 0) {break;}
+            off += r;
+        }
+    });
+    std::this_thread::sleep_for(std::chrono::milliseconds(200)); // its replies pile up in the farm
+
+    BOOST_CHECK_EQUAL(read_reg(port, 1, 124).size(), 11u); // the worker still serves others
+
+    const size_t rsp_len = 9 + 2 * 125;
+    std::vector<uint8_t> rsp(n * rsp_len);
+    size_t got = 0;
+    while (got < rsp.size())
+    {
+        ssize_t r = recv(deaf, rsp.data() + got, rsp.size() - got, 0);
+        if (r <= 0) {break;}
+        got += r;
+    }
+    sender.join();
+    BOOST_REQUIRE_EQUAL(got, rsp.size());
+    for (size_t i = 0; i < n; i++)
+    {
+        BOOST_REQUIRE_EQUAL(mb_get16(rsp.data() + i * rsp_len), (uint16_t)i);
+        BOOST_REQUIRE_EQUAL(mb_get16(rsp.data() + i * rsp_len + 9 + 2 * 124), 5);
+    }
+    close(deaf);
+    farm.stop();
+}
+
+BOOST_AUTO_TEST_CASE(bad_files)
+{
+    DeviceFarm a;
+    BOOST_CHECK_THROW(a.load_string("hr 0 const value=1\n"), std::invalid_argument);
+    DeviceFarm b;
+    BOOST_CHECK_THROW(b.load_string("device x unit=1\n"), std::invalid_argument);
+    DeviceFarm c;
+    BOOST_CHECK_THROW(c.load_string("device x port=1502 units=1..3\ndevice y port=1502 unit=2\n"), std::invalid_argument);
+    DeviceFarm d;
+    try
+    {
+        d.load_string("\ndevice x port=1502 hr=2\n  hr 5 const value=1\n");
+        BOOST_FAIL("no throw");
+    }
+    catch (const std::out_of_range & e)
+    {
+        BOOST_CHECK(std::string(e.what()).find("farm line 2") != std::string::npos);
+    }
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,364 @@
+/// @brief Modbus TCP load generator: K connections, configurable function code mix, fixed rate or flat out.
+/// Prints throughput and latency percentiles as JSON tagged with the version/build number,
+/// so results of different builds can be compared. Not a ctest test, see EXCLUDED_FILES.
+
+#include "modbus/modbus.h"
+#include "src/DumbModbus.hpp"
+#include "Version.h"
+
+#include <gflags/gflags.h>
+
+#include <arpa/inet.h>
+#include <netinet/in.h>
+#include <sys/socket.h>
+#include <unistd.h>
+
+#include <algorithm>
+#include <chrono>
+#include <fstream>
+#include <iostream>
+#include <map>
+#include <sstream>
+#include <string>
+#include <thread>
+#include <vector>
+
+DEFINE_string(host, "127.0.0.1", "server to hammer");
+DEFINE_int32(port, 1502, "server port");
+DEFINE_int32(conns, 4, "concurrent connections, one thread each");
+DEFINE_double(duration_s, 5, "how long to run");
+DEFINE_double(rate, 0, "total requests/s over all connections, 0 = flat out");
+DEFINE_string(mix, "3:50,4:20,6:10,16:10,1:5,5:5", "fc:weight list, fc one of 1,3,4,5,6,16");
+DEFINE_int32(start, 0, "first address of every request");
+DEFINE_int32(qty, 8, "registers/bits per read and FC16 write");
+DEFINE_int32(pipeline, 1, "requests in flight per connection, >1 sends raw MBAP frames in batches");
+DEFINE_bool(pipelined_server, false, "--self server uses the pipelined serving mode");
+DEFINE_bool(self, false, "start an in-process dumb_Mserver on --port instead of using an external one");
+DEFINE_int32(workers, 1, "serving workers of the --self server");
+DEFINE_int32(low_latency_cpu, -2, "--self server in low-latency mode pinned from this CPU on, -1 = unpinned, -2 = off");
+DEFINE_string(out, "", "write JSON here instead of stdout");
+
+using bench_clock = std::chrono::steady_clock;
+
+/// @brief one latency sample
+struct Sample
+{
+    uint8_t fc;
+    uint32_t ns;
+};
+
+/// @brief what one connection thread did
+struct ConnResult
+{
+    std::vector<Sample> samples;
+    uint64_t errors = 0;
+    bool connected = false;
+};
+
+/// @brief weighted function code table, parsed from --mix
+struct Mix
+{
+    std::vector<uint8_t> fc;
+    std::vector<uint32_t> upto; // cumulative weights
+
+    /// @throws std::invalid_argument on unsupported fc or empty mix
+    explicit Mix(const std::string & spec)
+    {
+        std::stringstream ss(spec);
+        std::string item;
+        uint32_t total = 0;
+        while (std::getline(ss, item, ','))
+        {
+            auto colon = item.find(':');
+            int code = std::stoi(item.substr(0, colon));
+            uint32_t weight = colon == std::string::npos ? 1 : std::stoul(item.substr(colon + 1));
+            if (code != 1 && code != 3 && code != 4 && code != 5 && code != 6 && code != 16)
+            {
+                throw std::invalid_argument("unsupported function code in --mix: " + item);
+            }
+            if (weight == 0) {continue;}
+            total += weight;
+            fc.push_back(code);
+            upto.push_back(total);
+        }
+        if (fc.empty()) {throw std::invalid_argument("empty --mix");}
+    }
+
+    inline uint8_t pick(uint64_t & rng) const
+    {
+        // xorshift64, good enough to shuffle function codes
+        rng ^= rng << 13; rng ^= rng >> 7; rng ^= rng << 17;
+        uint32_t r = rng % upto.back();
+        return fc[std::upper_bound(upto.begin(), upto.end(), r) - upto.begin()];
+    }
+};
+
+/// @brief one request of the given function code
+/// @return libmodbus result, -1 on error
+static int do_request(modbus_t * ctx, const uint8_t & fc, uint16_t * regs, uint8_t * bits, const uint16_t & val)
+{
+    switch (fc)
+    {
+    case 1:  return modbus_read_bits(ctx, FLAGS_start, FLAGS_qty, bits);
+    case 3:  return modbus_read_registers(ctx, FLAGS_start, FLAGS_qty, regs);
+    case 4:  return modbus_read_input_registers(ctx, FLAGS_start, FLAGS_qty, regs);
+    case 5:  return modbus_write_bit(ctx, FLAGS_start, val & 1);
+    case 6:  return modbus_write_register(ctx, FLAGS_start, val);
+    case 16: return modbus_write_registers(ctx, FLAGS_start, FLAGS_qty, regs);
+    default: return -1;
+    }
+}
+
+/// @brief raw MBAP request of the given function code, for --pipeline
+/// @return frame length
+static size_t build_request(const uint8_t & fc, const uint16_t & tid, const uint16_t & val, uint8_t * buf)
+{
+    size_t pdu = 5;
+    buf[7] = fc;
+    mb_put16(buf + 8, FLAGS_start);
+    switch (fc)
+    {
+    case 5:  mb_put16(buf + 10, val & 1 ? 0xFF00 : 0x0000); break;
+    case 6:  mb_put16(buf + 10, val); break;
+    case 16:
+        mb_put16(buf + 10, FLAGS_qty);
+        buf[12] = FLAGS_qty * 2;
+        for (int i = 0; i < FLAGS_qty; i++) {mb_put16(buf + 13 + i * 2, val);}
+        pdu = 6 + FLAGS_qty * 2;
+        break;
+    default: mb_put16(buf + 10, FLAGS_qty); break;
+    }
+    mb_put16(buf, tid);
+    mb_put16(buf + 2, 0);
+    mb_put16(buf + 4, pdu + 1);
+    buf[6] = 1;
+    return MB_MBAP_LENGTH + pdu;
+}
+
+/// @brief --pipeline connection thread: sends a batch of frames, waits for all replies,
+/// every request of the batch gets the batch round trip as its latency
+static void run_pipelined_conn(const int & id, const Mix & mix, bench_clock::time_point start, bench_clock::time_point end, ConnResult & res)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    sockaddr_in addr{};
+    addr.sin_family = AF_INET;
+    addr.sin_port = htons(FLAGS_port);
+    inet_pton(AF_INET, FLAGS_host.c_str(), &addr.sin_addr);
+    if (fd == -1 || connect(fd, (sockaddr *)&addr, sizeof(addr)) == -1)
+    {
+        if (fd != -1) {close(fd);}
+        return;
+    }
+    res.connected = true;
+    timeval tv{1, 0};
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+
+    const int depth = FLAGS_pipeline;
+    std::vector<uint8_t> out(depth * MB_MAX_ADU_LENGTH);
+    std::vector<uint8_t> in(depth * MB_MAX_ADU_LENGTH);
+    std::vector<uint8_t> fcs(depth);
+    uint64_t rng = 0x9E3779B97F4A7C15ull * (id + 1);
+    auto interval = FLAGS_rate > 0 ? std::chrono::duration<double>(FLAGS_conns * depth / FLAGS_rate) : std::chrono::duration<double>(0);
+    uint16_t tid = 0;
+
+    for (uint64_t i = 0;; i++)
+    {
+        auto t0 = bench_clock::now();
+        if (FLAGS_rate > 0)
+        {
+            auto due = start + std::chrono::duration_cast<bench_clock::duration>(interval * (double)i);
+            if (due >= end) {break;}
+            if (due > t0) {std::this_thread::sleep_until(due);}
+            t0 = due;
+        }
+        else if (t0 >= end)
+        {
+            break;
+        }
+
+        size_t olen = 0;
+        for (int k = 0; k < depth; k++)
+        {
+            fcs[k] = mix.pick(rng);
+            olen += build_request(fcs[k], tid++, (uint16_t)(i + k), out.data() + olen);
+        }
+        if (send(fd, out.data(), olen, MSG_NOSIGNAL) != (ssize_t)olen)
+        {
+            res.errors += depth;
+            break;
+        }
+
+        size_t ilen = 0;
+        int frames = 0;
+        bool broken = false;
+        while (frames < depth && !broken)
+        {
+            ssize_t r = recv(fd, in.data() + ilen, in.size() - ilen, 0);
+            if (r <= 0) {broken = true; break;}
+            ilen += r;
+            size_t pos = 0;
+            for (;;)
+            {
+                long flen = mb_frame_length(in.data() + pos, ilen - pos);
+                if (flen <= 0) {broken = flen < 0; break;}
+                if (in[pos + MB_MBAP_LENGTH] & 0x80) {res.errors++;}
+                pos += flen;
+                frames++;
+            }
+            ilen -= pos;
+            std::memmove(in.data(), in.data() + pos, ilen);
+        }
+        if (broken)
+        {
+            res.errors += depth - frames;
+            break;
+        }
+
+        uint32_t ns = std::min<int64_t>(std::chrono::duration_cast<std::chrono::nanoseconds>(bench_clock::now() - t0).count(), UINT32_MAX);
+        for (int k = 0; k < depth; k++) {res.samples.push_back({fcs[k], ns});}
+    }
+    close(fd);
+}
+
+/// @brief connection thread. With --rate the requests follow a fixed schedule and latency is counted
+/// from the scheduled send time, so a stalled server can't hide behind a stalled client.
+static void run_conn(const int & id, const Mix & mix, bench_clock::time_point start, bench_clock::time_point end, ConnResult & res)
+{
+    modbus_t * ctx = modbus_new_tcp(FLAGS_host.c_str(), FLAGS_port);
+    if (ctx == nullptr || modbus_connect(ctx) == -1)
+    {
+        if (ctx != nullptr) {modbus_free(ctx);}
+        return;
+    }
+    res.connected = true;
+    modbus_set_response_timeout(ctx, 1, 0);
+
+    std::vector<uint16_t> regs(std::max(FLAGS_qty, 1));
+    std::vector<uint8_t> bits(std::max(FLAGS_qty, 1));
+    uint64_t rng = 0x9E3779B97F4A7C15ull * (id + 1);
+    auto interval = FLAGS_rate > 0 ? std::chrono::duration<double>(FLAGS_conns / FLAGS_rate) : std::chrono::duration<double>(0);
+    res.samples.reserve(FLAGS_rate > 0 ? (size_t)(FLAGS_rate / FLAGS_conns * FLAGS_duration_s) + 16 : 1 << 16);
+
+    for (uint64_t i = 0;; i++)
+    {
+        auto t0 = bench_clock::now();
+        if (FLAGS_rate > 0)
+        {
+            auto due = start + std::chrono::duration_cast<bench_clock::duration>(interval * (double)i);
+            if (due >= end) {break;}
+            if (due > t0) {std::this_thread::sleep_until(due);}
+            t0 = due;
+        }
+        else if (t0 >= end)
+        {
+            break;
+        }
+
+        uint8_t fc = mix.pick(rng);
+        int rc = do_request(ctx, fc, regs.data(), bits.data(), (uint16_t)i);
+        auto t1 = bench_clock::now();
+        if (rc == -1)
+        {
+            res.errors++;
+            continue;
+        }
+        res.samples.push_back({fc, (uint32_t)std::min<int64_t>(std::chrono::duration_cast<std::chrono::nanoseconds>(t1 - t0).count(), UINT32_MAX)});
+    }
+
+    modbus_close(ctx);
+    modbus_free(ctx);
+}
+
+/// @brief percentile of sorted latencies in microseconds
+static double pct_us(const std::vector<uint32_t> & sorted, const double & p)
+{
+    if (sorted.empty()) {return 0;}
+    size_t idx = std::min(sorted.size() - 1, (size_t)(p * sorted.size()));
+    return sorted[idx] / 1000.0;
+}
+
+static void latency_json(std::ostream & os, std::vector<uint32_t> & ns)
+{
+    std::sort(ns.begin(), ns.end());
+    os << "{\"count\": " << ns.size()
+       << ", \"p50\": " << pct_us(ns, 0.50)
+       << ", \"p99\": " << pct_us(ns, 0.99)
+       << ", \"p999\": " << pct_us(ns, 0.999)
+       << ", \"max\": " << (ns.empty() ? 0 : ns.back() / 1000.0) << "}";
+}
+
+int main(int argc, char* argv[])
+{
+    gflags::ParseCommandLineFlags(&argc, &argv, true);
+    Mix mix(FLAGS_mix);
+
+    dumb_Mserver srv;
+    if (FLAGS_self)
+    {
+        int n = std::max(20, FLAGS_start + FLAGS_qty);
+        srv.setRegSizes(n, n, n, n);
+        srv.set_context(FLAGS_host, FLAGS_port);
+        srv.set_multi_client(FLAGS_conns + 8, std::chrono::milliseconds(0), nullptr);
+        srv.set_workers(FLAGS_workers);
+        srv.set_pipelined(FLAGS_pipelined_server);
+        if (FLAGS_low_latency_cpu > -2) {srv.set_low_latency(FLAGS_low_latency_cpu);}
+        srv.ezTreadstart();
+    }
+
+    std::vector<ConnResult> res(FLAGS_conns);
+    std::vector<std::thread> threads;
+    auto start = bench_clock::now() + std::chrono::milliseconds(50);
+    auto end = start + std::chrono::duration_cast<bench_clock::duration>(std::chrono::duration<double>(FLAGS_duration_s));
+    for (int i = 0; i < FLAGS_conns; i++)
+    {
+        threads.emplace_back(FLAGS_pipeline > 1 ? run_pipelined_conn : run_conn, i, std::cref(mix), start, end, std::ref(res[i]));
+    }
+    for (auto &&t : threads) {t.join();}
+    double elapsed = std::chrono::duration<double>(bench_clock::now() - start).count();
+
+    if (FLAGS_self) {srv.stop();}
+
+    std::vector<uint32_t> all;
+    std::map<int, std::vector<uint32_t>> per_fc;
+    uint64_t errors = 0;
+    int connected = 0;
+    for (auto &&r : res)
+    {
+        errors += r.errors;
+        connected += r.connected;
+        for (auto &&s : r.samples)
+        {
+            all.push_back(s.ns);
+            per_fc[s.fc].push_back(s.ns);
+        }
+    }
+
+    std::ofstream file;
+    if (!FLAGS_out.empty()) {file.open(FLAGS_out);}
+    std::ostream & os = FLAGS_out.empty() ? std::cout : file;
+
+    os << "{\n"
+       << "  \"project\": \"" << PROJECT_NAME << "\",\n"
+       << "  \"version\": \"" << VERSION_STRING << "\",\n"
+       << "  \"build\": " << BUILD_NUMBER << ",\n"
+       << "  \"host\": \"" << FLAGS_host << "\", \"port\": " << FLAGS_port << ",\n"
+       << "  \"conns\": " << FLAGS_conns << ", \"connected\": " << connected << ",\n"
+       << "  \"mix\": \"" << FLAGS_mix << "\", \"start\": " << FLAGS_start << ", \"qty\": " << FLAGS_qty << ",\n"
+       << "  \"rate_target\": " << FLAGS_rate << ", \"pipeline\": " << FLAGS_pipeline << ", \"low_latency_cpu\": " << FLAGS_low_latency_cpu << ",\n"
+       << "  \"duration_s\": " << elapsed << ",\n"
+       << "  \"requests\": " << all.size() << ", \"errors\": " << errors << ",\n"
+       << "  \"throughput_rps\": " << (elapsed > 0 ? all.size() / elapsed : 0) << ",\n"
+       << "  \"latency_us\": ";
+    latency_json(os, all);
+    os << ",\n  \"per_fc\": {";
+    bool first = true;
+    for (auto &&[fc, ns] : per_fc)
+    {
+        os << (first ? "\n" : ",\n") << "    \"" << fc << "\": ";
+        latency_json(os, ns);
+        first = false;
+    }
+    os << "\n  }\n}\n";
+
+    return connected == FLAGS_conns && errors == 0 ? 0 : 1;
+}
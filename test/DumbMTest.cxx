@@ -6,6 +6,7 @@
 
 #include "src/DataBucket.hpp"
 #include "src/DumbModbus.hpp"
+#include "src/ModbusRos.hpp"
 
 BOOST_AUTO_TEST_SUITE(LL_Tests)
 
@@ -0,0 +1,64 @@
+/// @brief latency histogram and Prometheus rendering tests
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE Metrics_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include <sstream>
+
+#include "src/ServerMetrics.hpp"
+
+BOOST_AUTO_TEST_SUITE(Metrics_Tests)
+
+BOOST_AUTO_TEST_CASE(bucket_bounds)
+{
+    for (uint64_t v : {0ull, 1ull, 15ull, 16ull, 17ull, 31ull, 32ull, 1000ull, 123456789ull})
+    {
+        size_t b = LatencyHistogram::bucket_of(v);
+        BOOST_CHECK_GE(LatencyHistogram::bucket_top(b), v);
+        if (b > 0) {BOOST_CHECK_LT(LatencyHistogram::bucket_top(b - 1), v);}
+    }
+    // ~6% relative error
+    size_t b = LatencyHistogram::bucket_of(1000000);
+    BOOST_CHECK_LE(LatencyHistogram::bucket_top(b), 1000000 * 1.07);
+}
+
+BOOST_AUTO_TEST_CASE(quantiles)
+{
+    LatencyHistogram h;
+    for (uint64_t i = 1; i <= 1000; i++) {h.record(i * 1000);}
+    std::vector<uint64_t> counts(LatencyHistogram::BUCKETS);
+    BOOST_CHECK_EQUAL(h.add_to(counts.data()), 500500000ull);
+
+    uint64_t p50 = LatencyHistogram::quantile(counts.data(), 0.5);
+    uint64_t p99 = LatencyHistogram::quantile(counts.data(), 0.99);
+    BOOST_CHECK_GE(p50, 500000u);
+    BOOST_CHECK_LE(p50, 500000 * 1.07);
+    BOOST_CHECK_GE(p99, 990000u);
+    BOOST_CHECK_LE(p99, 990000 * 1.07);
+}
+
+BOOST_AUTO_TEST_CASE(render)
+{
+    ServerMetrics a, b;
+    auto conn = a.open_conn("127.0.0.1:5555");
+    a.record(0x03, false, 20000, 12, 25, conn.get());
+    b.record(0x03, true, 40000, 12, 9, nullptr);
+    b.record(0x2B, true, 1000, 11, 9, nullptr);
+
+    std::ostringstream os;
+    ServerMetrics::render(os, {&a, &b});
+    std::string txt = os.str();
+    BOOST_CHECK(txt.find("modbus_requests_total{fc=\"3\"} 2\n") != std::string::npos);
+    BOOST_CHECK(txt.find("modbus_exceptions_total{fc=\"3\"} 1\n") != std::string::npos);
+    BOOST_CHECK(txt.find("modbus_exceptions_total{fc=\"other\"} 1\n") != std::string::npos);
+    BOOST_CHECK(txt.find("modbus_reply_seconds_count{fc=\"3\"} 2\n") != std::string::npos);
+    BOOST_CHECK(txt.find("modbus_connection_sent_bytes_total{peer=\"127.0.0.1:5555\"} 25\n") != std::string::npos);
+
+    a.close_conn(conn);
+    std::ostringstream again;
+    ServerMetrics::render(again, {&a, &b});
+    BOOST_CHECK(again.str().find("127.0.0.1:5555") == std::string::npos);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
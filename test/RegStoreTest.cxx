@@ -0,0 +1,244 @@
+/// @brief RegisterStore seqlock and reply encoder tests, no sockets involved
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE RegStore_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include <thread>
+#include <atomic>
+#include <unistd.h>
+
+#include "src/RegisterStore.hpp"
+#include "src/MbReply.hpp"
+
+BOOST_AUTO_TEST_SUITE(RegStore_Tests)
+
+BOOST_AUTO_TEST_CASE(read_write_range)
+{
+    RegisterStore st(10, 20, 30, 40);
+    BOOST_CHECK_EQUAL(st.count(RegTable::COILS), 10u);
+    BOOST_CHECK_EQUAL(st.count(RegTable::INPUT_REGS), 40u);
+
+    uint16_t in[3] = {7, 8, 9};
+    uint16_t out[3] = {0, 0, 0};
+    BOOST_CHECK(st.write(RegTable::HOLDING_REGS, 27, 3, in));
+    BOOST_CHECK(st.read(RegTable::HOLDING_REGS, 27, 3, out));
+    BOOST_CHECK_EQUAL(out[2], 9);
+
+    BOOST_CHECK(!st.write(RegTable::HOLDING_REGS, 28, 3, in));
+    BOOST_CHECK(!st.read(RegTable::INPUT_REGS, 40, 1, out));
+
+    BOOST_CHECK(st.set(RegTable::COILS, 3, 5));
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 3), 1);
+}
+
+/// @brief writer keeps the whole table equal to one value, reader must never see a mix
+BOOST_AUTO_TEST_CASE(snapshot_is_consistent)
+{
+    RegisterStore st(0, 0, 100, 0);
+    std::atomic<bool> done{false};
+
+    std::thread writer([&]{
+        for (uint16_t v = 1; v < 20000; v++)
+        {
+            auto b = st.batch(RegTable::HOLDING_REGS);
+            for (uint32_t i = 0; i < 100; i++) {b.set(i, v);}
+        }
+        done = true;
+    });
+
+    uint16_t out[100];
+    int torn = 0;
+    while (!done)
+    {
+        st.read(RegTable::HOLDING_REGS, 0, 100, out);
+        for (int i = 1; i < 100; i++)
+        {
+            if (out[i] != out[0]) {torn++; break;}
+        }
+    }
+    writer.join();
+    BOOST_CHECK_EQUAL(torn, 0);
+}
+
+BOOST_AUTO_TEST_CASE(reply_pdu)
+{
+    RegisterStore st(16, 0, 10, 0);
+    for (uint32_t i = 0; i < 10; i++) {st.set(RegTable::HOLDING_REGS, i, i * 3);}
+
+    uint8_t rsp[MB_MAX_PDU_LENGTH];
+    const uint8_t fc3[] = {0x03, 0x00, 0x02, 0x00, 0x02};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc3, sizeof(fc3), rsp), 6u);
+    BOOST_CHECK_EQUAL(rsp[1], 4);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 2), 6);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 4), 9);
+
+    const uint8_t fc6[] = {0x06, 0x00, 0x01, 0x12, 0x34};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc6, sizeof(fc6), rsp), 5u);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 1), 0x1234);
+
+    const uint8_t fc15[] = {0x0F, 0x00, 0x00, 0x00, 0x0A, 0x02, 0x05, 0x02};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc15, sizeof(fc15), rsp), 5u);
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 0), 1);
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 1), 0);
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 9), 1);
+
+    const uint8_t fc1[] = {0x01, 0x00, 0x00, 0x00, 0x0A};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc1, sizeof(fc1), rsp), 4u);
+    BOOST_CHECK_EQUAL(rsp[2], 0x05);
+    BOOST_CHECK_EQUAL(rsp[3], 0x02);
+
+    const uint8_t bad_addr[] = {0x03, 0x00, 0x09, 0x00, 0x02};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, bad_addr, sizeof(bad_addr), rsp), 2u);
+    BOOST_CHECK_EQUAL(rsp[0], 0x83);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_ADDRESS);
+
+    const uint8_t bad_qty[] = {0x03, 0x00, 0x00, 0x00, 0x7E};
+    mb_reply_pdu(st, bad_qty, sizeof(bad_qty), rsp);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_VALUE);
+
+    const uint8_t bad_fc[] = {0x2B, 0x0E, 0x01, 0x00, 0x00};
+    mb_reply_pdu(st, bad_fc, sizeof(bad_fc), rsp);
+    BOOST_CHECK_EQUAL(rsp[0], 0xAB);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_FUNCTION);
+
+    // short requests: unknown codes are still Illegal Function, known ones Illegal Data Value
+    const uint8_t short_fc[] = {0x2B, 0x0E, 0x01};
+    mb_reply_pdu(st, short_fc, sizeof(short_fc), rsp);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_FUNCTION);
+    const uint8_t short_read[] = {0x03, 0x00, 0x00};
+    mb_reply_pdu(st, short_read, sizeof(short_read), rsp);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_VALUE);
+    BOOST_CHECK_EQUAL(MB_MAX_ADU_LENGTH, 260u);
+}
+
+BOOST_AUTO_TEST_CASE(reply_server_id_and_mask_write)
+{
+    RegisterStore st(0, 0, 10, 0);
+    st.set(RegTable::HOLDING_REGS, 4, 0x12);
+
+    uint8_t rsp[MB_MAX_PDU_LENGTH];
+    const uint8_t fc17[] = {0x11};
+    size_t n = mb_reply_pdu(st, fc17, sizeof(fc17), rsp);
+    BOOST_REQUIRE_EQUAL(n, 4u + sizeof(MB_SERVER_ID_TEXT) - 1);
+    BOOST_CHECK_EQUAL(rsp[0], 0x11);
+    BOOST_CHECK_EQUAL(rsp[1], n - 2);
+    BOOST_CHECK_EQUAL(rsp[2], MB_SERVER_ID);
+    BOOST_CHECK_EQUAL(rsp[3], 0xFF);
+    BOOST_CHECK_EQUAL(std::string((const char *)rsp + 4, n - 4), MB_SERVER_ID_TEXT);
+
+    // spec example: 0x12 AND 0xF2 OR (0x25 AND NOT 0xF2) = 0x17
+    const uint8_t fc22[] = {0x16, 0x00, 0x04, 0x00, 0xF2, 0x00, 0x25};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc22, sizeof(fc22), rsp), 7u);
+    BOOST_CHECK_EQUAL_COLLECTIONS(rsp, rsp + 7, fc22, fc22 + 7);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 4), 0x17);
+
+    const uint8_t fc22_bad_addr[] = {0x16, 0x00, 0x0A, 0x00, 0xF2, 0x00, 0x25};
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc22_bad_addr, sizeof(fc22_bad_addr), rsp), 2u);
+    BOOST_CHECK_EQUAL(rsp[0], 0x96);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_ADDRESS);
+
+    const uint8_t fc22_short[] = {0x16, 0x00, 0x04, 0x00, 0xF2};
+    mb_reply_pdu(st, fc22_short, sizeof(fc22_short), rsp);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_VALUE);
+}
+
+BOOST_AUTO_TEST_CASE(reply_adu_keeps_mbap)
+{
+    RegisterStore st(0, 0, 0, 8);
+    st.set(RegTable::INPUT_REGS, 7, 0xBEEF);
+
+    const uint8_t req[] = {0x12, 0x34, 0x00, 0x00, 0x00, 0x06, 0x11, 0x04, 0x00, 0x07, 0x00, 0x01};
+    uint8_t rsp[MB_MAX_ADU_LENGTH];
+    BOOST_REQUIRE_EQUAL(mb_reply_adu(st, req, sizeof(req), rsp), 11u);
+    BOOST_CHECK_EQUAL(mb_get16(rsp), 0x1234);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 4), 5);
+    BOOST_CHECK_EQUAL(rsp[6], 0x11);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 9), 0xBEEF);
+}
+
+BOOST_AUTO_TEST_CASE(sparse_tables)
+{
+    RegTableSpec spec[4] = {RegTableSpec::parse("16"), RegTableSpec::parse("0"),
+                            RegTableSpec::parse("40000..40099,40200"), RegTableSpec::parse("30000..30009,65530..65535")};
+    RegisterStore st(spec);
+    BOOST_CHECK(!st.sparse(RegTable::COILS));
+    BOOST_CHECK(st.sparse(RegTable::HOLDING_REGS));
+    BOOST_CHECK(st.in_range(RegTable::HOLDING_REGS, 40000, 100));
+    BOOST_CHECK(!st.in_range(RegTable::HOLDING_REGS, 40000, 101));
+    BOOST_CHECK(!st.in_range(RegTable::HOLDING_REGS, 39999, 1));
+    BOOST_CHECK(st.in_range(RegTable::HOLDING_REGS, 40200, 1));
+    BOOST_CHECK(!st.in_range(RegTable::HOLDING_REGS, 40199, 2));
+    BOOST_CHECK(st.in_range(RegTable::INPUT_REGS, 65530, 6));
+
+    // nothing written, nothing allocated, reads are zero
+    BOOST_CHECK_EQUAL(st.used_blocks(RegTable::HOLDING_REGS), 0u);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 40050), 0);
+
+    uint16_t in[4] = {1, 2, 3, 4};
+    BOOST_CHECK(st.write(RegTable::HOLDING_REGS, 40062, 4, in)); // crosses a 64 block border
+    BOOST_CHECK_EQUAL(st.used_blocks(RegTable::HOLDING_REGS), 2u);
+    uint16_t out[4] = {};
+    BOOST_CHECK(st.read(RegTable::HOLDING_REGS, 40062, 4, out));
+    BOOST_CHECK_EQUAL(out[3], 4);
+    BOOST_CHECK(!st.write(RegTable::HOLDING_REGS, 40150, 1, in));
+    BOOST_CHECK(!st.set(RegTable::HOLDING_REGS, 0, 1));
+    BOOST_CHECK_EQUAL(st.used_blocks(RegTable::HOLDING_REGS), 2u);
+
+    uint8_t rsp[MB_MAX_PDU_LENGTH];
+    const uint8_t fc3[] = {0x03, 0x9C, 0x7E, 0x00, 0x02}; // 40062
+    BOOST_REQUIRE_EQUAL(mb_reply_pdu(st, fc3, sizeof(fc3), rsp), 6u);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 4), 2);
+    const uint8_t hole[] = {0x03, 0x9C, 0xD4, 0x00, 0x01}; // 40148
+    mb_reply_pdu(st, hole, sizeof(hole), rsp);
+    BOOST_CHECK_EQUAL(rsp[0], 0x83);
+    BOOST_CHECK_EQUAL(rsp[1], MB_EX_ILLEGAL_DATA_ADDRESS);
+
+    uint64_t g = st.range_gen(RegTable::HOLDING_REGS, 40062, 4);
+    st.clear(RegTable::HOLDING_REGS);
+    BOOST_CHECK_EQUAL(st.used_blocks(RegTable::HOLDING_REGS), 0u);
+    BOOST_CHECK(st.range_gen(RegTable::HOLDING_REGS, 40062, 4) != g);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 40063), 0);
+    BOOST_CHECK(st.in_range(RegTable::HOLDING_REGS, 40000, 100));
+    BOOST_CHECK(st.set(RegTable::HOLDING_REGS, 40000, 5)); // reuses a block that held data
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 40063), 0);
+    BOOST_CHECK_EQUAL(st.used_blocks(RegTable::HOLDING_REGS), 1u);
+
+    BOOST_CHECK_THROW(RegTableSpec::parse("5..3"), std::invalid_argument);
+    BOOST_CHECK_THROW(RegTableSpec::parse("65537"), std::invalid_argument);
+}
+
+/// @brief second mapping plays the external process
+BOOST_AUTO_TEST_CASE(shared_map_attach)
+{
+    const std::string path = "/tmp/RegStoreTest_" + std::to_string(getpid());
+    {
+        RegisterStore srv(path, 16, 0, 65536, 4);
+        auto ext = RegisterStore::attach(path);
+        BOOST_CHECK(ext->shared());
+        BOOST_CHECK_EQUAL(ext->count(RegTable::HOLDING_REGS), 65536u);
+
+        uint64_t g = srv.range_gen(RegTable::HOLDING_REGS, 65530, 6);
+        uint16_t in[2] = {0xDEAD, 0xBEEF};
+        BOOST_CHECK(ext->write(RegTable::HOLDING_REGS, 65534, 2, in));
+        BOOST_CHECK_EQUAL(srv.get(RegTable::HOLDING_REGS, 65535), 0xBEEF);
+        BOOST_CHECK(srv.range_gen(RegTable::HOLDING_REGS, 65530, 6) != g);
+
+        srv.set(RegTable::COILS, 15, 1);
+        BOOST_CHECK_EQUAL(ext->get(RegTable::COILS, 15), 1);
+    }
+    {
+        RegTableSpec spec[4] = {RegTableSpec::parse("0"), RegTableSpec::parse("0"), RegTableSpec::parse("40000..40009"), RegTableSpec::parse("0")};
+        RegisterStore srv(path, spec);
+        auto ext = RegisterStore::attach(path);
+        BOOST_CHECK(ext->sparse(RegTable::HOLDING_REGS));
+        BOOST_CHECK(ext->set(RegTable::HOLDING_REGS, 40009, 9));
+        BOOST_CHECK(!ext->set(RegTable::HOLDING_REGS, 40010, 9));
+        BOOST_CHECK_EQUAL(srv.get(RegTable::HOLDING_REGS, 40009), 9);
+        BOOST_CHECK_EQUAL(srv.used_blocks(RegTable::HOLDING_REGS), 1u);
+    }
+    BOOST_CHECK(RegisterStore::remove(path));
+    BOOST_CHECK_THROW(RegisterStore::attach(path), std::ios_base::failure);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
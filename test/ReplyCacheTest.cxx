@@ -0,0 +1,112 @@
+/// @brief ReplyCache hits, transaction id patching, generation invalidation and LRU eviction
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE ReplyCache_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include "src/ReplyCache.hpp"
+
+BOOST_AUTO_TEST_SUITE(ReplyCache_Tests)
+
+/// @brief FC 3 read of qty registers at start, transaction id tid
+static void fc3(uint8_t * req, const uint16_t & tid, const uint16_t & start, const uint16_t & qty)
+{
+    const uint8_t tpl[] = {0, 0, 0x00, 0x00, 0x00, 0x06, 0x01, 0x03, 0, 0, 0, 0};
+    std::memcpy(req, tpl, sizeof(tpl));
+    mb_put16(req, tid);
+    mb_put16(req + 8, start);
+    mb_put16(req + 10, qty);
+}
+
+BOOST_AUTO_TEST_CASE(hit_patches_tid)
+{
+    RegisterStore st(0, 0, 10, 0);
+    st.set(RegTable::HOLDING_REGS, 2, 0xCAFE);
+    ReplyCache cache(4);
+    ReplyCache::Outcome res;
+    uint8_t req[12], rsp[MB_MAX_ADU_LENGTH];
+
+    fc3(req, 1, 2, 1);
+    BOOST_REQUIRE_EQUAL(cache.reply(st, req, sizeof(req), rsp, res), 11u);
+    BOOST_CHECK(res == ReplyCache::Outcome::MISS);
+
+    fc3(req, 0xABCD, 2, 1);
+    BOOST_REQUIRE_EQUAL(cache.reply(st, req, sizeof(req), rsp, res), 11u);
+    BOOST_CHECK(res == ReplyCache::Outcome::HIT);
+    BOOST_CHECK_EQUAL(mb_get16(rsp), 0xABCD);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 9), 0xCAFE);
+}
+
+BOOST_AUTO_TEST_CASE(write_invalidates)
+{
+    RegisterStore st(0, 0, 200, 0);
+    ReplyCache cache(4);
+    ReplyCache::Outcome res;
+    uint8_t req[12], rsp[MB_MAX_ADU_LENGTH];
+
+    fc3(req, 1, 60, 8);
+    cache.reply(st, req, sizeof(req), rsp, res);
+
+    // other block, entry stays valid
+    st.set(RegTable::HOLDING_REGS, 150, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::HIT);
+
+    // second block of the range
+    st.set(RegTable::HOLDING_REGS, 65, 0x1234);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::MISS);
+    BOOST_CHECK_EQUAL(mb_get16(rsp + 9 + 5 * 2), 0x1234);
+
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::HIT);
+}
+
+BOOST_AUTO_TEST_CASE(lru_eviction)
+{
+    RegisterStore st(0, 0, 10, 0);
+    ReplyCache cache(2);
+    ReplyCache::Outcome res;
+    uint8_t req[12], rsp[MB_MAX_ADU_LENGTH];
+
+    fc3(req, 1, 0, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    fc3(req, 1, 1, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    // touch 0 so 1 is the oldest
+    fc3(req, 1, 0, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::HIT);
+    fc3(req, 1, 2, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK_EQUAL(cache.size(), 2u);
+
+    fc3(req, 1, 0, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::HIT);
+    fc3(req, 1, 1, 1);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::MISS);
+}
+
+BOOST_AUTO_TEST_CASE(bypass_and_exceptions)
+{
+    RegisterStore st(0, 0, 10, 0);
+    ReplyCache cache(4);
+    ReplyCache::Outcome res;
+    uint8_t rsp[MB_MAX_ADU_LENGTH];
+
+    const uint8_t fc6[] = {0x00, 0x01, 0x00, 0x00, 0x00, 0x06, 0x01, 0x06, 0x00, 0x01, 0x00, 0x07};
+    cache.reply(st, fc6, sizeof(fc6), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::BYPASS);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 1), 7);
+
+    uint8_t req[12];
+    fc3(req, 1, 9, 2);
+    cache.reply(st, req, sizeof(req), rsp, res);
+    BOOST_CHECK(res == ReplyCache::Outcome::BYPASS);
+    BOOST_CHECK_EQUAL(rsp[7], 0x83);
+    BOOST_CHECK_EQUAL(cache.size(), 0u);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,265 @@
+/// @brief ephemeral ports, instant stop with idle clients attached and the fixture pool
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE ServerPool_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include "src/ServerPool.hpp"
+
+BOOST_AUTO_TEST_SUITE(ServerPool_Tests)
+
+using test_clock = std::chrono::steady_clock;
+
+static int connect_to(const int & port)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    sockaddr_in sa{};
+    sa.sin_family = AF_INET;
+    sa.sin_port = htons(port);
+    sa.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    BOOST_REQUIRE_EQUAL(connect(fd, (sockaddr *)&sa, sizeof(sa)), 0);
+    return fd;
+}
+
+/// @brief one request on an open connection, returns the first data register of the reply
+static uint16_t transact(const int & fd, const uint8_t & fc, const uint16_t & addr, const uint16_t & val)
+{
+    uint8_t req[12] = {0x00, 0x01, 0x00, 0x00, 0x00, 0x06, 0x01, fc};
+    mb_put16(req + 8, addr);
+    mb_put16(req + 10, val);
+    send(fd, req, sizeof(req), 0);
+    uint8_t rsp[MB_MAX_ADU_LENGTH];
+    ssize_t n = recv(fd, rsp, sizeof(rsp), 0);
+    BOOST_REQUIRE_GE(n, 11);
+    return fc == 0x03 ? mb_get16(rsp + 9) : mb_get16(rsp + 10);
+}
+
+static double stop_ms(dumb_Mserver & srv)
+{
+    auto t0 = test_clock::now();
+    srv.stop();
+    return std::chrono::duration<double, std::milli>(test_clock::now() - t0).count();
+}
+
+BOOST_AUTO_TEST_CASE(port_zero_and_instant_stop)
+{
+    dumb_Mserver single;
+    single.set_context("127.0.0.1", 0);
+    single.ezTreadstart();
+    int port = single.get_port();
+    BOOST_REQUIRE_GT(port, 0);
+    int fd = connect_to(port);
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 2, 1), 6);
+    BOOST_CHECK_LT(stop_ms(single), 50.0); // client still connected and idle
+    BOOST_CHECK_EQUAL(single.get_port(), 0);
+    close(fd);
+
+    dumb_Mserver multi;
+    multi.set_context("127.0.0.1", 0);
+    multi.set_workers(2);
+    multi.ezTreadstart();
+    BOOST_REQUIRE_GT(multi.get_port(), 0);
+    fd = connect_to(multi.get_port());
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 3, 1), 9);
+    BOOST_CHECK_LT(stop_ms(multi), 50.0);
+    close(fd);
+
+    dumb_Mserver never_started;
+    BOOST_CHECK_LT(stop_ms(never_started), 50.0);
+}
+
+BOOST_AUTO_TEST_CASE(scrape_while_restarting)
+{
+    dumb_Mserver srv;
+    srv.set_context("127.0.0.1", 0);
+    srv.set_workers(4);
+    std::atomic<bool> done{false};
+    size_t scrapes = 0;
+    std::thread scraper([&]
+    {
+        while (!done)
+        {
+            srv.get_stats();
+            scrapes += srv.metrics_text().size() > 0;
+        }
+    });
+    for (int i = 0; i < 20; i++)
+    {
+        srv.ezTreadstart(); // workers are rebuilt under the scraper's feet
+        srv.stop();
+    }
+    done = true;
+    scraper.join();
+    BOOST_CHECK_GT(scrapes, 0u);
+}
+
+BOOST_AUTO_TEST_CASE(sparse_layout_not_seeded)
+{
+    dumb_Mserver srv;
+    srv.set_context("127.0.0.1", 0);
+    srv.setRegLayout("16", "0", "0..9,40000..49999", "20");
+    srv.set_simulation("");
+    srv.ezTreadstart();
+    BOOST_CHECK_EQUAL(srv.regs().used_blocks(RegTable::HOLDING_REGS), 0u);
+    BOOST_CHECK_EQUAL(srv.regs().get(RegTable::HOLDING_REGS, 40000), 0);
+    BOOST_CHECK_EQUAL(srv.regs().get(RegTable::INPUT_REGS, 3), 6); // dense tables still get the pattern
+    int fd = connect_to(srv.get_port());
+    transact(fd, 0x06, 40001, 7);
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 40001, 1), 7);
+    BOOST_CHECK_EQUAL(srv.regs().used_blocks(RegTable::HOLDING_REGS), 1u);
+    close(fd);
+    srv.stop();
+}
+
+/// @brief n reads of 125 registers sent in one go before reading anything, every reply must come back whole and in order
+static void slow_reader(dumb_Mserver & srv, const uint16_t & n)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    int small = 4096;
+    setsockopt(fd, SOL_SOCKET, SO_RCVBUF, &small, sizeof(small));
+    timeval tv{2, 0};
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+    sockaddr_in sa{};
+    sa.sin_family = AF_INET;
+    sa.sin_port = htons(srv.get_port());
+    sa.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    BOOST_REQUIRE_EQUAL(connect(fd, (sockaddr *)&sa, sizeof(sa)), 0);
+
+    std::thread sender([&]
+    {
+        std::vector<uint8_t> reqs(n * 12);
+        for (uint16_t i = 0; i < n; i++)
+        {
+            uint8_t * q = reqs.data() + i * 12;
+            const uint8_t head[8] = {0x00, 0x00, 0x00, 0x00, 0x00, 0x06, 0x01, 0x03};
+            std::copy_n(head, 8, q);
+            mb_put16(q, i);
+            mb_put16(q + 8, 0);
+            mb_put16(q + 10, MB_MAX_READ_REGISTERS);
+        }
+        for (size_t off = 0; off < reqs.size();)
+        {
+            ssize_t r = send(fd, reqs.data() + off, reqs.size() - off, MSG_NOSIGNAL);
+            if (r <= 0) {break;}
+            off += r;
+        }
+    });
+    std::this_thread::sleep_for(std::chrono::milliseconds(200)); // server runs into a full socket meanwhile
+
+    const size_t rsp_len = 9 + 2 * MB_MAX_READ_REGISTERS;
+    std::vector<uint8_t> rsp(n * rsp_len);
+    size_t got = 0;
+    while (got < rsp.size())
+    {
+        ssize_t r = recv(fd, rsp.data() + got, rsp.size() - got, 0);
+        if (r <= 0) {break;}
+        got += r;
+    }
+    sender.join();
+    BOOST_REQUIRE_EQUAL(got, rsp.size());
+    for (uint16_t i = 0; i < n; i++)
+    {
+        BOOST_REQUIRE_EQUAL(mb_get16(rsp.data() + i * rsp_len), i);
+        BOOST_REQUIRE_EQUAL(mb_get16(rsp.data() + i * rsp_len + 9 + 2 * 124), 124 * 3);
+    }
+    close(fd);
+}
+
+BOOST_AUTO_TEST_CASE(slow_reader_gets_every_reply)
+{
+    for (int mode : {0, 1, 2})
+    {
+        dumb_Mserver srv;
+        srv.set_context("127.0.0.1", 0);
+        srv.setRegSizes(20, 20, 200, 20); // 200 holding registers
+        srv.set_simulation("");
+        if (mode == 0) {srv.set_low_latency(-1);}
+        else if (mode == 1) {srv.set_pipelined(true);}
+        else {srv.set_multi_client(4);}
+        srv.ezTreadstart();
+        slow_reader(srv, 30000);
+        srv.stop();
+    }
+}
+
+BOOST_AUTO_TEST_CASE(stalled_clients_dont_block_others)
+{
+    dumb_Mserver srv;
+    srv.set_context("127.0.0.1", 0);
+    srv.set_multi_client(4);
+    srv.ezTreadstart();
+
+    int half = connect_to(srv.get_port());
+    const uint8_t part[6] = {0x00, 0x01, 0x00, 0x00, 0x00, 0x06}; // header only, the rest never comes
+    send(half, part, sizeof(part), 0);
+
+    int deaf = connect_to(srv.get_port());
+    std::vector<uint8_t> reqs(20000 * 12);
+    for (size_t i = 0; i < reqs.size(); i += 12)
+    {
+        const uint8_t q[12] = {0x00, 0x00, 0x00, 0x00, 0x00, 0x06, 0x01, 0x03, 0x00, 0x00, 0x00, 0x7D};
+        std::copy_n(q, 12, reqs.data() + i);
+    }
+    send(deaf, reqs.data(), reqs.size(), MSG_DONTWAIT | MSG_NOSIGNAL); // never reads the replies
+    std::this_thread::sleep_for(std::chrono::milliseconds(100));
+
+    int fd = connect_to(srv.get_port());
+    timeval tv{2, 0};
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv));
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 3, 1), 9);
+    BOOST_CHECK_LT(stop_ms(srv), 50.0);
+    close(fd);
+    close(deaf);
+    close(half);
+}
+
+BOOST_AUTO_TEST_CASE(pool_resets_maps)
+{
+    ServerPool pool(2);
+    BOOST_CHECK_EQUAL(pool.size(), 2u);
+    int port;
+    {
+        auto srv = pool.acquire();
+        port = srv.port();
+        int fd = connect_to(port);
+        BOOST_CHECK_EQUAL(transact(fd, 0x06, 4, 999), 999);
+        BOOST_CHECK_EQUAL(srv->regs().get(RegTable::HOLDING_REGS, 4), 999);
+        close(fd);
+        BOOST_CHECK_EQUAL(pool.available(), 1u);
+    }
+    BOOST_CHECK_EQUAL(pool.available(), 2u);
+
+    auto t0 = test_clock::now();
+    for (int i = 0; i < 1000; i++) {auto srv = pool.acquire();}
+    double us = std::chrono::duration<double, std::micro>(test_clock::now() - t0).count() / 1000;
+    BOOST_TEST_MESSAGE("acquire + reset: " << us << " us");
+    BOOST_CHECK_LT(us, 1000.0);
+
+    auto a = pool.acquire(), b = pool.acquire(), c = pool.acquire();
+    BOOST_CHECK_EQUAL(pool.size(), 3u);
+    auto & same = a.port() == port ? a : b;
+    BOOST_CHECK_EQUAL(same.port(), port);
+    int fd = connect_to(port);
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 4, 1), 12);
+    close(fd);
+}
+
+BOOST_AUTO_TEST_CASE(pool_resets_sparse_maps)
+{
+    ServerPool pool(1, [](dumb_Mserver & s) {s.setRegLayout("16", "0", "40000..40099", "20");});
+    {
+        auto srv = pool.acquire();
+        int fd = connect_to(srv.port());
+        BOOST_CHECK_EQUAL(transact(fd, 0x06, 40010, 999), 999);
+        close(fd);
+        BOOST_CHECK_EQUAL(srv->regs().used_blocks(RegTable::HOLDING_REGS), 1u);
+    }
+    auto srv = pool.acquire();
+    BOOST_CHECK_EQUAL(pool.size(), 1u);
+    BOOST_CHECK_EQUAL(srv->regs().used_blocks(RegTable::HOLDING_REGS), 0u);
+    int fd = connect_to(srv.port());
+    BOOST_CHECK_EQUAL(transact(fd, 0x03, 40010, 1), 0);
+    close(fd);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
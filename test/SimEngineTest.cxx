@@ -0,0 +1,118 @@
+/// @brief SimEngine profile parsing and waveforms, ticks driven by hand
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE SimEngine_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include <thread>
+
+#include "src/SimEngine.hpp"
+
+BOOST_AUTO_TEST_SUITE(SimEngine_Tests)
+
+BOOST_AUTO_TEST_CASE(waveforms)
+{
+    RegisterStore st(8, 0, 20, 20);
+    SimEngine sim;
+    sim.load_string(
+        "# comment line\n"
+        "tick_us 500\n"
+        "hr 0 const value=1234\n"
+        "hr 1 ramp from=0 to=100 period_ms=10\n"
+        "ir 0..3 sine offset=1000 amp=500 period_ms=4 phase_step_deg=90\n"
+        "ir 4 counter from=10 step=2 every_ms=1 wrap=20\n"
+        "co 0..1 steps values=1,0 every_ms=1  # trailing comment\n"
+        "ir 5..6 mirror src=hr:0 scale=2 offset=1\n");
+    BOOST_CHECK_EQUAL(sim.points(), 11u);
+    BOOST_CHECK_EQUAL(sim.tick_period().count(), 500);
+    BOOST_REQUIRE_NO_THROW(sim.check(st));
+
+    sim.step(st, 0);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 0), 1234);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 1), 0);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 0), 1000);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 1), 1500);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 3), 500);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 4), 10);
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 0), 1);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 5), 2469);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 6), 1); // hr 1 was 0
+
+    sim.step(st, 5000);
+    BOOST_CHECK_EQUAL(st.get(RegTable::HOLDING_REGS, 1), 50);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 4), 0); // 10 + 2*5 wraps at 20
+    BOOST_CHECK_EQUAL(st.get(RegTable::COILS, 1), 0);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 6), 101);
+}
+
+BOOST_AUTO_TEST_CASE(walk_stays_in_bounds)
+{
+    RegisterStore st(0, 0, 0, 10);
+    SimEngine sim;
+    sim.load_string("ir 0..9 walk from=5 min=0 max=10 step=3 seed=7\n");
+    for (int i = 0; i < 1000; i++)
+    {
+        sim.step(st, i * 1000.0);
+        for (uint32_t a = 0; a < 10; a++) {BOOST_REQUIRE_LE(st.get(RegTable::INPUT_REGS, a), 10);}
+    }
+}
+
+BOOST_AUTO_TEST_CASE(bad_profiles)
+{
+    SimEngine sim;
+    BOOST_CHECK_THROW(sim.load_string("xx 0 const value=1\n"), std::invalid_argument);
+    BOOST_CHECK_THROW(sim.load_string("hr 0 sine amp=1\n"), std::invalid_argument);
+    BOOST_CHECK_THROW(sim.load_string("hr 5..2 const value=1\n"), std::invalid_argument);
+    BOOST_CHECK_THROW(sim.load_string("hr 0 steps every_ms=1\n"), std::invalid_argument);
+    BOOST_CHECK_THROW(sim.load_string("hr 0 const value=abc\n"), std::invalid_argument);
+    try
+    {
+        sim.load_string("\n\nhr 0 bogus\n");
+        BOOST_FAIL("no throw");
+    }
+    catch (const std::invalid_argument & e)
+    {
+        BOOST_CHECK(std::string(e.what()).find("line 3") != std::string::npos);
+    }
+
+    RegisterStore st(0, 0, 4, 0);
+    SimEngine out_of_map;
+    out_of_map.load_string("hr 2..5 const value=1\n");
+    BOOST_CHECK_THROW(out_of_map.start(st), std::out_of_range);
+}
+
+BOOST_AUTO_TEST_CASE(default_profile_keeps_seed)
+{
+    RegisterStore st(0, 0, 0, 10);
+    st.set(RegTable::INPUT_REGS, 6, 12); // what DumbModbus seeds, the first tick must not change it
+    SimEngine sim;
+    sim.load_string(SimEngine::DEFAULT_PROFILE);
+    uint64_t g = st.range_gen(RegTable::INPUT_REGS, 0, 10);
+    sim.step(st, 0);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 6), 12);
+    sim.step(st, 50000);
+    BOOST_CHECK_EQUAL(st.range_gen(RegTable::INPUT_REGS, 0, 10), g); // nothing changed, cached replies stay valid
+    sim.step(st, 100000);
+    BOOST_CHECK_GT(st.range_gen(RegTable::INPUT_REGS, 0, 10), g);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 6), 30);
+    sim.step(st, 200000);
+    BOOST_CHECK_EQUAL(st.get(RegTable::INPUT_REGS, 6), 12);
+}
+
+BOOST_AUTO_TEST_CASE(ticks_on_own_thread)
+{
+    RegisterStore st(0, 0, 0, 10);
+    SimEngine sim;
+    sim.load_string(SimEngine::DEFAULT_PROFILE);
+    sim.load_string("tick_us 200\nir 0 counter every_ms=0.2 wrap=65536\n");
+    uint64_t g = st.range_gen(RegTable::INPUT_REGS, 0, 1);
+    sim.start(st);
+    std::this_thread::sleep_for(std::chrono::milliseconds(20));
+    sim.stop();
+    BOOST_CHECK_GT(st.get(RegTable::INPUT_REGS, 0), 10);
+    BOOST_CHECK_GT(st.range_gen(RegTable::INPUT_REGS, 0, 1), g);
+    uint16_t v = st.get(RegTable::INPUT_REGS, 6);
+    BOOST_CHECK(v == 30 || v == 12);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,146 @@
+/// @brief TaskScheduler coalescing, result splitting and plan caching against an in-memory device
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE TaskScheduler_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include <memory>
+
+#include "src/TaskScheduler.hpp"
+
+BOOST_AUTO_TEST_SUITE(TaskScheduler_Tests)
+
+/// @brief holding regs hold addr * 2, coils addr % 3 == 0, addresses from 1000 on are undefined
+struct Device
+{
+    uint16_t hr[65536];
+    uint16_t co[65536 / 16] = {};
+    size_t frames = 0;
+    Device() {for (uint32_t a = 0; a < 65536; a++) {hr[a] = a * 2; if (a % 3 == 0) {co[a >> 4] |= 1 << (a & 15);}}}
+
+    int16_t operator()(char op, uint16_t start, uint16_t qty, uint16_t * buf)
+    {
+        frames++;
+        if (start + qty > 1000) {return MB_EX_ILLEGAL_DATA_ADDRESS;}
+        for (uint32_t i = 0; i < qty; i++)
+        {
+            uint32_t a = start + i;
+            if (op == 'R') {buf[i] = hr[a];}
+            if (op == 'W') {hr[a] = buf[i];}
+            if (op == 'c')
+            {
+                bool v = (co[a >> 4] >> (a & 15)) & 1;
+                buf[i >> 4] = (buf[i >> 4] & ~(1 << (i & 15))) | (v << (i & 15));
+            }
+        }
+        return DataBucket::OK;
+    }
+};
+
+static std::vector<DataBucket *> ptrs(std::vector<std::unique_ptr<DataBucket>> & v)
+{
+    std::vector<DataBucket *> p;
+    for (auto & t : v) {p.push_back(t.get());}
+    return p;
+}
+
+BOOST_AUTO_TEST_CASE(scattered_polling_set)
+{
+    auto dev = std::make_unique<Device>();
+    TaskScheduler sched(16);
+    std::vector<std::unique_ptr<DataBucket>> tasks;
+    for (int i = 0; i < 300; i++) {tasks.emplace_back(std::make_unique<DataBucket>('R', (i * 37) % 900, 1 + i % 3));}
+    auto p = ptrs(tasks);
+
+    size_t sent = sched.run(p.data(), p.size(), *dev);
+    BOOST_CHECK_LE(sent, 10u);
+    for (auto & t : tasks)
+    {
+        uint16_t v[3];
+        BOOST_REQUIRE(t->read(v));
+        for (int i = 0; i < t->size(); i++) {BOOST_REQUIRE_EQUAL(v[i], uint16_t((t->startReg + i) * 2));}
+    }
+
+    for (auto & t : tasks) {t->reset();}
+    BOOST_CHECK_EQUAL(sched.run(p.data(), p.size(), *dev), sent);
+    BOOST_CHECK_EQUAL(sched.plan_hits(), 1u);
+    BOOST_CHECK_EQUAL(sched.cached_plans(), 1u);
+    for (const auto & f : sched.plan(p.data(), p.size()).frames) {BOOST_CHECK_LE(f.qty, MB_MAX_READ_REGISTERS);}
+}
+
+BOOST_AUTO_TEST_CASE(ordering_and_writes)
+{
+    auto dev = std::make_unique<Device>();
+    TaskScheduler sched(0);
+    uint16_t a[3] = {1, 2, 3}, b[2] = {9, 9};
+    DataBucket before('R', 10, 4), w1('W', 10, 3), w2('W', 12, 2), after('R', 10, 4), far('R', 40, 1);
+    w1.write(a, 3);
+    w2.write(b, 2);
+    DataBucket * batch[] = {&before, &w1, &w2, &after, &far};
+
+    BOOST_CHECK_EQUAL(sched.run(batch, 5, *dev), 4u); // read | merged write | two reads, no gap allowed
+    uint16_t v[4];
+    BOOST_CHECK(before.read(v));
+    BOOST_CHECK_EQUAL(v[2], 24);
+    BOOST_CHECK(after.read(v));
+    BOOST_CHECK_EQUAL(v[0], 1);
+    BOOST_CHECK_EQUAL(v[2], 9); // w2 came later
+    BOOST_CHECK_EQUAL(v[3], 9);
+    BOOST_CHECK_EQUAL(v[1], 2);
+}
+
+BOOST_AUTO_TEST_CASE(overlapping_writes_past_the_limit)
+{
+    auto dev = std::make_unique<Device>();
+    TaskScheduler sched(0);
+    uint16_t ones[50], twos[120];
+    std::fill_n(ones, 50, 1);
+    std::fill_n(twos, 120, 2);
+    DataBucket w1('W', 100, 50), w2('W', 10, 120); // 10..149 does not fit one frame
+    w1.write(ones, 50);
+    w2.write(twos, 120);
+    DataBucket * batch[] = {&w1, &w2};
+
+    BOOST_CHECK_EQUAL(sched.run(batch, 2, *dev), 2u);
+    BOOST_CHECK_EQUAL(dev->hr[10], 2);
+    BOOST_CHECK_EQUAL(dev->hr[100], 2); // w2 was submitted later
+    BOOST_CHECK_EQUAL(dev->hr[129], 2);
+    BOOST_CHECK_EQUAL(dev->hr[130], 1);
+    BOOST_CHECK_EQUAL(dev->hr[149], 1);
+
+    // submitted out of address order but touching: still one frame
+    DataBucket w3('W', 20, 5), w4('W', 10, 10);
+    w3.write(ones, 5);
+    w4.write(twos, 10);
+    DataBucket * joined[] = {&w3, &w4};
+    BOOST_CHECK_EQUAL(sched.run(joined, 2, *dev), 1u);
+    BOOST_CHECK_EQUAL(dev->hr[19], 2);
+    BOOST_CHECK_EQUAL(dev->hr[20], 1);
+}
+
+BOOST_AUTO_TEST_CASE(bits_limits_and_fallback)
+{
+    auto dev = std::make_unique<Device>();
+    TaskScheduler sched(16);
+    DataBucket c1('c', 5, 20), c2('c', 25, 30);
+    DataBucket * coils[] = {&c1, &c2};
+    BOOST_CHECK_EQUAL(sched.run(coils, 2, *dev), 1u);
+    uint16_t v[2];
+    BOOST_CHECK(c2.read(v));
+    for (int i = 0; i < 30; i++) {BOOST_CHECK_EQUAL((v[i >> 4] >> (i & 15)) & 1, (25 + i) % 3 == 0);}
+
+    DataBucket big1('R', 0, 100), big2('R', 100, 100);
+    DataBucket * bigs[] = {&big1, &big2};
+    BOOST_CHECK_EQUAL(sched.run(bigs, 2, *dev), 2u); // 200 registers do not fit one frame
+
+    // bridged read hits an undefined address, the members go again one by one
+    DataBucket ok('R', 990, 2), bad('R', 1005, 1);
+    DataBucket * mixed[] = {&ok, &bad};
+    dev->frames = 0;
+    sched.run(mixed, 2, *dev);
+    BOOST_CHECK_EQUAL(dev->frames, 3u);
+    BOOST_CHECK_EQUAL(ok.result(), DataBucket::OK);
+    BOOST_CHECK_EQUAL(bad.result(), MB_EX_ILLEGAL_DATA_ADDRESS);
+}
+
+BOOST_AUTO_TEST_SUITE_END()
@@ -0,0 +1,119 @@
+/// @brief capture file round trip, capture from a live server and replay against another one
+
+#define BOOST_TEST_DYN_LINK
+#define BOOST_TEST_MODULE TrafficLog_TestSuite
+#include <boost/test/included/unit_test.hpp>
+
+#include "src/DumbModbus.hpp"
+#include "src/TrafficReplay.hpp"
+
+#include <filesystem>
+
+BOOST_AUTO_TEST_SUITE(TrafficLog_Tests)
+
+static std::string tmp_file(const std::string & name)
+{
+    return (std::filesystem::temp_directory_path() / (name + "." + std::to_string(getpid()))).string();
+}
+
+static int connect_to(const int & port)
+{
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    sockaddr_in sa{};
+    sa.sin_family = AF_INET;
+    sa.sin_port = htons(port);
+    sa.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    BOOST_REQUIRE_EQUAL(connect(fd, (sockaddr *)&sa, sizeof(sa)), 0);
+    return fd;
+}
+
+static void transact(const int & fd, const uint16_t & tid, const uint8_t & fc, const uint16_t & addr, const uint16_t & val)
+{
+    uint8_t req[12] = {0x00, 0x00, 0x00, 0x00, 0x00, 0x06, 0x01, fc};
+    mb_put16(req, tid);
+    mb_put16(req + 8, addr);
+    mb_put16(req + 10, val);
+    send(fd, req, sizeof(req), 0);
+    uint8_t rsp[MB_MAX_ADU_LENGTH];
+    BOOST_REQUIRE_GE(recv(fd, rsp, sizeof(rsp), 0), 9);
+}
+
+BOOST_AUTO_TEST_CASE(round_trip_and_torn_tail)
+{
+    std::string file = tmp_file("mbcap_rt");
+    const uint8_t req[] = {1, 2, 3, 4, 5};
+    const uint8_t rsp[] = {9, 8, 7};
+    {
+        TrafficLog log(file);
+        TrafficLog::Writer w(log, 64);
+        auto t = std::chrono::steady_clock::now();
+        uint32_t c = log.open_conn();
+        for (int i = 0; i < 10; i++) {w.record(c, t + std::chrono::microseconds(i), req, sizeof(req), rsp, i % 2 ? sizeof(rsp) : 0);}
+    }
+    {
+        TrafficLogView view(file);
+        BOOST_REQUIRE_EQUAL(view.frames(), 10u);
+        BOOST_CHECK_GT(view.wall_ns(), 0);
+        auto f = view.frame(3);
+        BOOST_CHECK_EQUAL(f.conn, 1u);
+        BOOST_CHECK_EQUAL_COLLECTIONS(f.req, f.req + f.req_len, req, req + sizeof(req));
+        BOOST_CHECK_EQUAL_COLLECTIONS(f.rsp, f.rsp + f.rsp_len, rsp, rsp + sizeof(rsp));
+        BOOST_CHECK_EQUAL(view.frame(4).rsp_len, 0);
+        BOOST_CHECK_GT(view.frame(4).t_ns, view.frame(3).t_ns);
+    }
+    std::filesystem::resize_file(file, std::filesystem::file_size(file) - 3);
+    BOOST_CHECK_EQUAL(TrafficLogView(file).frames(), 9u);
+
+    std::filesystem::resize_file(file, 4);
+    BOOST_CHECK_THROW(TrafficLogView{file}, std::ios_base::failure);
+    std::filesystem::remove(file);
+}
+
+BOOST_AUTO_TEST_CASE(capture_and_replay)
+{
+    std::string file = tmp_file("mbcap_srv");
+    {
+        dumb_Mserver srv;
+        srv.set_context("127.0.0.1", 0);
+        srv.set_simulation("");
+        srv.set_capture(file);
+        srv.ezTreadstart();
+        int fd = connect_to(srv.get_port());
+        transact(fd, 1, 0x03, 0, 10);
+        transact(fd, 2, 0x06, 5, 1234);
+        transact(fd, 3, 0x03, 0, 10);
+        transact(fd, 4, 0x04, 0, 4);
+        close(fd);
+        srv.stop();
+    }
+
+    TrafficLogView view(file);
+    BOOST_REQUIRE_EQUAL(view.frames(), 4u);
+    TrafficReplay replay(view);
+    BOOST_CHECK_EQUAL(replay.connections(), 1u);
+
+    dumb_Mserver fresh;
+    fresh.set_context("127.0.0.1", 0);
+    fresh.set_multi_client(4, std::chrono::milliseconds(0), nullptr); // two replays, two masters
+    fresh.set_simulation("");
+    fresh.ezTreadstart();
+    auto res = replay.run("127.0.0.1", fresh.get_port());
+    BOOST_CHECK_EQUAL(res.frames, 4u);
+    BOOST_CHECK_EQUAL(res.errors, 0u);
+    BOOST_CHECK_EQUAL(res.divergences, 0u);
+    BOOST_CHECK_GT(res.rps(), 0);
+
+    // the server now starts from the written value, the first read comes out different
+    res = replay.run("127.0.0.1", fresh.get_port(), 1);
+    BOOST_CHECK_EQUAL(res.errors, 0u);
+    BOOST_CHECK_EQUAL(res.divergences, 1u);
+    BOOST_REQUIRE_EQUAL(res.samples.size(), 1u);
+    BOOST_TEST_MESSAGE(res.samples[0]);
+    fresh.stop();
+
+    auto none = replay.run("127.0.0.1", fresh.get_port());
+    BOOST_CHECK_EQUAL(none.errors, 4u);
+    std::filesystem::remove(file);
+}
+
+BOOST_AUTO_TEST_SUITE_END()